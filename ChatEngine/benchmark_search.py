@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Latency per search_internet call: bare requests.get vs the pooled SearchClient.
+
+Both run against the local stub server. The stub charges `--handshake-delay`
+once per new connection, roughly what the TCP + TLS setup to the real API
+costs, so the numbers show what keep-alive and the smaller response save.
+
+    python -m ChatEngine.benchmark_search --calls 200 --handshake-delay 0.03
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import requests
+
+from ChatEngine.search_client import SearchClient, make_session
+from ChatEngine.stub_search_server import serve_in_thread
+
+QUERIES = [
+    "Scotiabank dividend Q1 2024",
+    "RBC earnings per share last quarter",
+    "TD Bank quarterly dividend",
+    "BMO EPS 2024",
+]
+
+
+def legacy_search(endpoint, search_query):
+    """The original search_internet: new connection, full payload, JSON round trip."""
+    params = {'api_key': "stub", 'q': search_query, 'google_domain': 'google.com', 'gl': 'ca'}
+    api_result = requests.get(endpoint, params)
+    data = json.loads((json.dumps(api_result.json())))
+    organic_results = data["organic_results"][:3]
+    filtered_data = [{'link': item['link'], 'snippet': item['snippet']} for item in organic_results]
+    return json.dumps(filtered_data, indent=4)
+
+
+def time_calls(search, n_calls):
+    timings = []
+    for i in range(n_calls):
+        start = time.perf_counter()
+        search(QUERIES[i % len(QUERIES)])
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--handshake-delay", type=float, default=0.03, help="seconds per new connection")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    args = parser.parse_args()
+
+    server = serve_in_thread(latency=args.latency, handshake_delay=args.handshake_delay)
+    try:
+        client = SearchClient("stub", endpoint=server.endpoint, session=make_session())
+        runs = [
+            ("requests.get", lambda q: legacy_search(server.endpoint, q)),
+            ("SearchClient", client.search_json),
+        ]
+        print(f"{'client':>14} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'connections':>12}")
+        means = []
+        for name, search in runs:
+            before = server.counters["connections"]
+            timings = time_calls(search, args.calls)
+            means.append(timings.mean())
+            p50, p95 = np.percentile(timings, [50, 95])
+            print(f"{name:>14} {timings.mean():>9.2f} {p50:>8.2f} {p95:>8.2f} {server.counters['connections'] - before:>12}")
+        print(f"Per call latency drop: {means[0] - means[1]:.2f} ms ({means[0] / means[1]:.1f}x)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
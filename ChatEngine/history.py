@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Token-budgeted conversation history for the chat UIs.
+
+st.session_state.messages keeps the whole chat for display, but sending all of
+it on every turn makes prompt tokens (and latency) grow with the length of the
+chat until the request no longer fits the context window. ConversationHistory
+picks what is sent:
+- the leading system message(s) are always kept,
+- the most recent turns (a user message and everything answering it, so a
+  tool call is never separated from its tool results) are kept while they fit
+  `budget` tokens, with `reserve` tokens left for the answer,
+- older turns are dropped, or folded into a running summary when a summarizer
+  is given.
+
+Each message is tokenized once, its count is cached with the history. When the
+budget is exceeded the window is trimmed down to `low_water` of the budget, so
+the (optional) summarizer call happens every few turns, not on every turn.
+
+    history = st.session_state.setdefault("history", ConversationHistory(budget=4000))
+    stream = engine.stream(history.window(st.session_state.messages))
+
+    python -m ChatEngine.history --budget 2000 --turns 40
+"""
+
+import argparse
+import json
+
+import tiktoken
+
+DEFAULT_BUDGET = 4000
+DEFAULT_RESERVE = 500
+DEFAULT_LOW_WATER = 0.75
+DEFAULT_ENCODING = "cl100k_base"
+# every message is wrapped in <|start|>{role/name}\n{content}<|end|>\n
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_TOKENS = 3
+API_FIELDS = ("role", "content", "name", "tool_calls", "tool_call_id")
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SUMMARY_INSTRUCTIONS = ("Summarize the conversation below for the assistant that continues it. Keep account numbers, "
+                        "amounts, dates, queue categories, the questions asked and the answers given. "
+                        "At most 150 words.")
+
+
+def api_message(message):
+    """The fields of a message the chat API accepts, from a dict or an SDK message object."""
+    if not isinstance(message, dict):
+        message = message.model_dump(exclude_none=True) if hasattr(message, "model_dump") else vars(message)
+    return {field: message[field] for field in API_FIELDS if message.get(field) is not None}
+
+
+def make_llm_summarizer(client, model, max_tokens=250):
+    """summarizer(previous_summary, messages) -> str backed by a chat completion."""
+
+    def summarize(previous_summary, messages):
+        lines = [f"Earlier summary: {previous_summary}"] if previous_summary else []
+        for message in messages:
+            if message.get("content"):
+                lines.append(f"{message['role']}: {message['content']}")
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": "\n".join(lines)}],
+            max_tokens=max_tokens,
+            temperature=0,
+        )
+        return response.choices[0].message.content.strip()
+
+    return summarize
+
+
+class ConversationHistory:
+    """The part of a conversation that fits a token budget, updated incrementally."""
+
+    def __init__(self, budget=DEFAULT_BUDGET, reserve=DEFAULT_RESERVE, low_water=DEFAULT_LOW_WATER,
+                 summarizer=None, encoding=DEFAULT_ENCODING):
+        self.budget = budget
+        self.reserve = reserve
+        self.low_water = low_water
+        self.summarizer = summarizer
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.reset()
+
+    def reset(self):
+        # (hash of the message, token count) per message seen so far
+        self.counts = []
+        # messages before `start` have been dropped (or summarized)
+        self.start = 0
+        self.summary = None
+        self.summary_tokens = 0
+        self.n_trims = 0
+
+    def count(self, message):
+        n_tokens = TOKENS_PER_MESSAGE
+        for field, value in message.items():
+            n_tokens += len(self.encoding.encode(value if isinstance(value, str) else json.dumps(value)))
+            if field == "name":
+                n_tokens += TOKENS_PER_NAME
+        return n_tokens
+
+    def _update_counts(self, messages):
+        """Count the messages added since the last call; recount if the history was edited."""
+        keys = [hash(json.dumps(message, sort_keys=True)) for message in messages]
+        if len(keys) < len(self.counts) or any(keys[i] != self.counts[i][0] for i in range(len(self.counts))):
+            self.reset()
+        for key, message in zip(keys[len(self.counts):], messages[len(self.counts):]):
+            self.counts.append((key, self.count(message)))
+
+    def _turn_starts(self, first, end, messages):
+        return [i for i in range(first, end) if i == first or messages[i]["role"] == "user"]
+
+    def window(self, messages):
+        """Messages to send: pinned system prompt, summary of the dropped turns, recent turns."""
+        messages = [api_message(message) for message in messages]
+        self._update_counts(messages)
+        n_pinned = 0
+        while n_pinned < len(messages) and messages[n_pinned]["role"] == "system":
+            n_pinned += 1
+        self.start = max(self.start, n_pinned)
+        pinned_tokens = sum(n for _, n in self.counts[:n_pinned])
+        available = self.budget - self.reserve - REPLY_TOKENS - pinned_tokens
+
+        recent_tokens = sum(n for _, n in self.counts[self.start:])
+        if recent_tokens + self.summary_tokens > available:
+            target = self.low_water * available
+            # never drop the turn of the latest user message
+            starts = self._turn_starts(self.start, len(messages), messages)
+            new_start = self.start
+            for turn_start in starts[1:]:
+                if recent_tokens + self.summary_tokens <= target:
+                    break
+                recent_tokens -= sum(n for _, n in self.counts[new_start:turn_start])
+                new_start = turn_start
+            if new_start > self.start:
+                if self.summarizer is not None:
+                    self.summary = self.summarizer(self.summary, messages[self.start:new_start])
+                    self.summary_tokens = self.count({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+                self.start = new_start
+                self.n_trims += 1
+
+        window = messages[:n_pinned]
+        if self.summary:
+            window.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        return window + messages[self.start:]
+
+    def n_tokens(self, messages):
+        """Prompt tokens of a messages list (as counted by the chat API, approximately)."""
+        return REPLY_TOKENS + sum(self.count(api_message(message)) for message in messages)
+
+
+def load_conversation(path, n_turns):
+    """A long chat stitched together from the examples of a dataset."""
+    with open(path, 'r', encoding='utf-8') as f:
+        examples = [json.loads(line)["messages"] for line in f if line.strip()]
+    conversation = [m for m in examples[0] if m["role"] == "system"]
+    for i in range(n_turns):
+        conversation.extend(m for m in examples[i % len(examples)] if m["role"] != "system")
+    return conversation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt tokens per turn with and without the history budget.")
+    parser.add_argument("--dataset", default="./DI_QnA_Assistance/validation_DI_QnA.jsonl")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET)
+    parser.add_argument("--reserve", type=int, default=DEFAULT_RESERVE)
+    args = parser.parse_args()
+
+    conversation = load_conversation(args.dataset, args.turns)
+    history = ConversationHistory(budget=args.budget, reserve=args.reserve)
+    user_positions = [i for i, m in enumerate(conversation) if m["role"] == "user"]
+    print(f"{'turn':>5} {'full history':>13} {'budgeted':>9} {'messages sent':>14}")
+    for turn, position in enumerate(user_positions, 1):
+        sent = conversation[:position + 1]
+        window = history.window(sent)
+        if turn == 1 or turn % 5 == 0 or turn == len(user_positions):
+            print(f"{turn:>5} {history.n_tokens(sent):>13} {history.n_tokens(window):>9} {len(window):>14}")
+    print(f"Trimmed {history.n_trims} times")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Process wide resources for the Streamlit UIs.
+
+Streamlit re-runs the script on every interaction; get_openai_client is cached
+with st.cache_resource, so every rerun and every session of the process share
+one OpenAI client, i.e. one HTTP connection pool whose keep-alive connections
+skip the TCP + TLS handshake after the first request.
+
+The client's transport records the timing of every request through the
+httpcore trace extension, split into
+- connect: TCP connect + TLS handshake (0 on a reused keep-alive connection),
+- first byte: request sent until the response headers (queueing + prompt
+  processing, i.e. time to first token for streamed completions),
+- generation: response headers until the last byte of the body.
+"""
+
+import functools
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+import numpy as np
+import openai
+
+from ChatEngine.queue_classifier import QueueClassifier
+from ChatEngine.retrieval import DEFAULT_INDEX_DIR, DEFAULT_SOURCES, RetrievalIndex, build_index
+from ChatEngine.router import TaskRouter
+from ChatEngine.txn_store import TransactionStore
+
+try:
+    import streamlit as st
+    cache_resource = st.cache_resource
+except ImportError:
+    cache_resource = functools.lru_cache(maxsize=None)
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+# OpenAI closes idle connections after a few minutes, keep ours a bit shorter
+DEFAULT_KEEPALIVE_EXPIRY = 90.0
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+MAX_RECORDED_REQUESTS = 500
+
+
+@dataclass
+class RequestTiming:
+    method: str
+    path: str
+    started: float
+    connect: float = 0.0
+    first_byte: Optional[float] = None
+    generation: Optional[float] = None
+    total: Optional[float] = None
+    status: Optional[int] = None
+
+    @property
+    def reused_connection(self):
+        return self.connect == 0.0
+
+    def describe(self):
+        first_byte = f"{self.first_byte * 1000:.0f} ms" if self.first_byte is not None else "-"
+        generation = f"{self.generation * 1000:.0f} ms" if self.generation is not None else "-"
+        connect = "reused connection" if self.reused_connection else f"connect {self.connect * 1000:.0f} ms"
+        return f"{self.method} {self.path}: {connect}, first byte {first_byte}, generation {generation}"
+
+
+class LatencyRecorder:
+    """Timings of the last MAX_RECORDED_REQUESTS requests, shared by threads."""
+
+    def __init__(self, maxlen=MAX_RECORDED_REQUESTS):
+        self.timings = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    def add(self, timing):
+        with self.lock:
+            self.timings.append(timing)
+
+    def last(self):
+        with self.lock:
+            return self.timings[-1] if self.timings else None
+
+    def summary(self):
+        with self.lock:
+            timings = [t for t in self.timings if t.total is not None]
+        if not timings:
+            return {"requests": 0}
+        summary = {"requests": len(timings), "reused_connections": sum(t.reused_connection for t in timings)}
+        for name in ("connect", "first_byte", "generation", "total"):
+            values = np.array([getattr(t, name) or 0.0 for t in timings]) * 1000
+            p50, p95 = np.percentile(values, [50, 95])
+            summary[f"{name}_ms"] = {"mean": float(values.mean()), "p50": float(p50), "p95": float(p95)}
+        return summary
+
+
+class _TimedStream(httpx.SyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._on_close()
+
+
+class TimedTransport(httpx.HTTPTransport):
+    """HTTPTransport that records a RequestTiming per request."""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def handle_request(self, request):
+        timing = RequestTiming(request.method, request.url.path, time.perf_counter())
+        marks = {}
+
+        def trace(event_name, info):
+            marks[event_name] = time.perf_counter()
+
+        request.extensions = {**request.extensions, "trace": trace}
+        response = super().handle_request(request)
+        headers_received = time.perf_counter()
+        timing.status = response.status_code
+        for step in ("connect_tcp", "start_tls"):
+            started = marks.get(f"connection.{step}.started")
+            complete = marks.get(f"connection.{step}.complete")
+            if started is not None and complete is not None:
+                timing.connect += complete - started
+        sent = marks.get("http11.send_request_body.complete") or marks.get("http2.send_request_body.complete")
+        timing.first_byte = headers_received - (sent or timing.started)
+
+        def finished():
+            now = time.perf_counter()
+            timing.generation = now - headers_received
+            timing.total = now - timing.started
+            self.recorder.add(timing)
+
+        response.stream = _TimedStream(response.stream, finished)
+        return response
+
+
+latency_recorder = LatencyRecorder()
+
+
+@cache_resource
+def get_openai_client(api_key, base_url=None, max_connections=DEFAULT_MAX_CONNECTIONS,
+                      max_keepalive_connections=DEFAULT_MAX_KEEPALIVE, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY):
+    """One OpenAI client per process and settings, with a tuned keep-alive pool."""
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                          keepalive_expiry=keepalive_expiry)
+    http_client = openai.DefaultHttpxClient(
+        transport=TimedTransport(latency_recorder, limits=limits),
+        timeout=DEFAULT_TIMEOUT,
+    )
+    return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+@cache_resource
+def get_task_router(suffix=""):
+    """The task router trained from the datasets, once per process."""
+    return TaskRouter.from_datasets(suffix=suffix)
+
+
+@cache_resource
+def get_txn_store():
+    """The transactions table of the Transactional dataset, loaded once per process."""
+    return TransactionStore.from_dataset()
+
+
+@cache_resource
+def get_queue_classifier():
+    """The local queue classifier trained on the queue training file, once per process."""
+    return QueueClassifier.from_dataset()
+
+
+@cache_resource
+def get_retrieval_index(index_dir=DEFAULT_INDEX_DIR, extra_sources=()):
+    """The DI QnA retrieval index, brought up to date with its sources (only
+    changed files are re-read, a dense matrix built with --dense is kept) and
+    memory-mapped, once per process."""
+    build_index(index_dir, list(DEFAULT_SOURCES) + list(extra_sources))
+    return RetrievalIndex.load(index_dir)
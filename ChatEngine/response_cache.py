@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache in front of client.chat.completions.create.
+
+Queue classification and DI QnA answers are deterministic at temperature=0
+with a fixed system prompt, and customers ask the same questions ("How do I
+update my address?") over and over. A completion is keyed on the model id,
+the messages (API fields only, whitespace collapsed) and the sampling params;
+a repeated request is answered from the cache, streamed back chunk by chunk
+like a live completion so Streamlit cannot tell the difference.
+
+An optional semantic tier (`similarity_threshold`) also answers a question
+whose hashed n-gram vector (ChatEngine.router) or `embed(text)` vector is
+close enough to a cached question with the same model, params and earlier
+messages ("how do i update my address" for "How do I update my address?").
+
+Entries live in a bounded in-process LRU with a TTL and, with a path, in a
+SQLite file shared by every Streamlit worker process (RESPONSE_CACHE_PATH).
+Only complete answers (finish_reason "stop", no tool calls) of deterministic
+requests (temperature=0, one choice) are stored.
+
+    cached_client = CachedClient(client, response_cache)
+    stream = cached_client.chat.completions.create(model=model, messages=messages, temperature=0, stream=True)
+
+    python -m ChatEngine.response_cache ./DI_QnA_Assistance/validation_DI_QnA.jsonl --stub --similarity 0.9
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from ChatEngine.history import api_message
+from ChatEngine.router import HashedNgramVectorizer
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_DISK_ENTRIES = 100_000
+# expired / surplus rows are purged from SQLite every PURGE_EVERY writes
+PURGE_EVERY = 100
+# last_used of hits is saved with the next write, or after TOUCH_EVERY hits
+TOUCH_EVERY = 100
+# smaller than the router's: one vector is kept per cached question
+SEMANTIC_N_FEATURES = 2 ** 12
+# request arguments that do not change the answer
+IGNORED_PARAMS = {"stream", "stream_options", "user", "timeout", "extra_headers", "extra_query", "extra_body", "metadata", "store"}
+# cached text is replayed a few words per chunk
+_REPLAY_PIECE = re.compile(r"\S+\s*|\s+")
+REPLAY_WORDS = 3
+
+
+def normalize_messages(messages):
+    """API fields of each message, with runs of whitespace in string contents collapsed."""
+    normalized = []
+    for message in messages:
+        message = api_message(message)
+        if isinstance(message.get("content"), str):
+            message["content"] = " ".join(message["content"].split())
+        normalized.append(message)
+    return normalized
+
+
+def _digest(value):
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode("utf-8"), digest_size=16).digest()
+
+
+def request_params(params):
+    return {name: value for name, value in params.items() if name not in IGNORED_PARAMS and value is not None}
+
+
+def cache_key(model, messages, params):
+    return _digest([model, normalize_messages(messages), request_params(params)])
+
+
+def context_key(model, messages, params):
+    """Key of everything but the last user message: the scope of a semantic match."""
+    return _digest([model, normalize_messages(messages[:-1]), request_params(params)])
+
+
+def is_deterministic(params):
+    return params.get("temperature") == 0 and params.get("n", 1) == 1
+
+
+def _last_question(messages):
+    """Content of the last message when it is a user message with text, else None."""
+    if not messages:
+        return None
+    last = api_message(messages[-1])
+    if last.get("role") == "user" and isinstance(last.get("content"), str):
+        return last["content"]
+    return None
+
+
+@dataclass
+class CacheHit:
+    text: str
+    kind: str  # "exact" or "semantic"
+    similarity: float
+    seconds: float
+
+
+class ResponseCache:
+    """Answers (strings) by request, in process and optionally in SQLite.
+
+    `embed(text)` returns an L2-normalized vector; it defaults to hashed word and
+    character n-grams. The semantic tier is off while `similarity_threshold` is
+    None. Safe to use from several threads."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES,
+                 similarity_threshold=None, embed=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed or HashedNgramVectorizer(n_features=SEMANTIC_N_FEATURES).transform_one
+        # key -> (expires_at, text, context, vector)
+        self.memo = OrderedDict()
+        # context -> {key: vector}, and the stacked (keys, matrix) of a context
+        self.vectors = {}
+        self.matrices = {}
+        self.loaded_contexts = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        # key -> time of the hits whose last_used is not saved yet
+        self.touched = {}
+        self.conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key BLOB PRIMARY KEY, context BLOB NOT NULL, model TEXT NOT NULL, question TEXT, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache (last_used)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS response_cache_context ON response_cache (context)")
+            self.conn.commit()
+
+    def get(self, model, messages, params):
+        """CacheHit for the request, or None when missing, expired or not deterministic."""
+        if not is_deterministic(params):
+            return None
+        start = time.perf_counter()
+        key = cache_key(model, messages, params)
+        now = time.time()
+        with self.lock:
+            entry = self.memo.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memo.move_to_end(key)
+                    self.hits += 1
+                    return CacheHit(entry[1], "exact", 1.0, time.perf_counter() - start)
+                self._forget(key)
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value, context, question, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                                        (key, now)).fetchone()
+                if row is not None:
+                    self._touch(key, now)
+                    self._remember(key, row[3], row[0], row[1], row[2])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return CacheHit(row[0], "exact", 1.0, time.perf_counter() - start)
+            question = _last_question(messages)
+            if self.similarity_threshold is not None and question is not None:
+                hit = self._nearest(context_key(model, messages, params), question, now)
+                if hit is not None:
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return CacheHit(hit[0], "semantic", hit[1], time.perf_counter() - start)
+            self.misses += 1
+            return None
+
+    def set(self, model, messages, params, text):
+        if not is_deterministic(params):
+            return
+        key = cache_key(model, messages, params)
+        context = context_key(model, messages, params)
+        question = _last_question(messages)
+        now = time.time()
+        with self.lock:
+            self._remember(key, now + self.ttl, text, context, question)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, context, model, question, value, expires_at, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, context, model, question, text, now + self.ttl, now),
+                )
+                self._save_touched()
+                self.conn.commit()
+                self.writes += 1
+                if self.writes % PURGE_EVERY == 0:
+                    self._purge(now)
+
+    def _nearest(self, context, question, now):
+        """(text, similarity) of the closest cached question of the context above the threshold."""
+        if self.conn is not None and context not in self.loaded_contexts:
+            # the questions other processes cached in this context
+            rows = self.conn.execute(
+                "SELECT key, value, question, expires_at FROM response_cache WHERE context = ? AND expires_at > ?"
+                " AND question IS NOT NULL ORDER BY last_used DESC LIMIT ?", (context, now, self.max_entries)).fetchall()
+            for key, value, row_question, expires_at in reversed(rows):
+                if key not in self.memo:
+                    self._remember(key, expires_at, value, context, row_question)
+            self.loaded_contexts.add(context)
+        if not self.vectors.get(context):
+            return None
+        if context not in self.matrices:
+            keys = list(self.vectors[context])
+            self.matrices[context] = (keys, np.vstack([self.vectors[context][key] for key in keys]))
+        keys, matrix = self.matrices[context]
+        similarities = matrix @ self.embed(question)
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.similarity_threshold:
+                return None
+            key = keys[index]
+            entry = self.memo[key]
+            if entry[0] > now:
+                self.memo.move_to_end(key)
+                if self.conn is not None:
+                    self._touch(key, now)
+                return entry[1], float(similarities[index])
+            self._forget(key)
+        return None
+
+    def _touch(self, key, now):
+        # no write (and no write lock) on the read path of every hit
+        self.touched[key] = now
+        if len(self.touched) >= TOUCH_EVERY:
+            self._save_touched()
+            self.conn.commit()
+
+    def _save_touched(self):
+        if self.touched:
+            self.conn.executemany("UPDATE response_cache SET last_used = ? WHERE key = ?",
+                                  [(now, key) for key, now in self.touched.items()])
+            self.touched.clear()
+
+    def _remember(self, key, expires_at, text, context, question):
+        vector = None
+        if self.similarity_threshold is not None and question is not None:
+            vector = self.embed(question)
+            self.vectors.setdefault(context, {})[key] = vector
+            self.matrices.pop(context, None)
+        self.memo[key] = (expires_at, text, context, vector)
+        self.memo.move_to_end(key)
+        if len(self.memo) > self.max_entries:
+            self._forget(next(iter(self.memo)))
+
+    def _forget(self, key):
+        _, _, context, vector = self.memo.pop(key)
+        if vector is not None:
+            del self.vectors[context][key]
+            self.matrices.pop(context, None)
+
+    def _purge(self, now):
+        self._save_touched()
+        self.conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        (n_entries,) = self.conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+        if n_entries > self.max_disk_entries:
+            self.conn.execute(
+                "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY last_used LIMIT ?)",
+                (n_entries - self.max_disk_entries,),
+            )
+        self.conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.memo),
+        }
+
+    def clear(self):
+        with self.lock:
+            self.memo.clear()
+            self.vectors.clear()
+            self.matrices.clear()
+            self.loaded_contexts.clear()
+            self.touched.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM response_cache")
+                self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self._purge(time.time())
+                self.conn.close()
+                self.conn = None
+
+
+def replay_pieces(text, words=REPLAY_WORDS):
+    """text in pieces of a few words (with their trailing whitespace)."""
+    pieces = _REPLAY_PIECE.findall(text)
+    return ["".join(pieces[i:i + words]) for i in range(0, len(pieces), words)]
+
+
+def replay_stream(text, model, include_usage=False):
+    """ChatCompletionChunks of a cached answer, shaped like a live stream."""
+    completion_id = "chatcmpl-cache-" + hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None, usage=None):
+        choices = [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        return ChatCompletionChunk.model_validate({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                                   "model": model, "choices": choices, "usage": usage})
+
+    yield chunk({"role": "assistant", "content": ""})
+    for piece in replay_pieces(text):
+        yield chunk({"content": piece})
+    yield chunk({}, "stop")
+    if include_usage:
+        # a cache hit costs no tokens
+        yield chunk(None, usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+
+
+def cached_completion(text, model):
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-cache-" + hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest(),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": CompletionUsage(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+    })
+
+
+class CachedCompletions:
+    """client.chat.completions with the response cache in front of create()."""
+
+    def __init__(self, completions, cache):
+        self.completions = completions
+        self.cache = cache
+        self.last_hit = None
+
+    def create(self, model, messages, stream=False, **params):
+        self.last_hit = self.cache.get(model, messages, params)
+        if self.last_hit is not None:
+            if stream:
+                return replay_stream(self.last_hit.text, model, (params.get("stream_options") or {}).get("include_usage", False))
+            return cached_completion(self.last_hit.text, model)
+        response = self.completions.create(model=model, messages=messages, stream=stream, **params)
+        if not is_deterministic(params):
+            return response
+        if stream:
+            return self._recording(response, model, list(messages), params)
+        choice = response.choices[0]
+        if choice.finish_reason == "stop" and not choice.message.tool_calls and choice.message.content is not None:
+            self.cache.set(model, messages, params, choice.message.content)
+        return response
+
+    def _recording(self, stream, model, messages, params):
+        """Pass the chunks through; the answer is stored once the stream completed."""
+        parts = []
+        finish_reason = None
+        tool_calls = False
+        for chunk in stream:
+            if chunk.choices:
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                tool_calls = tool_calls or bool(choice.delta.tool_calls)
+                finish_reason = choice.finish_reason or finish_reason
+            yield chunk
+        if finish_reason == "stop" and not tool_calls:
+            self.cache.set(model, messages, params, "".join(parts))
+
+
+class CachedClient:
+    """Stand-in for an OpenAI client whose chat completions go through the cache
+    (e.g. for StreamingChatEngine); everything else is the wrapped client's."""
+
+    def __init__(self, client, cache):
+        self.client = client
+        self.chat = type("CachedChat", (), {})()
+        self.chat.completions = CachedCompletions(client.chat.completions, cache)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and latency of the response cache on a JSONL of conversations.")
+    parser.add_argument("input")
+    parser.add_argument("--model", default="gpt-3.5-turbo-0125")
+    parser.add_argument("--cache-path", default=None, help="SQLite file of the cache (default: in memory)")
+    parser.add_argument("--similarity", type=float, default=None, help="threshold of the semantic tier (default: off)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server replaying the references")
+    parser.add_argument("--stub-seconds", type=float, default=0.2, help="generation time of a stub completion")
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    base_url = os.getenv("BASE_URL")
+    server = None
+    if args.stub:
+        from FineTuning.stub_openai_server import load_answers, serve_in_thread
+        server = serve_in_thread(completion_seconds=args.stub_seconds, answers=load_answers([args.input]))
+        base_url = server.base_url
+    with open(args.input, 'r', encoding='utf-8') as f:
+        conversations = [json.loads(line)["messages"] for line in f if line.strip()][:args.limit]
+    # the prompt of each example: everything up to its last user message
+    prompts = []
+    for messages in conversations:
+        last_user = max(i for i, message in enumerate(messages) if message["role"] == "user")
+        prompts.append(messages[:last_user + 1])
+    # the same questions reworded: lowercase, no final punctuation
+    reworded = [prompt[:-1] + [{"role": "user", "content": prompt[-1]["content"].lower().rstrip(" ?.!")}] for prompt in prompts]
+
+    cache = ResponseCache(path=args.cache_path, similarity_threshold=args.similarity)
+    client = CachedClient(OpenAI(api_key=os.getenv("OPENAI_API_KEY", "stub" if args.stub else None), base_url=base_url), cache)
+    try:
+        print(f"{'pass':>10} {'requests':>9} {'exact':>6} {'semantic':>9} {'mean ms':>8} {'p95 ms':>7}")
+        for name, batch in (("cold", prompts), ("repeated", prompts), ("reworded", reworded)):
+            seconds = []
+            kinds = []
+            for messages in batch:
+                start = time.perf_counter()
+                text = "".join(chunk.choices[0].delta.content or "" for chunk in client.chat.completions.create(
+                    model=args.model, messages=messages, temperature=0, stream=True) if chunk.choices)
+                seconds.append(time.perf_counter() - start)
+                hit = client.chat.completions.last_hit
+                kinds.append(hit.kind if hit is not None else None)
+            seconds = np.array(seconds) * 1e3
+            print(f"{name:>10} {len(batch):>9} {kinds.count('exact'):>6} {kinds.count('semantic'):>9} "
+                  f"{seconds.mean():>8.1f} {np.percentile(seconds, 95):>7.1f}")
+        print(cache.stats())
+    finally:
+        cache.close()
+        if server is not None:
+            server.shutdown()
+
+
+# shared by every session of a Streamlit process; RESPONSE_CACHE_PATH adds the
+# SQLite tier shared across processes, RESPONSE_CACHE_SIMILARITY the semantic tier
+response_cache = ResponseCache(
+    path=os.getenv("RESPONSE_CACHE_PATH"),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", DEFAULT_TTL)),
+    similarity_threshold=float(os.environ["RESPONSE_CACHE_SIMILARITY"]) if os.getenv("RESPONSE_CACHE_SIMILARITY") else None,
+)
+
+
+if __name__ == "__main__":
+    main()
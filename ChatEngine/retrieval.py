@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Offline retrieval for the DI QnA task.
+
+The QnA model only knows the answers it memorized during fine-tuning; for
+anything else it falls back to the "Insufficient information" phone message.
+This module indexes local documents, by default the reference answers of
+DI_QnA_Assistance/*.jsonl (training and validation, so the retrieval figures
+of the CLI are in-sample), plus any JSONL / Markdown / text files or folders,
+and puts the top-k passages of a question into the QnA system prompt, as the
+"provided steps" the prompt asks the model to answer from.
+
+The index is a folder of flat files, memory-mapped at load:
+- manifest.json: sources (content hash and passage range), BM25 parameters,
+- passages.jsonl + passage_offsets.npy: passage records, read by offset,
+- terms.json, postings_start.npy, postings_doc.npy, postings_tf.npy,
+  doc_len.npy: the BM25 inverted index,
+- dense.npy (optional): one L2-normalized vector per passage (hashed word /
+  character n-grams of ChatEngine.router, or `embed(text)`), fused with BM25
+  by reciprocal rank.
+Building is incremental: a source whose content hash did not change keeps its
+passages and dense vectors, only new or changed files are parsed and embedded.
+Queries need no network.
+
+    build_index("./retrieval_index", DEFAULT_SOURCES, dense=True)
+    index = RetrievalIndex.load("./retrieval_index")
+    index.search("How do I update my address?", k=3)
+    index.context("How do I update my address?")  # the block added to the prompt
+
+    python -m ChatEngine.retrieval --build --dense ./docs  # later --build runs keep the dense matrix
+    python -m ChatEngine.retrieval --query "How can I transfer funds to my account?"
+    python -m ChatEngine.retrieval
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+
+from ChatEngine.router import HashedNgramVectorizer
+from ChatEngine.search_backends import DEFAULT_OFFLINE_SOURCES, reference_answer, tokenize
+
+DEFAULT_INDEX_DIR = "./retrieval_index"
+DEFAULT_SOURCES = DEFAULT_OFFLINE_SOURCES
+DEFAULT_K = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+DENSE_N_FEATURES = 2 ** 10
+# reciprocal rank fusion constant, and candidates taken from each ranking
+RRF_K = 60
+CANDIDATES_PER_K = 4
+# relevance floors: share of the query terms' idf found in a passage, and cosine
+# similarity of the dense vectors (hashed n-grams of unrelated questions reach 0.3)
+DEFAULT_MIN_COVERAGE = 0.5
+DEFAULT_MIN_SIMILARITY = 0.35
+# words per passage of a Markdown / text file
+MAX_PASSAGE_WORDS = 200
+INDEX_VERSION = 2
+TEXT_SUFFIXES = (".md", ".txt")
+
+_HEADING = re.compile(r"^#+\s*(.+)$", re.MULTILINE)
+# not indexed: a question sharing only these with a passage is not about it
+STOP_WORDS = frozenset("""
+a about an and any are as at be been but by can could do does for from had has have how i if in into is it its me
+my no not of on or our should so than that the their them then there these they this those to us was we what when
+where which who why will with would you your
+""".split())
+
+
+def terms(text):
+    return [word for word in tokenize(text) if word not in STOP_WORDS]
+
+
+@dataclass
+class Passage:
+    id: int
+    title: str
+    link: str
+    text: str
+    source: str
+    score: float = 0.0
+
+
+@dataclass
+class BuildReport:
+    n_sources: int
+    parsed: int
+    reused: int
+    removed: int
+    n_passages: int
+    n_terms: int
+    embedded: int
+    seconds: float
+
+
+def _content_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def expand_sources(paths):
+    """Files of the sources; folders are walked for .jsonl, .md and .txt files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.endswith((".jsonl",) + TEXT_SUFFIXES))
+        elif os.path.exists(path):
+            files.append(path)
+    return list(dict.fromkeys(os.path.normpath(path) for path in files))
+
+
+def read_jsonl_passages(path):
+    """Passages of a JSONL file: the referenced assistant answers of fine-tuning
+    examples, or {"title", "link", "text" or "snippet"} documents."""
+    passages = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if "messages" not in row:
+                text = row.get("text") or row.get("snippet") or ""
+                passages.setdefault(row.get("link") or f"{path}#{len(passages)}", (row.get("title", ""), text))
+                continue
+            for message in row["messages"]:
+                reference = reference_answer(message)
+                if reference:
+                    title, link, text = reference
+                    passages.setdefault(link, (title, text))
+    return [{"title": title, "link": link, "text": text} for link, (title, text) in passages.items()]
+
+
+def read_text_passages(path, max_words=MAX_PASSAGE_WORDS):
+    """Passages of a Markdown / text file: paragraphs packed up to max_words, titled by the last heading."""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    title = os.path.splitext(os.path.basename(path))[0]
+    passages, current, n_words = [], [], 0
+
+    def flush():
+        if current:
+            passages.append({"title": title, "link": f"{path}#{len(passages) + 1}", "text": "\n\n".join(current)})
+        current.clear()
+
+    for paragraph in re.split(r"\n\s*\n", content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        heading = _HEADING.match(paragraph)
+        if heading and "\n" not in paragraph:
+            flush()
+            n_words = 0
+            title = heading.group(1).strip()
+            continue
+        words = len(paragraph.split())
+        if current and n_words + words > max_words:
+            flush()
+            n_words = 0
+        current.append(paragraph)
+        n_words += words
+    flush()
+    return passages
+
+
+def read_passages(path):
+    return read_text_passages(path) if path.endswith(TEXT_SUFFIXES) else read_jsonl_passages(path)
+
+
+def _write_atomic(path, write):
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _save_npy(path, array):
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+    _write_atomic(path, write)
+
+
+def _load_manifest(index_dir):
+    path = os.path.join(index_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return manifest if manifest.get("version") == INDEX_VERSION else None
+
+
+def _read_passage(buffer, offsets, i):
+    return json.loads(buffer[offsets[i]:offsets[i + 1]])
+
+
+def _embed_all(embed, name, passages):
+    if embed is None:
+        raise ValueError(f"the dense vectors of this index come from {name!r}: pass that embed() to update it")
+    return [embed(f"{p['title']} {p['text']}") for p in passages]
+
+
+def build_index(index_dir, sources=DEFAULT_SOURCES, dense=None, embed=None, embed_name=None):
+    """Build or update the index of `sources` (files or folders) in index_dir.
+
+    Passages and dense vectors of sources whose content did not change are kept.
+    dense=None keeps the dense matrix when the index has one, True adds it,
+    False drops it. `embed(text)` -> L2-normalized vector replaces the hashed
+    n-gram vectors; `embed_name` is recorded so a changed embedder re-embeds
+    everything."""
+    start = time.perf_counter()
+    os.makedirs(index_dir, exist_ok=True)
+    recorded = (_load_manifest(index_dir) or {}).get("dense")
+    if dense is None:
+        dense = recorded is not None
+        if dense and embed is None and recorded != f"hashed-ngrams-{DENSE_N_FEATURES}":
+            # vectors of another embedder: reusable, but new passages cannot be embedded
+            embed_name = recorded
+    if dense and embed is None and embed_name is None:
+        embed = HashedNgramVectorizer(n_features=DENSE_N_FEATURES).transform_one
+        embed_name = f"hashed-ngrams-{DENSE_N_FEATURES}"
+    dense_name = (embed_name or getattr(embed, "__name__", "embed")) if dense else None
+
+    previous = _load_manifest(index_dir) or {"sources": {}, "dense": None}
+    old_offsets = old_buffer = old_dense = None
+    if previous["sources"]:
+        old_offsets = np.load(os.path.join(index_dir, "passage_offsets.npy"))
+        with open(os.path.join(index_dir, "passages.jsonl"), 'rb') as f:
+            old_buffer = f.read()
+        if dense and previous["dense"] == dense_name:
+            old_dense = np.load(os.path.join(index_dir, "dense.npy"), mmap_mode="r")
+
+    files = expand_sources(sources)
+    passages, vectors, manifest_sources = [], [], {}
+    parsed = reused = embedded = 0
+    for path in files:
+        content_hash = _content_hash(path)
+        entry = previous["sources"].get(path)
+        if entry is not None and entry["hash"] == content_hash:
+            reused += 1
+            source_passages = [_read_passage(old_buffer, old_offsets, i) for i in range(entry["start"], entry["start"] + entry["count"])]
+            if dense and old_dense is not None:
+                vectors.extend(old_dense[entry["start"]:entry["start"] + entry["count"]])
+            elif dense:
+                vectors.extend(_embed_all(embed, dense_name, source_passages))
+                embedded += len(source_passages)
+        else:
+            parsed += 1
+            source_passages = [dict(p, source=path) for p in read_passages(path)]
+            if dense:
+                vectors.extend(_embed_all(embed, dense_name, source_passages))
+                embedded += len(source_passages)
+        manifest_sources[path] = {"hash": content_hash, "start": len(passages), "count": len(source_passages)}
+        passages.extend(source_passages)
+    removed = len(set(previous["sources"]) - set(manifest_sources))
+
+    # BM25 postings, sorted by term then passage
+    vocabulary = {}
+    postings = []
+    doc_len = np.zeros(len(passages), dtype=np.int32)
+    for doc_id, passage in enumerate(passages):
+        counts = Counter(terms(f"{passage['title']} {passage['text']}"))
+        doc_len[doc_id] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.append((vocabulary.setdefault(term, len(vocabulary)), doc_id, tf))
+    postings.sort()
+    term_ids = np.array([p[0] for p in postings], dtype=np.int32)
+    postings_start = np.searchsorted(term_ids, np.arange(len(vocabulary) + 1)).astype(np.int64)
+    lines = [json.dumps(p, ensure_ascii=False).encode("utf-8") + b"\n" for p in passages]
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum([len(line) for line in lines], out=offsets[1:])
+
+    def write_passages(tmp):
+        with open(tmp, 'wb') as f:
+            f.writelines(lines)
+
+    def write_terms(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+
+    # arrays first, the manifest last: a reader never sees a manifest without its files
+    _write_atomic(os.path.join(index_dir, "passages.jsonl"), write_passages)
+    _save_npy(os.path.join(index_dir, "passage_offsets.npy"), offsets)
+    _write_atomic(os.path.join(index_dir, "terms.json"), write_terms)
+    _save_npy(os.path.join(index_dir, "postings_start.npy"), postings_start)
+    _save_npy(os.path.join(index_dir, "postings_doc.npy"), np.array([p[1] for p in postings], dtype=np.int32))
+    _save_npy(os.path.join(index_dir, "postings_tf.npy"), np.array([p[2] for p in postings], dtype=np.float32))
+    _save_npy(os.path.join(index_dir, "doc_len.npy"), doc_len)
+    if dense:
+        _save_npy(os.path.join(index_dir, "dense.npy"), np.vstack(vectors).astype(np.float32) if vectors
+                  else np.zeros((0, DENSE_N_FEATURES), dtype=np.float32))
+    elif os.path.exists(os.path.join(index_dir, "dense.npy")):
+        os.remove(os.path.join(index_dir, "dense.npy"))
+    manifest = {"version": INDEX_VERSION, "sources": manifest_sources, "n_passages": len(passages),
+                "avg_doc_len": float(doc_len.mean()) if len(passages) else 0.0, "k1": BM25_K1, "b": BM25_B,
+                "dense": dense_name}
+
+    def write_manifest(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+
+    _write_atomic(os.path.join(index_dir, "manifest.json"), write_manifest)
+    return BuildReport(len(files), parsed, reused, removed, len(passages), len(vocabulary), embedded,
+                       time.perf_counter() - start)
+
+
+class RetrievalIndex:
+    """Read-only view of an index folder; arrays and passages are memory-mapped."""
+
+    def __init__(self, index_dir, embed=None, min_coverage=DEFAULT_MIN_COVERAGE, min_similarity=DEFAULT_MIN_SIMILARITY):
+        manifest = _load_manifest(index_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"no retrieval index in {index_dir}, build it with --build")
+        self.index_dir = index_dir
+        self.manifest = manifest
+        self.min_coverage = min_coverage
+        self.min_similarity = min_similarity
+        self.k1 = manifest["k1"]
+        self.b = manifest["b"]
+        self.avg_doc_len = manifest["avg_doc_len"] or 1.0
+        with open(os.path.join(index_dir, "terms.json"), 'r', encoding='utf-8') as f:
+            self.vocabulary = json.load(f)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+        self.offsets = load("passage_offsets.npy")
+        self.postings_start = load("postings_start.npy")
+        self.postings_doc = load("postings_doc.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_len = np.asarray(load("doc_len.npy"), dtype=np.float32)
+        self.n_passages = len(self.doc_len)
+        self.dense = None
+        self.embed = None
+        if manifest["dense"] is not None:
+            self.dense = load("dense.npy")
+            if embed is None and manifest["dense"] == f"hashed-ngrams-{DENSE_N_FEATURES}":
+                embed = HashedNgramVectorizer(n_features=DENSE_N_FEATURES).transform_one
+            # without the embedder the index was built with, BM25 alone
+            self.embed = embed
+        self._file = open(os.path.join(index_dir, "passages.jsonl"), 'rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+        self._length_norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avg_doc_len)
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR, **kwargs):
+        return cls(index_dir, **kwargs)
+
+    def __len__(self):
+        return self.n_passages
+
+    def bm25(self, query):
+        return self.bm25_coverage(query)[0]
+
+    def bm25_coverage(self, query):
+        """(BM25 score, share of the query's idf found in the passage) of every passage;
+        a query term missing from the index counts with the idf of an unseen term."""
+        scores = np.zeros(self.n_passages, dtype=np.float32)
+        matched = np.zeros(self.n_passages, dtype=np.float32)
+        total = 0.0
+        for term in set(terms(query)):
+            term_id = self.vocabulary.get(term)
+            n_docs = 0 if term_id is None else int(self.postings_start[term_id + 1] - self.postings_start[term_id])
+            idf = math.log(1 + (self.n_passages - n_docs + 0.5) / (n_docs + 0.5))
+            total += idf
+            if not n_docs:
+                continue
+            lo, hi = self.postings_start[term_id], self.postings_start[term_id + 1]
+            docs, tf = self.postings_doc[lo:hi], self.postings_tf[lo:hi]
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+            matched[docs] += idf
+        return scores, matched / total if total else matched
+
+    def search(self, query, k=DEFAULT_K):
+        """Top-k relevant passages of query: BM25, fused with the dense ranking when
+        the index has one. A passage below both floors (min_coverage of the query
+        terms, min_similarity to the query) is not returned, even in the top k."""
+        if not self.n_passages:
+            return []
+        scores, coverage = self.bm25_coverage(query)
+        n_candidates = min(self.n_passages, k * CANDIDATES_PER_K)
+        lexical = _top(scores, n_candidates)
+        lexical = lexical[(scores[lexical] > 0) & (coverage[lexical] >= self.min_coverage)]
+        if self.dense is None or self.embed is None:
+            ranked = [(int(i), float(scores[i])) for i in lexical[:k]]
+        else:
+            similarities = self.dense @ self.embed(query)
+            semantic = _top(similarities, n_candidates)
+            semantic = semantic[similarities[semantic] >= self.min_similarity]
+            fused = {}
+            for ranking in (lexical, semantic):
+                for rank, i in enumerate(ranking):
+                    fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (RRF_K + rank + 1)
+            ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [self.passage(i, score) for i, score in ranked]
+
+    def passage(self, i, score=0.0):
+        record = _read_passage(self._buffer, self.offsets, i)
+        return Passage(i, record["title"], record["link"], record["text"], record["source"], score)
+
+    def context(self, query, k=DEFAULT_K):
+        """The top-k passages as the document block of the QnA prompt ("" when nothing matches)."""
+        passages = self.search(query, k)
+        if not passages:
+            return ""
+        return "\n\nDocuments:\n" + "\n\n".join(f"[{p.title}]({p.link})\n{p.text}" for p in passages)
+
+    def close(self):
+        if not isinstance(self._buffer, bytes):
+            self._buffer.close()
+        self._file.close()
+
+
+def _top(scores, k):
+    """Indices of the k highest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, query or evaluate the offline retrieval index of the DI QnA task.")
+    parser.add_argument("sources", nargs="*", help="extra files or folders to index (JSONL, Markdown, text)")
+    parser.add_argument("--index", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--build", action="store_true", help="build or update the index, then evaluate it")
+    parser.add_argument("--dense", action=argparse.BooleanOptionalAction, default=None,
+                        help="with --build: add (--dense) or drop (--no-dense) the dense vector matrix, default as built")
+    parser.add_argument("--query", default=None)
+    parser.add_argument("-k", type=int, default=DEFAULT_K)
+    parser.add_argument("--repeat", type=int, default=200, help="timed searches per question")
+    args = parser.parse_args()
+
+    if args.build:
+        report = build_index(args.index, list(DEFAULT_SOURCES) + args.sources, dense=args.dense)
+        print(f"{report.n_passages} passages, {report.n_terms} terms from {report.n_sources} sources "
+              f"({report.parsed} parsed, {report.reused} unchanged, {report.removed} removed, "
+              f"{report.embedded} passages embedded) in {report.seconds:.2f}s")
+    index = RetrievalIndex.load(args.index)
+    if args.query:
+        for passage in index.search(args.query, args.k):
+            print(f"{passage.score:.3f} [{passage.title}]({passage.link})\n  {passage.text[:200]!r}")
+        return
+
+    # does the answer of each DI QnA question come back, and how fast
+    questions = []
+    for path in DEFAULT_SOURCES:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                messages = json.loads(line)["messages"] if line.strip() else []
+                question = next((m["content"] for m in messages if m["role"] == "user"), None)
+                reference = reference_answer(messages[-1]) if messages else None
+                if question and reference:
+                    questions.append((question, reference[1]))
+    hits_1 = hits_k = 0
+    timings = []
+    context_chars = []
+    for question, link in questions:
+        links = [p.link for p in index.search(question, args.k)]
+        hits_1 += links[:1] == [link]
+        hits_k += link in links
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index.search(question, args.k)
+            timings.append(time.perf_counter() - start)
+        context_chars.append(len(index.context(question, args.k)))
+    timings = np.array(timings) * 1e3
+    total_chars = sum(len(index.passage(i).text) for i in range(len(index)))
+    print(f"{len(index)} passages ({'BM25 + dense' if index.embed is not None else 'BM25'}), {len(questions)} questions")
+    # the default sources hold the training and the validation answers
+    print(f"Reference in top 1: {hits_1}/{len(questions)}, in top {args.k}: {hits_k}/{len(questions)} "
+          f"(in-sample: the index holds the answers of these questions)")
+    print(f"Search: mean {timings.mean():.3f} ms, p95 {np.percentile(timings, 95):.3f} ms")
+    print(f"Prompt context: {np.mean(context_chars):.0f} chars per question, against {total_chars} for every passage")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
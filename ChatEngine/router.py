@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Local task router: picks the fine-tuned task of a user message before the
+chat request is sent, so only that task's system prompt goes to the model.
+
+The combined system prompt of the UI (queue + transactional table + QnA
+instructions) is sent on every turn, whatever the question. The router embeds
+the message with a hashed bag of word 1-2 grams and character 4-grams (no
+vocabulary to fit or ship, a few microseconds per message) and compares it
+with one centroid per task, built from the user messages of the training
+files. Each task answers with the exact system prompt it was fine-tuned with.
+Ambiguous messages keep the previous turn's task, or fall back to the
+combined prompt.
+
+    router = TaskRouter.from_datasets()
+    decision = router.route("List all accounts with a status of 'Closed'")
+    decision.task, decision.system_prompt
+
+    python -m ChatEngine.router
+"""
+
+import argparse
+import json
+import os
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from DataPrep.text_normalize import normalize_text
+
+DEFAULT_N_FEATURES = 2 ** 14
+CHAR_NGRAM = 4
+# training file, validation file and the system prompt come from the rows
+TASK_DATASETS = {
+    "queue": ("./queue/training.jsonl", "./queue/validation.jsonl"),
+    "qna": ("./DI_QnA_Assistance/training_DI_QnA.jsonl", "./DI_QnA_Assistance/validation_DI_QnA.jsonl"),
+    "transactional": ("./Transactional/training_DI_txn.jsonl", "./Transactional/validation_DI_txn.jsonl"),
+}
+# cosine similarity to the best centroid, and lead over the second best
+DEFAULT_MIN_SIMILARITY = 0.15
+DEFAULT_MIN_MARGIN = 0.03
+
+
+class HashedNgramVectorizer:
+    """L2-normalized, log-scaled counts of hashed word 1-2 grams and character n-grams."""
+
+    def __init__(self, n_features=DEFAULT_N_FEATURES, char_ngram=CHAR_NGRAM):
+        self.n_features = n_features
+        self.char_ngram = char_ngram
+
+    def features(self, text):
+        words = normalize_text(text).split()
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        k = self.char_ngram
+        for word in words:
+            padded = f" {word} "
+            features.extend(f"#{padded[i:i + k]}" for i in range(max(1, len(padded) - k + 1)))
+        return features
+
+    def transform_one(self, text):
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        for feature in self.features(text):
+            vector[zlib.crc32(feature.encode("utf-8")) % self.n_features] += 1
+        np.log1p(vector, out=vector)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def transform(self, texts):
+        return np.vstack([self.transform_one(text) for text in texts]) if texts else np.zeros((0, self.n_features), dtype=np.float32)
+
+
+@dataclass
+class RouteDecision:
+    task: Optional[str]
+    similarity: float
+    margin: float
+    system_prompt: str
+    seconds: float
+
+    @property
+    def routed(self):
+        return self.task is not None
+
+
+def load_task_examples(path):
+    """(user messages, system prompt) of a fine-tuning file."""
+    texts, system_prompt = [], None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for message in json.loads(line).get("messages", []):
+                if message["role"] == "system" and system_prompt is None:
+                    system_prompt = message["content"]
+                elif message["role"] == "user":
+                    texts.append(message["content"])
+    return texts, system_prompt
+
+
+class TaskRouter:
+    """Nearest-centroid classifier over hashed n-gram vectors."""
+
+    def __init__(self, tasks, centroids, prompts, fallback_prompt=None, vectorizer=None,
+                 min_similarity=DEFAULT_MIN_SIMILARITY, min_margin=DEFAULT_MIN_MARGIN):
+        self.tasks = list(tasks)
+        self.centroids = centroids
+        self.prompts = prompts
+        self.fallback_prompt = fallback_prompt
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+
+    @classmethod
+    def fit(cls, examples, prompts, vectorizer=None, **kwargs):
+        """examples: {task: [user message, ...]}, prompts: {task: system prompt}."""
+        vectorizer = vectorizer or HashedNgramVectorizer()
+        tasks = sorted(examples)
+        centroids = np.vstack([vectorizer.transform(examples[task]).mean(axis=0) for task in tasks])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        return cls(tasks, centroids, prompts, vectorizer=vectorizer, **kwargs)
+
+    @classmethod
+    def from_datasets(cls, datasets=TASK_DATASETS, suffix="", **kwargs):
+        """Router trained on the training file of each task; `suffix` is appended
+        to every task prompt (e.g. the search_internet instructions)."""
+        examples, prompts = {}, {}
+        for task, (training_path, _) in datasets.items():
+            if not os.path.exists(training_path):
+                continue
+            examples[task], prompt = load_task_examples(training_path)
+            prompts[task] = prompt + suffix
+        return cls.fit(examples, prompts, **kwargs)
+
+    def scores(self, text):
+        return self.centroids @ self.vectorizer.transform_one(text)
+
+    def route(self, text, previous=None):
+        """Task of text; below the thresholds the previous task is kept, else no task
+        (decision.system_prompt is then the fallback prompt)."""
+        start = time.perf_counter()
+        scores = self.scores(text)
+        order = np.argsort(scores)[::-1]
+        similarity = float(scores[order[0]])
+        margin = similarity - float(scores[order[1]]) if len(order) > 1 else similarity
+        if similarity >= self.min_similarity and margin >= self.min_margin:
+            task = self.tasks[order[0]]
+        else:
+            task = previous if previous in self.prompts else None
+        system_prompt = self.prompts[task] if task is not None else self.fallback_prompt
+        return RouteDecision(task, similarity, margin, system_prompt, time.perf_counter() - start)
+
+    @staticmethod
+    def apply(messages, decision):
+        """messages with the leading system message replaced by the decision's prompt."""
+        if decision.system_prompt is None:
+            return messages
+        rest = messages[1:] if messages and messages[0]["role"] == "system" else messages
+        return [{"role": "system", "content": decision.system_prompt}] + rest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, latency and prompt size of the task router on the validation files.")
+    parser.add_argument("--min-similarity", type=float, default=DEFAULT_MIN_SIMILARITY)
+    parser.add_argument("--min-margin", type=float, default=DEFAULT_MIN_MARGIN)
+    args = parser.parse_args()
+
+    router = TaskRouter.from_datasets(min_similarity=args.min_similarity, min_margin=args.min_margin)
+    combined_chars = sum(len(prompt) for prompt in router.prompts.values())
+    print(f"{'task':>14} {'examples':>9} {'correct':>8} {'fallback':>9} {'prompt chars':>13}")
+    n_total = n_correct = 0
+    seconds = []
+    for task, (_, validation_path) in TASK_DATASETS.items():
+        texts, _ = load_task_examples(validation_path)
+        decisions = [router.route(text) for text in texts]
+        seconds.extend(d.seconds for d in decisions)
+        correct = sum(d.task == task for d in decisions)
+        fallback = sum(not d.routed for d in decisions)
+        n_total += len(texts)
+        n_correct += correct
+        print(f"{task:>14} {len(texts):>9} {correct:>8} {fallback:>9} {len(router.prompts[task]):>13}")
+    print(f"Accuracy {n_correct / n_total:.1%}, {np.mean(seconds) * 1e6:.0f} us per message, "
+          f"combined prompt {combined_chars} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Interchangeable search backends for the search_internet tool.
+
+Every backend answers search(query, num) with [{"link", "snippet"}]:
+- ValueSerpBackend: VALUE SERP over the pooled SearchClient,
+- SerpApiBackend: SerpApi (the GoogleSearch service) over the same client,
+- OfflineIndexBackend: a local TF-IDF index over JSONL documents, by default
+  the reference pages of the DI QnA dataset; no network, optional simulated
+  latency, for load tests of the chat loop,
+- HedgedSearch: sends the query to two backends at once and returns the first
+  good (non-empty) answer, cutting the tail latency of either one.
+
+The UIs pick one with SEARCH_BACKEND, e.g. "valueserp", "serpapi", "offline"
+or "hedged:valueserp,serpapi".
+"""
+
+import json
+import math
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from ChatEngine.search_client import DEFAULT_NUM_RESULTS, SearchClient
+
+SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
+SERPAPI_PARAMS = {"engine": "google", "google_domain": "google.com", "gl": "ca", "json_restrictor": "organic_results"}
+DEFAULT_OFFLINE_SOURCES = (
+    './DI_QnA_Assistance/training_DI_QnA.jsonl',
+    './DI_QnA_Assistance/validation_DI_QnA.jsonl',
+)
+DEFAULT_HEDGE_TIMEOUT = 15.0
+
+_WORD = re.compile(r"\w+")
+# "Reference: [Title](URL)" at the end of the DI QnA answers
+_REFERENCE = re.compile(r"\[([^\]]+)\]\((https?://[^)\s]+)\)")
+
+
+class SearchBackend:
+    name = "search"
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        raise NotImplementedError
+
+    def search_json(self, query, num=DEFAULT_NUM_RESULTS):
+        """search() serialized for a tool message."""
+        return json.dumps(self.search(query, num), separators=(",", ":"))
+
+
+class ValueSerpBackend(SearchBackend):
+    name = "valueserp"
+
+    def __init__(self, api_key, **client_kwargs):
+        self.client = SearchClient(api_key, **client_kwargs)
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        return self.client.search(query, num)
+
+
+class SerpApiBackend(SearchBackend):
+    name = "serpapi"
+
+    def __init__(self, api_key, endpoint=SERPAPI_ENDPOINT, params=SERPAPI_PARAMS, **client_kwargs):
+        self.client = SearchClient(api_key, endpoint=endpoint, params=params, **client_kwargs)
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        return self.client.search(query, num)
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def reference_answer(message):
+    """(title, link, text) of a DI QnA assistant answer ending with a
+    "Reference: [Title](URL)", else None; shared by the offline indexes."""
+    if message.get("role") != "assistant":
+        return None
+    content = message.get("content") or ""
+    match = _REFERENCE.search(content)
+    if match is None:
+        return None
+    title, link = match.groups()
+    return title, link, content[:match.start()].replace("Reference:", "").strip()
+
+
+class OfflineIndexBackend(SearchBackend):
+    """TF-IDF ranking over local documents ({"link", "snippet", "title"?})."""
+
+    name = "offline"
+
+    def __init__(self, documents, latency=0.0):
+        self.documents = list(documents)
+        self.latency = latency
+        self.postings = defaultdict(list)
+        self.norms = []
+        n_docs = len(self.documents)
+        doc_terms = []
+        for doc_id, doc in enumerate(self.documents):
+            terms = Counter(tokenize(f"{doc.get('title', '')} {doc['snippet']}"))
+            doc_terms.append(terms)
+            for term, tf in terms.items():
+                self.postings[term].append((doc_id, tf))
+        self.idf = {term: math.log((1 + n_docs) / (1 + len(postings))) + 1 for term, postings in self.postings.items()}
+        self.norms = [math.sqrt(sum((tf * self.idf[t]) ** 2 for t, tf in terms.items())) or 1.0 for terms in doc_terms]
+
+    @classmethod
+    def from_jsonl(cls, path, **kwargs):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls((json.loads(line) for line in f if line.strip()), **kwargs)
+
+    @classmethod
+    def from_qna_datasets(cls, paths=DEFAULT_OFFLINE_SOURCES, **kwargs):
+        """One document per assistant answer that ends with a [Title](URL) reference."""
+        documents = {}
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    for message in json.loads(line).get("messages", []):
+                        reference = reference_answer(message)
+                        if reference:
+                            title, link, snippet = reference
+                            documents.setdefault(link, {"title": title, "link": link, "snippet": snippet})
+        return cls(documents.values(), **kwargs)
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        if self.latency:
+            time.sleep(self.latency)
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                scores[doc_id] += tf * idf * idf
+        ranked = sorted(scores, key=lambda doc_id: scores[doc_id] / self.norms[doc_id], reverse=True)
+        return [{"link": self.documents[i]["link"], "snippet": self.documents[i]["snippet"]} for i in ranked[:num]]
+
+
+class HedgedSearch(SearchBackend):
+    """Query several backends at once, return the first non-empty answer.
+
+    An exception or an empty result from one backend just means waiting for
+    the others; only when all fail is the last error raised."""
+
+    def __init__(self, backends, timeout=DEFAULT_HEDGE_TIMEOUT):
+        self.backends = list(backends)
+        self.name = "hedged:" + ",".join(b.name for b in self.backends)
+        self.timeout = timeout
+        # the losing request keeps running in the background, the pool absorbs it
+        self._pool = ThreadPoolExecutor(max_workers=4 * len(self.backends), thread_name_prefix="hedged-search")
+        self.wins = Counter()
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        futures = {self._pool.submit(backend.search, query, num): backend for backend in self.backends}
+        deadline = time.monotonic() + self.timeout
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if results:
+                    self.wins[futures[future].name] += 1
+                    return results
+        if error is not None:
+            raise error
+        if pending:
+            raise TimeoutError(f"no search backend answered within {self.timeout}s")
+        return []
+
+
+def make_backend(spec, api_keys=None):
+    """Backend from a name: valueserp, serpapi, offline or hedged:<name>,<name>.
+
+    api_keys maps backend names to keys; VALUESERP_API_KEY / SERPAPI_API_KEY
+    (then SERP_API_KEY) are used for the missing ones."""
+    api_keys = api_keys or {}
+    if spec.startswith("hedged:"):
+        return HedgedSearch([make_backend(name.strip(), api_keys) for name in spec[len("hedged:"):].split(",")])
+    if spec == "valueserp":
+        return ValueSerpBackend(api_keys.get("valueserp") or os.getenv("VALUESERP_API_KEY") or os.getenv("SERP_API_KEY"))
+    if spec == "serpapi":
+        return SerpApiBackend(api_keys.get("serpapi") or os.getenv("SERPAPI_API_KEY") or os.getenv("SERP_API_KEY"))
+    if spec == "offline":
+        path = os.getenv("OFFLINE_SEARCH_INDEX")
+        latency = float(os.getenv("OFFLINE_SEARCH_LATENCY", 0))
+        return OfflineIndexBackend.from_jsonl(path, latency=latency) if path else OfflineIndexBackend.from_qna_datasets(latency=latency)
+    raise ValueError(f"unknown search backend {spec!r}")
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+TTL + LRU cache for internet search results.
+
+Queries are keyed on a normalized form (case, punctuation, whitespace and word
+order ignored), so "Scotiabank dividend Q1 2024?" and "q1 2024 scotiabank
+dividend" share one entry. Lookups go through a bounded in-process LRU first,
+then through an optional SQLite file that every Streamlit worker process can
+share (set SEARCH_CACHE_PATH). Entries expire after `ttl` seconds: dividend and
+earnings results only change around announcements, an hour keeps answers
+fresh while absorbing the bursts of near-identical questions. An empty result
+("[]", e.g. after a backend hiccup) only lives
+`empty_ttl` seconds, so the next question searches again.
+
+    @search_cache.cached("valueserp")
+    def search_internet(search_query):
+        ...
+"""
+
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 60 * 60
+DEFAULT_EMPTY_TTL = 60
+EMPTY_RESULTS = {"", "[]", "{}"}
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_DISK_ENTRIES = 100_000
+# expired / surplus rows are purged from SQLite every PURGE_EVERY writes
+PURGE_EVERY = 100
+# last_used of disk hits is saved with the next write, or after TOUCH_EVERY hits
+TOUCH_EVERY = 100
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize_query(query):
+    """Lowercase, drop punctuation, ignore word order and repeated words."""
+    return " ".join(sorted(set(_NON_WORD.sub(" ", query.lower()).split())))
+
+
+def cache_key(query, namespace=""):
+    return hashlib.blake2b(f"{namespace}\x00{normalize_query(query)}".encode("utf-8"), digest_size=16).digest()
+
+
+class SearchCache:
+    """Search results (strings) by normalized query, in process and optionally in SQLite.
+
+    Safe to use from the tool executor's threads."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES,
+                 empty_ttl=DEFAULT_EMPTY_TTL):
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        # key -> time of the disk hits whose last_used is not saved yet
+        self.touched = {}
+        self.conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # one connection guarded by self.lock, shared by the tool threads
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " key BLOB PRIMARY KEY, query TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache (last_used)")
+            self.conn.commit()
+
+    def get(self, query, namespace=""):
+        """Cached result of query, or None when missing or expired."""
+        key = cache_key(query, namespace)
+        now = time.time()
+        with self.lock:
+            entry = self.memo.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memo.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.memo[key]
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value, expires_at FROM search_cache WHERE key = ? AND expires_at > ?",
+                                        (key, now)).fetchone()
+                if row is not None:
+                    self._touch(key, now)
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, query, value, namespace=""):
+        key = cache_key(query, namespace)
+        now = time.time()
+        expires_at = now + (self.empty_ttl if value.strip() in EMPTY_RESULTS else self.ttl)
+        with self.lock:
+            self._remember(key, expires_at, value)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, query, value, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, query, value, expires_at, now),
+                )
+                self._save_touched()
+                self.conn.commit()
+                self.writes += 1
+                if self.writes % PURGE_EVERY == 0:
+                    self._purge(now)
+
+    def _touch(self, key, now):
+        self.touched[key] = now
+        if len(self.touched) >= TOUCH_EVERY:
+            self._save_touched()
+            self.conn.commit()
+
+    def _save_touched(self):
+        if self.touched:
+            self.conn.executemany("UPDATE search_cache SET last_used = ? WHERE key = ?",
+                                  [(now, key) for key, now in self.touched.items()])
+            self.touched.clear()
+
+    def _remember(self, key, expires_at, value):
+        self.memo[key] = (expires_at, value)
+        self.memo.move_to_end(key)
+        if len(self.memo) > self.max_entries:
+            self.memo.popitem(last=False)
+
+    def _purge(self, now):
+        self._save_touched()
+        self.conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+        (n_entries,) = self.conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()
+        if n_entries > self.max_disk_entries:
+            self.conn.execute(
+                "DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache ORDER BY last_used LIMIT ?)",
+                (n_entries - self.max_disk_entries,),
+            )
+        self.conn.commit()
+
+    def get_or_search(self, query, search, namespace=""):
+        """Cached result of query, else search(query), cached unless it is None."""
+        value = self.get(query, namespace)
+        if value is None:
+            value = search(query)
+            if value is not None:
+                self.set(query, value, namespace)
+        return value
+
+    def cached(self, namespace=""):
+        """Decorator for a search function taking the query as first argument."""
+        def decorator(search):
+            @functools.wraps(search)
+            def wrapper(search_query, *args, **kwargs):
+                if search_query is None:
+                    return search(search_query, *args, **kwargs)
+                return self.get_or_search(search_query, lambda q: search(q, *args, **kwargs), namespace)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.memo),
+        }
+
+    def clear(self):
+        with self.lock:
+            self.memo.clear()
+            self.touched.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM search_cache")
+                self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self._purge(time.time())
+                self.conn.close()
+                self.conn = None
+
+
+# shared by every session of a Streamlit process; SEARCH_CACHE_PATH adds the
+# SQLite tier shared across processes
+search_cache = SearchCache(path=os.getenv("SEARCH_CACHE_PATH"), ttl=float(os.getenv("SEARCH_CACHE_TTL", DEFAULT_TTL)))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled HTTP client for SERP APIs (VALUE SERP by default, SerpApi takes the
+same requests with other params, see search_backends.py).
+
+One requests.Session per process keeps connections alive between calls (and
+between Streamlit reruns, the module is only imported once), so only the first
+search pays for the TCP + TLS handshake. Transient failures (connection
+errors, 429 and 5xx) are retried with exponential backoff and every request
+has a connect and read timeout. The API is asked for the organic results only
+and only the link / snippet of the first `num` results are kept.
+"""
+
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+VALUESERP_ENDPOINT = "https://api.valueserp.com/search"
+# include_fields: skip ads, knowledge graph, related searches... in the response
+DEFAULT_PARAMS = {"google_domain": "google.com", "gl": "ca", "include_fields": "organic_results"}
+DEFAULT_NUM_RESULTS = 3
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 10.0)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.3
+DEFAULT_POOL_SIZE = 16
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(["GET"]), respect_retry_after_header=True)
+    # pool_maxsize covers the tool executor threads searching at the same time
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+    """Process wide session for these settings (requests.Session is safe to share
+    between threads for plain GETs)."""
+    key = (retries, backoff, pool_size)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = make_session(retries, backoff, pool_size)
+        return _sessions[key]
+
+
+def organic_results(data, num=DEFAULT_NUM_RESULTS):
+    """link / snippet of the first num organic results that have both."""
+    results = []
+    for item in data.get("organic_results") or ():
+        if item.get("link") and item.get("snippet"):
+            results.append({"link": item["link"], "snippet": item["snippet"]})
+            if len(results) == num:
+                break
+    return results
+
+
+class SearchClient:
+    def __init__(self, api_key, endpoint=VALUESERP_ENDPOINT, params=None, timeout=DEFAULT_TIMEOUT, session=None):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.params = dict(DEFAULT_PARAMS if params is None else params)
+        self.timeout = timeout
+        self.session = session or get_session()
+
+    def search(self, query, num=DEFAULT_NUM_RESULTS):
+        """Top num organic results of query as [{"link", "snippet"}]."""
+        params = {
+            **self.params,
+            "api_key": self.api_key,
+            "q": query,
+            "num": num,
+        }
+        response = self.session.get(self.endpoint, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return organic_results(response.json(), num)
+
+    def search_json(self, query, num=DEFAULT_NUM_RESULTS):
+        """search() serialized for a tool message."""
+        return json.dumps(self.search(query, num), separators=(",", ":"))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming chat completions with function calling.
+
+Text deltas are yielded as soon as they arrive, so they can go straight to
+st.write_stream. Tool calls come in fragments (`delta.tool_calls`, keyed by
+`index`, several calls possibly interleaved); they are stitched back together
+per index and each call is handed to the ToolExecutor as soon as its
+arguments are complete JSON, while the rest of the response is still
+streaming. Once the tools are done, the follow-up answer is streamed the same
+way.
+
+    engine = StreamingChatEngine(client, model, tools, {"search_internet": search_internet})
+    answer = st.write_stream(engine.stream(messages))
+"""
+
+import json
+
+from ChatEngine.tool_executor import ToolExecutor
+
+DEFAULT_MAX_TOOL_ROUNDS = 3
+
+
+class ToolCallAccumulator:
+    """Rebuilds the tool calls of one streamed response from their fragments."""
+
+    def __init__(self):
+        # index -> {"id", "type", "function": {"name", "arguments"}}
+        self.calls = {}
+        self.completed = set()
+
+    def add(self, fragments):
+        """Merge delta.tool_calls; returns the indexes whose arguments just became complete."""
+        ready = []
+        for fragment in fragments:
+            call = self.calls.setdefault(fragment.index, {"id": None, "type": "function",
+                                                          "function": {"name": "", "arguments": ""}})
+            if fragment.id:
+                call["id"] = fragment.id
+            if fragment.type:
+                call["type"] = fragment.type
+            function = fragment.function
+            if function is not None:
+                if function.name:
+                    call["function"]["name"] += function.name
+                if function.arguments:
+                    call["function"]["arguments"] += function.arguments
+            if self._is_complete(fragment.index):
+                ready.append(fragment.index)
+        return ready
+
+    def _is_complete(self, index):
+        if index in self.completed:
+            return False
+        call = self.calls[index]
+        if not call["id"] or not call["function"]["name"]:
+            return False
+        # an object is only valid JSON once its closing brace has arrived
+        try:
+            json.loads(call["function"]["arguments"])
+        except ValueError:
+            return False
+        self.completed.add(index)
+        return True
+
+    def finish(self):
+        """Indexes not reported complete yet (the stream has ended, run them as they are)."""
+        remaining = [index for index in sorted(self.calls) if index not in self.completed]
+        self.completed.update(remaining)
+        return remaining
+
+    def tool_calls(self):
+        return [self.calls[index] for index in sorted(self.calls)]
+
+
+class StreamingChatEngine:
+    """Streams a chat turn, running the tool calls the model makes on the way.
+
+    After stream() is exhausted, `new_messages` holds the messages the turn
+    added (assistant tool calls, tool results, final assistant answer) and
+    `content` the final answer. Tools run on `executor`, by default a
+    ToolExecutor over `functions`."""
+
+    def __init__(self, client, model, tools=None, functions=None, executor=None,
+                 max_tool_rounds=DEFAULT_MAX_TOOL_ROUNDS, on_tool_call=None, on_tool_results=None):
+        self.client = client
+        self.model = model
+        self.tools = tools
+        self.executor = executor or ToolExecutor(functions or {})
+        self.max_tool_rounds = max_tool_rounds
+        # called with the tool call dict when a tool starts, e.g. to show a spinner
+        self.on_tool_call = on_tool_call
+        # called with the tool messages once every call of a round has returned
+        self.on_tool_results = on_tool_results
+        self.new_messages = []
+        self.content = ""
+
+    def stream(self, messages, **params):
+        """Yield the text of the answer to `messages` (not modified) as it streams."""
+        self.new_messages = []
+        self.content = ""
+        conversation = list(messages)
+        for round_ in range(self.max_tool_rounds + 1):
+            request = dict(params)
+            # the last round must answer, no more tools
+            if self.tools and round_ < self.max_tool_rounds:
+                request.update(tools=self.tools, tool_choice="auto")
+            accumulator = ToolCallAccumulator()
+            running = {}
+            parts = []
+            for chunk in self.client.chat.completions.create(model=self.model, messages=conversation, stream=True, **request):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    parts.append(delta.content)
+                    yield delta.content
+                if delta.tool_calls:
+                    for index in accumulator.add(delta.tool_calls):
+                        running[index] = self._start(accumulator.calls[index])
+            for index in accumulator.finish():
+                running[index] = self._start(accumulator.calls[index])
+
+            content = "".join(parts)
+            if not accumulator.calls:
+                self.content = content
+                self.new_messages.append({"role": "assistant", "content": content})
+                return
+            turn = [{"role": "assistant", "content": content or None, "tool_calls": accumulator.tool_calls()}]
+            # results go back in the order of the calls in the assistant message
+            turn.extend(self.executor.result(running[index]).to_message() for index in sorted(accumulator.calls))
+            self.new_messages.extend(turn)
+            conversation.extend(turn)
+            if self.on_tool_results is not None:
+                self.on_tool_results(turn[1:])
+
+    def _start(self, call):
+        if self.on_tool_call is not None:
+            self.on_tool_call(call)
+        return self.executor.submit(call)
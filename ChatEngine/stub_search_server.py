@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the VALUE SERP search API, for benchmarks and load tests.
+
+Answers GET /search with a SERP shaped payload (metadata, ads, knowledge graph,
+related searches and 10 organic results). `include_fields` is honoured like the
+real API. New connections pay `handshake_delay` seconds once, standing in for
+the TCP + TLS setup a client without keep-alive pays on every call, and every
+request pays `latency` seconds.
+
+    python -m ChatEngine.stub_search_server --port 8090
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def serp_payload(query, n_results=10):
+    organic = [{
+        "position": i + 1,
+        "title": f"{query} - result {i + 1}",
+        "link": f"https://example.com/{i + 1}?q={query.replace(' ', '+')}",
+        "domain": "example.com",
+        "displayed_link": f"https://example.com > {i + 1}",
+        "snippet": f"Snippet {i + 1} for {query}: the quarterly dividend declared was $1.0{i} per common share.",
+        "prerender": False,
+        "cached_page_link": f"https://webcache.example.com/{i + 1}",
+        "block_position": i + 1,
+    } for i in range(n_results)]
+    return {
+        "request_info": {"success": True, "credits_used": 1, "credits_remaining": 999},
+        "search_metadata": {"created_at": "2024-01-01T00:00:00.000Z", "processed_at": "2024-01-01T00:00:01.000Z",
+                            "total_time_taken": 1.2, "engine_url": f"https://www.google.com/search?q={query}"},
+        "search_parameters": {"q": query, "google_domain": "google.com", "gl": "ca", "engine": "google"},
+        "search_information": {"original_query_yields_zero_results": False, "total_results": 123000000,
+                               "time_taken_displayed": 0.42},
+        "ads": [{"position": i + 1, "title": f"Ad {i + 1}", "link": f"https://ads.example.com/{i}",
+                 "description": "Open an account today. " * 10} for i in range(4)],
+        "knowledge_graph": {"title": query, "type": "Bank", "description": "A bank. " * 60,
+                            "known_attributes": [{"attribute": f"attr_{i}", "value": "value " * 5} for i in range(20)]},
+        "related_searches": [{"query": f"{query} related {i}", "link": f"https://www.google.com/search?q=r{i}"}
+                             for i in range(8)],
+        "organic_results": organic,
+        "pagination": {"current": 1, "next": "https://www.google.com/search?start=10"},
+    }
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body go out as two writes, don't let Nagle hold the second back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count("connections")
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.count("requests")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path != "/search" or "q" not in query:
+            body, status = {"request_info": {"success": False, "message": "q is required"}}, 400
+        else:
+            body, status = serp_payload(query["q"]), 200
+            if "include_fields" in query:
+                fields = set(query["include_fields"].split(",")) | {"request_info"}
+                body = {k: v for k, v in body.items() if k in fields}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, handshake_delay=0.0):
+        super().__init__(address, StubSearchHandler)
+        self.latency = latency
+        self.handshake_delay = handshake_delay
+        self.counters = {"connections": 0, "requests": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/search"
+
+
+def serve_in_thread(port=0, latency=0.0, handshake_delay=0.0):
+    server = StubSearchServer(("127.0.0.1", port), latency, handshake_delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the VALUE SERP search API.")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--handshake-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubSearchServer(("127.0.0.1", args.port), args.latency, args.handshake_delay)
+    print(f"Serving on {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent execution of the tool calls of one model turn.
+
+Every call is dispatched to a thread pool as soon as it is known, so a turn
+asking for several searches costs about the slowest round-trip instead of
+their sum. Each call gets its own timeout; a call that fails or times out
+becomes an error tool message ({"error": ...}) so the model can still answer
+from the others. Results always come back in the order of the tool calls of
+the assistant message.
+
+    executor = ToolExecutor({"search_internet": search_internet})
+    for result in executor.run(response_message.tool_calls):
+        messages.append(result.to_message())
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_TIMEOUT = 15.0
+
+
+@dataclass
+class ToolResult:
+    tool_call_id: str
+    name: str
+    content: str
+    ok: bool = True
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+    def to_message(self):
+        return {"tool_call_id": self.tool_call_id, "role": "tool", "name": self.name, "content": self.content}
+
+
+@dataclass
+class PendingCall:
+    tool_call_id: str
+    name: str
+    future: object
+    started: float
+    finished: Optional[float] = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+
+def call_fields(tool_call):
+    """(id, function name, arguments) of a tool call, either an SDK object or a dict."""
+    if isinstance(tool_call, dict):
+        return tool_call["id"], tool_call["function"]["name"], tool_call["function"]["arguments"]
+    return tool_call.id, tool_call.function.name, tool_call.function.arguments
+
+
+def _invoke(function, arguments):
+    result = function(**json.loads(arguments or "{}"))
+    return result if isinstance(result, str) else json.dumps(result)
+
+
+class ToolExecutor:
+    """Runs tool calls on a shared thread pool with a per-call timeout."""
+
+    def __init__(self, functions, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.functions = functions
+        self.timeout = timeout
+        # timed out calls cannot be interrupted, they finish in the background
+        # instead of blocking the turn, hence a long-lived pool
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def submit(self, tool_call):
+        """Start one tool call; pass the returned PendingCall to result()."""
+        tool_call_id, name, arguments = call_fields(tool_call)
+        function = self.functions.get(name)
+        if function is None:
+            future = self._pool.submit(_unknown_function, name)
+        else:
+            future = self._pool.submit(_invoke, function, arguments)
+        pending = PendingCall(tool_call_id, name, future, time.perf_counter())
+        future.add_done_callback(lambda _: setattr(pending, "finished", time.perf_counter()))
+        return pending
+
+    def result(self, pending):
+        """Wait for a call until its timeout (counted from submit) and return its ToolResult."""
+        remaining = max(0.0, pending.started + self.timeout - time.perf_counter())
+        try:
+            content = pending.future.result(timeout=remaining)
+        except TimeoutError:
+            pending.future.cancel()
+            error = f"timed out after {self.timeout:.0f}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            return ToolResult(pending.tool_call_id, pending.name, content, seconds=pending.seconds)
+        return ToolResult(pending.tool_call_id, pending.name, json.dumps({"error": f"{pending.name} failed: {error}"}),
+                          ok=False, error=error, seconds=pending.seconds)
+
+    def run(self, tool_calls):
+        """Run all tool_calls concurrently; ToolResults in the same order."""
+        pending = [self.submit(tool_call) for tool_call in tool_calls]
+        return [self.result(p) for p in pending]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _unknown_function(name):
+    raise KeyError(f"unknown function {name}")
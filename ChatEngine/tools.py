@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tools the chat model can call, shared by the Streamlit UIs.
+"""
+
+from ChatEngine.search_cache import search_cache
+
+SEARCH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_internet",
+        "description": "Search the internet for the search_query on Finance.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "search_query": {
+                    "type": "string",
+                    "description": "The query to search for on the internet."
+                }
+            },
+            "required": ["search_query"]
+        }
+    }
+}
+
+TOOLS = [SEARCH_TOOL]
+
+
+def make_search_internet(backend, cache=search_cache, num=3):
+    """search_internet tool function over a search backend (see search_backends.py),
+    cached by normalized query per backend."""
+
+    @cache.cached(backend.name)
+    def search_internet(search_query):
+        """Get the latest news from the internet on Finance for given search_query"""
+        if search_query is None:
+            print("LLM Didn't pass the argument")
+            return None
+        # link / snippet of the top organic results
+        return backend.search_json(search_query, num)
+
+    return search_internet
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Local fast path for simple Transactional questions.
+
+Lookups like "For the account number 901234, what is the balance amount and
+status" or "List all accounts with a status of 'Closed' and a withdrawal
+amount greater than $50,000" are answered from the TransactionStore without
+a model round trip, in the format of the fine-tuning answers:
+
+    Account: 901234
+    Balance Amount: $185,000
+    Status: Opened
+    ++++++++++++++++++
+    ...
+
+A question is only answered when every word of it is understood: the filters
+of txn_store.extract_filters, the names of the columns, "total" and a short
+list of filler words, and only when it asks for a field, a total or rows
+matching a condition ("Show account 345678" is not). Anything else ("with a note mentioning customer
+contact", "why", "compare", a number or a date the filters did not take) goes
+to the model as before, and so does a question no row matches: an empty
+result is more likely a misread question than a true "not found".
+
+    fast_path = TxnFastPath(TransactionStore.from_dataset())
+    result = fast_path.answer("What is the status of account 345678?")
+    result.answer  # None when the question needs the model
+
+    python -m ChatEngine.txn_fastpath --dataset ./Transactional/validation_DI_txn.jsonl
+"""
+
+import argparse
+import json
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from ChatEngine.txn_store import DEFAULT_TXN_DATASET, TransactionStore, extract_filters, strip_filters
+
+SEPARATOR = "++++++++++++++++++"
+# phrase -> (column, label), longest phrases first
+FIELDS = [
+    ("expected transfer days", ("expected_transfer_days", "Expected Transfer Days")),
+    ("transactional details", ("details", "Transactional Details")),
+    ("transaction details", ("details", "Transactional Details")),
+    ("withdrawal amount", ("withdrawal_amount", "Withdrawal Amount")),
+    ("deposit amount", ("deposit_amount", "Deposit Amount")),
+    ("balance amount", ("balance_amount", "Balance Amount")),
+    ("last note date", ("last_note_date", "Last Note Date")),
+    ("request date", ("request_date", "Request Date")),
+    ("transfer date", ("transfer_date", "Transfer Date")),
+    ("transfer days", ("expected_transfer_days", "Expected Transfer Days")),
+    ("last note", ("last_note_date", "Last Note Date")),
+    ("withdrawal", ("withdrawal_amount", "Withdrawal Amount")),
+    ("deposit", ("deposit_amount", "Deposit Amount")),
+    ("balance", ("balance_amount", "Balance Amount")),
+    ("details", ("details", "Transactional Details")),
+    ("status", ("status", "Status")),
+    ("note", ("note", "Note")),
+]
+_FIELD_PATTERN = re.compile(r"\b(" + "|".join(re.escape(phrase) for phrase, _ in FIELDS) + r")s?\b", re.IGNORECASE)
+_FIELD_BY_PHRASE = dict(FIELDS)
+_TOTAL = re.compile(r"\btotal\s+(withdrawal|deposit|balance)(?:\s+amounts?)?\b", re.IGNORECASE)
+# words that carry no condition in a lookup question
+FILLER = set("""
+a all an and answer any are as bullet by can current date dates days each for format from get give have i in is it its
+list lists me my number numbers of on only please point points provide show so tell that the their them these
+this those to what whats where which with you account accounts no amount amounts also along respective total sum
+""".split())
+_WORD = re.compile(r"[a-z]+|\d+")
+
+
+@dataclass
+class FastPathResult:
+    answer: Optional[str]
+    reason: str
+    n_rows: int
+    seconds: float
+
+    @property
+    def hit(self):
+        return self.answer is not None
+
+
+def format_field(column, value):
+    if value is None:
+        return "-"
+    if column.endswith("_amount"):
+        return f"${value:,.0f}"
+    return str(value)
+
+
+class TxnFastPath:
+    def __init__(self, store, max_rows=100):
+        self.store = store
+        self.max_rows = max_rows
+
+    def answer(self, question):
+        start = time.perf_counter()
+        answer, reason, n_rows = self._answer(question)
+        return FastPathResult(answer, reason, n_rows, time.perf_counter() - start)
+
+    def _answer(self, question):
+        filters = extract_filters(question, self.store.account_numbers)
+        rest = strip_filters(question, self.store.account_numbers)
+        total = _TOTAL.search(rest)
+        if total:
+            rest = rest[:total.start()] + " " + rest[total.end():]
+        fields = []
+        for match in _FIELD_PATTERN.finditer(rest):
+            field = _FIELD_BY_PHRASE[match.group(1).lower()]
+            if field not in fields:
+                fields.append(field)
+        rest = _FIELD_PATTERN.sub(" ", rest)
+        unknown = [word for word in _WORD.findall(rest.lower()) if word not in FILLER]
+        if unknown:
+            return None, "not understood: " + " ".join(unknown[:5]), 0
+        if not filters and not total:
+            return None, "no filter", 0
+        if not fields and not total and not (filters.amounts or filters.dates or filters.status or filters.details):
+            # "Show account 345678": nothing asked about the account but its number
+            return None, "no field", 0
+
+        rows = self.store.query(filters, limit=self.max_rows + 1)
+        if len(rows) > self.max_rows:
+            return None, "too many rows", len(rows)
+        if not rows:
+            return None, "no matching rows", 0
+        if total:
+            column = f"{total.group(1).lower()}_amount"
+            value = sum(getattr(row, column) or 0.0 for row in rows)
+            return f"Total {total.group(1).capitalize()} Amount: {format_field(column, value)}", "total", len(rows)
+
+        # a constraint on the value (account, status, details) is not repeated;
+        # compared fields are shown with their values
+        shown = [(column, label) for column, label in fields
+                 if not (column == "status" and filters.status) and not (column == "details" and filters.details)]
+        for column, operator, value in filters.amounts + filters.dates:
+            label = next(label for c, label in _FIELD_BY_PHRASE.values() if c == column)
+            if (column, label) not in shown:
+                shown.append((column, label))
+        accounts = [row.account_no for row in rows]
+        # an account with several requests: tell them apart by date
+        if len(set(accounts)) < len(accounts) and ("request_date", "Request Date") not in shown:
+            shown.insert(0, ("request_date", "Request Date"))
+        if len(rows) == 1 and filters.accounts and shown:
+            return "\n".join(f"{label}: {format_field(column, getattr(rows[0], column))}" for column, label in shown), "lookup", 1
+        blocks = ["\n".join([f"Account: {row.account_no}"] +
+                            [f"{label}: {format_field(column, getattr(row, column))}" for column, label in shown])
+                  for row in rows]
+        return f"\n{SEPARATOR}\n".join(blocks), "list", len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and latency of the transactional fast path.")
+    parser.add_argument("--dataset", default="./Transactional/validation_DI_txn.jsonl")
+    parser.add_argument("--table", default=DEFAULT_TXN_DATASET, help="dataset whose system prompt holds the table")
+    parser.add_argument("--repeat", type=int, default=1000, help="timed runs per question")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    fast_path = TxnFastPath(TransactionStore.from_dataset(args.table))
+    with open(args.dataset, 'r', encoding='utf-8') as f:
+        examples = [json.loads(line)["messages"] for line in f if line.strip()]
+    n_hits = 0
+    timings = []
+    for messages in examples:
+        question = next(m["content"] for m in messages if m["role"] == "user")
+        result = fast_path.answer(question)
+        for _ in range(args.repeat):
+            timings.append(fast_path.answer(question).seconds)
+        n_hits += result.hit
+        print(f"{'HIT ' if result.hit else 'MISS'} {result.reason:<32} {question[:80]}")
+        if args.verbose and result.hit:
+            print("  " + result.answer.replace("\n", "\n  "))
+    timings = np.array(timings) * 1e6
+    p50, p95 = np.percentile(timings, [50, 95])
+    print(f"\nHit rate {n_hits}/{len(examples)} ({n_hits / len(examples):.0%})")
+    print(f"Latency per question: mean {timings.mean():.0f} us, p50 {p50:.0f} us, p95 {p95:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
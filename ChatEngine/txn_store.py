@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Typed, indexed store for the Transactional task.
+
+The Transactional system prompt carries the whole markdown table of accounts,
+so the prompt grows with the book of accounts. TransactionStore parses that
+table once into SQLite (in memory by default, indexed on account number,
+request date and status) and builds the prompt of a question from the rows
+matching the filters found in it:
+- account numbers ("account number 901234", or a number of an account in
+  the store),
+- status ("status of 'Closed'", "where Status is 'opened'"),
+- date ranges on the date column the question names ("transfer date after
+  February 20, 2024", "request date before 2024-03-01"); a date whose column
+  is not named is not used as a filter,
+- amount / transfer days comparisons ("balance amount greater than $160,000",
+  "expected transfer days less than or equal to 20"),
+- transaction details ("Transaction details is 'Deposited funds from RBC'").
+Text the filters cannot express (e.g. "a note mentioning customer contact")
+is left to the model over the filtered rows. At most `max_rows` matching rows
+are injected, and the prompt says so when more rows match. The whole table is
+sent when there is nothing to filter on, since a total or a count over a
+truncated table would be wrong. It is also sent when "or" joins two filters
+(they are not all required), and when no row matches: a filter that misread
+the question must not hide the answer from the model.
+
+    store = TransactionStore.from_dataset("./Transactional/training_DI_txn.jsonl")
+    system_prompt = store.system_prompt("List all accounts with a status of 'Closed'")
+
+    python -m ChatEngine.txn_store "For the account number 901234, what is the balance amount?"
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Optional
+
+DEFAULT_TXN_DATASET = "./Transactional/training_DI_txn.jsonl"
+DEFAULT_MAX_ROWS = 50
+TABLE_MARKER = "Transactional Data :"
+
+# markdown header -> (column, type)
+COLUMNS = {
+    "Account No": ("account_no", "TEXT"),
+    "Request Date": ("request_date", "DATE"),
+    "Transactional Details": ("details", "TEXT"),
+    "Transfer Date": ("transfer_date", "DATE"),
+    "Withdrawal Amount": ("withdrawal_amount", "REAL"),
+    "Deposit Amount": ("deposit_amount", "REAL"),
+    "Balance Amount": ("balance_amount", "REAL"),
+    "Expected Transfer Days": ("expected_transfer_days", "INTEGER"),
+    "Status": ("status", "TEXT"),
+    "Note": ("note", "TEXT"),
+    "Last Note Date": ("last_note_date", "DATE"),
+}
+HEADERS = list(COLUMNS)
+COLUMN_NAMES = [name for name, _ in COLUMNS.values()]
+
+_COMPARISONS = [
+    ("greater than or equal to", ">="), ("less than or equal to", "<="), ("at least", ">="), ("at most", "<="),
+    ("greater than", ">"), ("more than", ">"), ("over", ">"), ("above", ">"),
+    ("less than", "<"), ("under", "<"), ("below", "<"), ("equal to", "="), ("of", "="),
+]
+_NUMERIC_COLUMNS = {
+    "withdrawal": "withdrawal_amount", "deposit": "deposit_amount", "balance": "balance_amount",
+    "expected transfer days": "expected_transfer_days", "transfer days": "expected_transfer_days",
+}
+_NUMERIC_FILTER = re.compile(
+    r"\b(expected transfer days|transfer days|withdrawal|deposit|balance)(?: amounts?)?\s+(?:is\s+|was\s+)?"
+    r"(" + "|".join(re.escape(words) for words, _ in _COMPARISONS) + r")\s+\$?\s*(\d[\d,]*(?:\.\d+)?)",
+    re.IGNORECASE,
+)
+_ACCOUNT = re.compile(r"\b(\d{6})\b")
+# "account 901234", "account number 901234", "account no. 901234", "account #901234"
+_ACCOUNT_REFERENCE = re.compile(r"\baccounts?\s*(?:number|no\.?|#)?\s*:?\s*#?$", re.IGNORECASE)
+_STATUS = re.compile(r"\bstatus\s+(?:of\s+|is\s+|=\s*)?['\"]?(opened|open|closed)\b", re.IGNORECASE)
+_DATE = r"(\d{4}-\d{2}-\d{2}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4})"
+_DATE_FILTER = re.compile(r"\b(?:(request|requested|transfer|transferred|last note)(?:\s+date)?\s+(?:is\s+|was\s+)?)?"
+                          r"(after|since|from|before|until|on)\s+" + _DATE, re.IGNORECASE)
+_DATE_COLUMNS = {"request": "request_date", "requested": "request_date", "transfer": "transfer_date",
+                 "transferred": "transfer_date", "last note": "last_note_date"}
+_DETAILS = re.compile(r"\b(?:transaction(?:al)?\s+details?)\s+(?:is|of|=|contains?|mentioning)\s+['\"]([^'\"]+)['\"]",
+                      re.IGNORECASE)
+_DATE_OPERATORS = {"after": ">", "since": ">=", "from": ">=", "before": "<", "until": "<=", "on": "="}
+_OR = re.compile(r"\bor\b", re.IGNORECASE)
+
+
+def parse_date(text):
+    text = text.replace(".", "").replace(",", "").strip()
+    for fmt in ("%Y-%m-%d", "%B %d %Y", "%b %d %Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_value(text, kind):
+    text = text.strip()
+    if text in ("", "-"):
+        return None
+    if kind == "DATE":
+        return parse_date(text)
+    if kind == "REAL":
+        return float(text.replace("$", "").replace(",", ""))
+    if kind == "INTEGER":
+        return int(text.replace(",", ""))
+    return text
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+@dataclass
+class Transaction:
+    account_no: str
+    request_date: Optional[date]
+    details: Optional[str]
+    transfer_date: Optional[date]
+    withdrawal_amount: Optional[float]
+    deposit_amount: Optional[float]
+    balance_amount: Optional[float]
+    expected_transfer_days: Optional[int]
+    status: Optional[str]
+    note: Optional[str]
+    last_note_date: Optional[date]
+
+    def to_markdown(self):
+        return "| " + " | ".join(format_value(getattr(self, name)) for name in COLUMN_NAMES) + " |"
+
+
+def parse_markdown_table(text):
+    """Transactions of the markdown table in text.
+
+    Cells may be missing at the end of a row (the last row of the fine-tuning
+    prompt stops at "| Closed | -"); they are read as "-"."""
+    lines = iter(text.splitlines())
+    for line in lines:
+        if line.strip().startswith("|") and "Account No" in line:
+            headers = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            break
+    else:
+        raise ValueError("no transactions table found")
+    kinds = [COLUMNS[header] for header in headers]
+    transactions = []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("|"):
+            break
+        if set(line) <= set("|-: "):
+            continue
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        cells += ["-"] * (len(headers) - len(cells))
+        values = {name: parse_value(cell, kind) for (name, kind), cell in zip(kinds, cells)}
+        transactions.append(Transaction(**{name: values.get(name) for name in COLUMN_NAMES}))
+    return transactions
+
+
+@dataclass
+class TxnFilters:
+    accounts: list = field(default_factory=list)
+    status: Optional[str] = None
+    # (column, operator, date)
+    dates: list = field(default_factory=list)
+    # (column, operator, value)
+    amounts: list = field(default_factory=list)
+    details: Optional[str] = None
+
+    def __bool__(self):
+        return bool(self.accounts or self.status or self.dates or self.amounts or self.details)
+
+    def where(self):
+        """SQL WHERE clause and parameters."""
+        clauses, params = [], []
+        if self.accounts:
+            clauses.append(f"account_no IN ({', '.join('?' * len(self.accounts))})")
+            params.extend(self.accounts)
+        if self.status:
+            clauses.append("status = ? COLLATE NOCASE")
+            params.append(self.status)
+        for column, operator, value in self.dates:
+            clauses.append(f"{column} {operator} ?")
+            params.append(value.isoformat())
+        for column, operator, value in self.amounts:
+            # "-" in an amount column means no withdrawal / deposit, i.e. 0
+            target = f"COALESCE({column}, 0)" if column.endswith("_amount") else column
+            clauses.append(f"{target} {operator} ?")
+            params.append(value)
+        if self.details:
+            clauses.append("details LIKE ?")
+            params.append(f"%{self.details}%")
+        return " AND ".join(clauses) or "1", params
+
+
+def _scan(question, known_accounts=None):
+    """(filters, spans of the question they were read from)."""
+    filters, spans = TxnFilters(), []
+    operators = dict(_COMPARISONS)
+    for match in _NUMERIC_FILTER.finditer(question):
+        column, comparison, value = match.groups()
+        filters.amounts.append((_NUMERIC_COLUMNS[column.lower()], operators[comparison.lower()], float(value.replace(",", ""))))
+        spans.append(match.span())
+    for match in _DATE_FILTER.finditer(question):
+        column, word, text = match.groups()
+        value = parse_date(text)
+        # a date alone ("after February 1") may be any of the three date columns
+        if value is not None and column is not None:
+            filters.dates.append((_DATE_COLUMNS[column.lower()], _DATE_OPERATORS[word.lower()], value))
+            spans.append(match.span())
+    for match in _ACCOUNT.finditer(question):
+        if any(start <= match.start() < end for start, end in spans):
+            continue
+        number = match.group(1)
+        if _ACCOUNT_REFERENCE.search(question[:match.start()]) or (known_accounts is not None and number in known_accounts):
+            if number not in filters.accounts:
+                filters.accounts.append(number)
+            spans.append(match.span())
+    status = _STATUS.search(question)
+    if status:
+        filters.status = "Closed" if status.group(1).lower() == "closed" else "Opened"
+        spans.append(status.span())
+    details = _DETAILS.search(question)
+    if details:
+        filters.details = details.group(1)
+        spans.append(details.span())
+    return filters, spans
+
+
+def extract_filters(question, known_accounts=None):
+    """Filters of question; a 6-digit number is an account when it follows
+    "account (number|no|#)" or is in known_accounts."""
+    return _scan(question, known_accounts)[0]
+
+
+def joined_by_or(question, spans):
+    """True when "or" stands between two filter spans of question."""
+    spans = sorted(spans)
+    return any(_OR.search(question[end:start]) for (_, end), (start, _) in zip(spans, spans[1:]))
+
+
+def strip_filters(question, known_accounts=None):
+    """question without the text extract_filters understood."""
+    for start, end in sorted(_scan(question, known_accounts)[1], reverse=True):
+        question = question[:start] + " " + question[end:]
+    return question
+
+
+class TransactionStore:
+    def __init__(self, transactions=(), path=":memory:", instructions=""):
+        self.instructions = instructions
+        # Streamlit sessions run in their own threads, reads only after loading
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.values())
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS transactions (id INTEGER PRIMARY KEY, {columns})")
+        for column in ("account_no", "request_date", "status"):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS transactions_{column} ON transactions ({column})")
+        self.account_numbers = set()
+        self.add_many(transactions)
+
+    @classmethod
+    def from_system_prompt(cls, system_prompt, **kwargs):
+        """Store of the table in a Transactional system prompt; the text before the
+        table is kept as the instructions of the prompts built later."""
+        instructions = system_prompt.split(TABLE_MARKER)[0] if TABLE_MARKER in system_prompt else ""
+        return cls(parse_markdown_table(system_prompt), instructions=instructions, **kwargs)
+
+    @classmethod
+    def from_dataset(cls, path=DEFAULT_TXN_DATASET, **kwargs):
+        with open(path, 'r', encoding='utf-8') as f:
+            first = json.loads(f.readline())
+        system_prompt = next(m["content"] for m in first["messages"] if m["role"] == "system")
+        return cls.from_system_prompt(system_prompt, **kwargs)
+
+    def add_many(self, transactions):
+        transactions = list(transactions)
+        rows = [[t.isoformat() if isinstance(t, date) else t for t in (getattr(txn, name) for name in COLUMN_NAMES)]
+                for txn in transactions]
+        self.account_numbers.update(txn.account_no for txn in transactions)
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO transactions ({', '.join(COLUMN_NAMES)}) VALUES ({', '.join('?' * len(COLUMN_NAMES))})", rows)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def count(self, filters=None):
+        where, params = (filters or TxnFilters()).where()
+        return self.conn.execute(f"SELECT COUNT(*) FROM transactions WHERE {where}", params).fetchone()[0]
+
+    def query(self, filters=None, limit=DEFAULT_MAX_ROWS):
+        """Rows matching filters, in table order; limit None for all of them."""
+        where, params = (filters or TxnFilters()).where()
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(COLUMN_NAMES)} FROM transactions WHERE {where} ORDER BY id LIMIT ?",
+            params + [-1 if limit is None else limit])
+        transactions = []
+        for row in cursor:
+            values = dict(zip(COLUMN_NAMES, row))
+            for name, kind in COLUMNS.values():
+                if kind == "DATE" and values[name] is not None:
+                    values[name] = date.fromisoformat(values[name])
+            transactions.append(Transaction(**values))
+        return transactions
+
+    @staticmethod
+    def to_markdown(transactions):
+        lines = ["| " + " | ".join(HEADERS) + " |", "|" + "|".join("-" * (len(h) + 2) for h in HEADERS) + "|"]
+        return "\n".join(lines + [txn.to_markdown() for txn in transactions])
+
+    def system_prompt(self, question, max_rows=DEFAULT_MAX_ROWS):
+        """The Transactional system prompt with only the rows relevant to question."""
+        return self.system_prompt_for(question, max_rows)[0]
+
+    def system_prompt_for(self, question, max_rows=DEFAULT_MAX_ROWS):
+        """(system prompt, filters, rows) for question; filters are empty when the
+        whole table is sent."""
+        filters, spans = _scan(question, self.account_numbers)
+        if joined_by_or(question, spans):
+            filters = TxnFilters()
+        rows = self.query(filters, limit=max_rows + 1) if filters else []
+        if not rows:
+            filters, rows = TxnFilters(), self.query(limit=None)
+        table = self.to_markdown(rows[:max_rows] if filters else rows)
+        if len(rows) > max_rows and filters:
+            table += (f"\n\nOnly {max_rows} of the {self.count(filters)} rows matching the question are shown;"
+                      " totals and counts over this table are incomplete.")
+            rows = rows[:max_rows]
+        return f"{self.instructions}{TABLE_MARKER}\n{table}", filters, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rows and prompt size the transaction store sends for a question.")
+    parser.add_argument("questions", nargs="*")
+    parser.add_argument("--dataset", default=DEFAULT_TXN_DATASET)
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    args = parser.parse_args()
+
+    with open(args.dataset, 'r', encoding='utf-8') as f:
+        examples = [json.loads(line)["messages"] for line in f if line.strip()]
+    full_prompt = next(m["content"] for m in examples[0] if m["role"] == "system")
+    store = TransactionStore.from_system_prompt(full_prompt)
+    questions = args.questions or list(dict.fromkeys(m["content"] for ex in examples for m in ex if m["role"] == "user"))
+    print(f"{len(store)} transactions, full prompt {len(full_prompt)} chars")
+    for question in questions:
+        prompt, filters, rows = store.system_prompt_for(question, args.max_rows)
+        print(f"\n{question}\n  filters: {filters.where()}\n  {len(rows)} rows, {len(prompt)} chars "
+              f"({len(prompt) / len(full_prompt):.0%} of the full prompt)")
+
+
+if __name__ == "__main__":
+    main()
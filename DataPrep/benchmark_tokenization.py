@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the parallel tokenization in complete_data_prep_analysis.
+
+Writes a synthetic JSONL (1M examples by default) built from the queue, DI QnA
+and Transactional training rows, then times the streaming analysis with an
+increasing number of workers and prints the speedup over a single process.
+
+    python -m DataPrep.benchmark_tokenization --examples 1000000 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from DataPrep.fine_tuning_data_prep_analysis import complete_data_prep_analysis
+
+SOURCE_FILES = [
+    './queue/training.jsonl',
+    './DI_QnA_Assistance/training_DI_QnA.jsonl',
+    './Transactional/training_DI_txn.jsonl',
+]
+
+
+def write_synthetic_dataset(path, n_examples, seed=0):
+    """Write n_examples rows sampled from the repo's training files, with the
+    user message perturbed so rows are not byte-identical."""
+    rows = []
+    for source in SOURCE_FILES:
+        with open(source, 'r', encoding='utf-8') as f:
+            rows.extend(json.loads(line) for line in f if line.strip())
+
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n_examples):
+            messages = [dict(m) for m in rng.choice(rows)["messages"]]
+            for message in messages:
+                if message["role"] == "user":
+                    message["content"] = f"{message['content']} (ref #{i})"
+            f.write(json.dumps({"messages": messages}) + "\n")
+
+
+def time_analysis(path, workers):
+    # no on-disk token cache: later runs would time cache hits, not tokenization
+    start = time.perf_counter()
+    complete_data_prep_analysis(path, streaming=True, workers=workers, cache_path=None, verbose=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--examples", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--data-path", help="reuse an existing JSONL instead of generating one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.data_path
+        if path is None:
+            path = os.path.join(tmp, "synthetic.jsonl")
+            print(f"Writing {args.examples} synthetic examples to {path}")
+            write_synthetic_dataset(path, args.examples)
+        print(f"File size: {os.path.getsize(path) / 1e6:.1f} MB")
+
+        baseline = None
+        print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}")
+        for workers in sorted(set(args.workers)):
+            elapsed = time_analysis(path, workers)
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
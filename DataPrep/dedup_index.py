@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Duplicate and train/validation leakage detection for fine-tuning JSONL files.
+
+Every example is reduced to its user + assistant text (the system prompt is
+shared by all rows of a task, so it is left out) and indexed twice:
+- an exact hash of the normalized text,
+- a MinHash signature over character shingles, bucketed with LSH banding, so
+  only examples sharing a band are compared and the scan stays sub-quadratic.
+
+Files are streamed in the order given; an example is a duplicate when it
+matches an earlier one, either in the same file or, for leakage, in an earlier
+file (pass the training file first, then validation).
+
+    python -m DataPrep.dedup_index ./queue/training.jsonl ./queue/validation.jsonl --remove --output-dir ./dedup
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from DataPrep.fine_tuning_data_prep_analysis import iter_jsonl
+from DataPrep.text_normalize import normalize_text
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+# candidates kept per LSH bucket, bounding the comparisons of a lookup on
+# templated data; rows left out of a full bucket are counted in the report
+DEFAULT_MAX_BUCKET_SIZE = 1000
+MAX_REPORTED_PAIRS = 20
+
+
+def example_text(ex, roles=("user", "assistant")):
+    """Normalized text of the messages of `roles`; "" when one of them is empty
+    after normalization, since all such rows would hash alike."""
+    messages = ex.get("messages") or [] if isinstance(ex, dict) else []
+    parts = []
+    for m in messages:
+        if isinstance(m, dict) and m.get("role") in roles and isinstance(m.get("content"), str):
+            content = normalize_text(m["content"])
+            if not content:
+                return ""
+            parts.append(f"{m['role']}: {content}")
+    return "\n".join(parts)
+
+
+class MinHasher:
+    """MinHash signatures with multiply-shift hashing, vectorized in NumPy."""
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        rng = np.random.default_rng(seed)
+        # odd multipliers: (a * x + b) >> 32 is a universal family on uint64
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def shingles(self, text):
+        k = self.shingle_size
+        if len(text) <= k:
+            return np.array([zlib.crc32(text.encode("utf-8"))], dtype=np.uint64)
+        data = text.encode("utf-8")
+        return np.unique(np.fromiter((zlib.crc32(data[i:i + k]) for i in range(len(data) - k + 1)),
+                                     dtype=np.uint64, count=len(data) - k + 1))
+
+    def signature(self, text):
+        x = self.shingles(text)
+        with np.errstate(over="ignore"):
+            hashed = (self.a[:, None] * x[None, :] + self.b[:, None]) >> np.uint64(32)
+        return hashed.min(axis=1).astype(np.uint32)
+
+
+@dataclass
+class DedupReport:
+    paths: list
+    n_examples: dict = field(default_factory=dict)
+    # (path, kind) -> count, kind is "exact" or "near"
+    within_file: dict = field(default_factory=lambda: defaultdict(int))
+    # (path, earlier path, kind) -> count
+    cross_file: dict = field(default_factory=lambda: defaultdict(int))
+    removed: dict = field(default_factory=lambda: defaultdict(int))
+    # rows with no text to compare, kept as they are
+    empty: dict = field(default_factory=lambda: defaultdict(int))
+    # indexed rows left out of at least one full LSH bucket: their later near
+    # duplicates can be missed
+    bucket_overflow: int = 0
+    output_paths: dict = field(default_factory=dict)
+    # a sample of (path, line, matched path, matched line, kind, similarity)
+    pairs: list = field(default_factory=list)
+
+    def print_report(self):
+        for path in self.paths:
+            print(f"{path}: {self.n_examples.get(path, 0)} examples, "
+                  f"{self.within_file[(path, 'exact')]} exact / {self.within_file[(path, 'near')]} near duplicates within the file")
+            if self.empty[path]:
+                print(f"{path}: {self.empty[path]} examples with an empty user or assistant text, not compared")
+        for (path, other, kind), n in sorted(self.cross_file.items()):
+            print(f"{path}: {n} {kind} duplicates of {other} (leakage)")
+        if not self.cross_file:
+            print("No overlap between files")
+        if self.bucket_overflow:
+            print(f"{self.bucket_overflow} examples were left out of full LSH buckets; near duplicates of them may be "
+                  f"missed (raise --max-bucket-size)")
+        for path, out in self.output_paths.items():
+            print(f"Wrote {out} ({self.removed[path]} examples removed)")
+        if self.pairs:
+            print("\nSample matches (path:line -> matched path:line, kind, similarity):")
+            for path, line, other, other_line, kind, similarity in self.pairs:
+                print(f"  {path}:{line} -> {other}:{other_line} {kind} {similarity:.2f}")
+
+
+class DedupIndex:
+    """Exact + MinHash/LSH index over the examples seen so far."""
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, threshold=DEFAULT_THRESHOLD,
+                 max_bucket_size=DEFAULT_MAX_BUCKET_SIZE):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        # None: no cap
+        self.max_bucket_size = max_bucket_size
+        self.bucket_overflow = 0
+        self.exact = {}
+        self.buckets = [dict() for _ in range(bands)]
+        self.signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.refs = []
+
+    def _store_signature(self, signature):
+        if len(self.refs) == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        self.signatures[len(self.refs)] = signature
+
+    def lookup_and_add(self, text, ref):
+        """Return (kind, matched ref, similarity) for the first earlier match of
+        text, or None; the example is only indexed when it is not a duplicate.
+        Empty text is never a match and is not indexed."""
+        if not text:
+            return None
+        exact_key = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+        if exact_key in self.exact:
+            return "exact", self.exact[exact_key], 1.0
+
+        signature = self.hasher.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = set()
+        for bucket, key in zip(self.buckets, band_keys):
+            candidates.update(bucket.get(key, ()))
+        if candidates:
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarity = (self.signatures[ids] == signature).mean(axis=1)
+            best = int(similarity.argmax())
+            if similarity[best] >= self.threshold:
+                return "near", self.refs[ids[best]], float(similarity[best])
+
+        idx = len(self.refs)
+        self._store_signature(signature)
+        self.refs.append(ref)
+        self.exact[exact_key] = ref
+        overflow = False
+        for bucket, key in zip(self.buckets, band_keys):
+            members = bucket.setdefault(key, [])
+            if self.max_bucket_size is None or len(members) < self.max_bucket_size:
+                members.append(idx)
+            else:
+                overflow = True
+        self.bucket_overflow += overflow
+        return None
+
+
+def find_duplicates(paths, remove=False, output_dir=None, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS,
+                    threshold=DEFAULT_THRESHOLD, verbose=True, max_bucket_size=DEFAULT_MAX_BUCKET_SIZE):
+    """Stream `paths` in order and report duplicates within and across files.
+
+    With remove=True a cleaned copy of every file is written (to output_dir,
+    default next to the input as <name>.dedup.jsonl) without the duplicates;
+    for cross-file matches the row of the later file (validation) is dropped."""
+    index = DedupIndex(num_perm, bands, threshold, max_bucket_size)
+    report = DedupReport(paths=list(paths))
+    for path in paths:
+        out = None
+        if remove:
+            name = os.path.splitext(os.path.basename(path))[0] + ".dedup.jsonl"
+            out_path = os.path.join(output_dir or os.path.dirname(path), name)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            report.output_paths[path] = out_path
+            out = open(out_path, 'w', encoding='utf-8')
+        try:
+            n = 0
+            for line_no, ex in enumerate(iter_jsonl(path), start=1):
+                n += 1
+                text = example_text(ex)
+                if not text:
+                    report.empty[path] += 1
+                match = index.lookup_and_add(text, (path, line_no))
+                if match is not None:
+                    kind, (other, other_line), similarity = match
+                    if other == path:
+                        report.within_file[(path, kind)] += 1
+                    else:
+                        report.cross_file[(path, other, kind)] += 1
+                    if len(report.pairs) < MAX_REPORTED_PAIRS:
+                        report.pairs.append((path, line_no, other, other_line, kind, similarity))
+                    if out is not None:
+                        report.removed[path] += 1
+                        continue
+                if out is not None:
+                    out.write(json.dumps(ex, ensure_ascii=False) + "\n")
+            report.n_examples[path] = n
+        finally:
+            if out is not None:
+                out.close()
+
+    report.bucket_overflow = index.bucket_overflow
+    if verbose:
+        report.print_report()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicates within and leakage across fine-tuning JSONL files.")
+    parser.add_argument("paths", nargs="+", help="files in priority order, e.g. training then validation")
+    parser.add_argument("--remove", action="store_true", help="write cleaned copies without the duplicates")
+    parser.add_argument("--output-dir")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="MinHash similarity for near duplicates")
+    parser.add_argument("--num-perm", type=int, default=DEFAULT_NUM_PERM)
+    parser.add_argument("--bands", type=int, default=DEFAULT_BANDS)
+    parser.add_argument("--max-bucket-size", type=int, default=DEFAULT_MAX_BUCKET_SIZE,
+                        help="candidates kept per LSH bucket, 0 for no cap")
+    args = parser.parse_args()
+    find_duplicates(args.paths, remove=args.remove, output_dir=args.output_dir, num_perm=args.num_perm,
+                    bands=args.bands, threshold=args.threshold, max_bucket_size=args.max_bucket_size or None)
+
+
+if __name__ == "__main__":
+    main()
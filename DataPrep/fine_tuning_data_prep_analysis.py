@@ -5,140 +5,528 @@ Created on Sat Apr 20 08:40:14 2024
 @author: Ishan
 """
 
+import hashlib
 import json
+import multiprocessing
+import os
 import tiktoken # for token counting
 import numpy as np
+from array import array
 from collections import defaultdict
+from DataPrep.prep_result import DataPrepResult
+from DataPrep.streaming_stats import RunningStats
+from DataPrep.token_cache import TokenCountCache
 
 # code taken from - https://cookbook.openai.com/examples/chat_finetuning_data_prep
 
-# Function to perform complete analysis of the dataset
-def complete_data_prep_analysis(data_path):
-    # Load the dataset
-    with open(data_path, 'r', encoding='utf-8') as f:
-        dataset = [json.loads(line) for line in f]
-
-    # Initial dataset stats
-    print("Num examples:", len(dataset))
-    print("First example:")
-    for message in dataset[0]["messages"]:
-        print(message)
-        
-
-
-    # Format error checks
-    format_errors = defaultdict(int)
-
-    for ex in dataset:
-        if not isinstance(ex, dict):
-            format_errors["data_type"] += 1
-            continue
-            
-        messages = ex.get("messages", None)
-        if not messages:
-            format_errors["missing_messages_list"] += 1
-            continue
-            
-        for message in messages:
-            if "role" not in message or "content" not in message:
-                format_errors["message_missing_key"] += 1
-            
-            if any(k not in ("role", "content", "name", "function_call", "weight") for k in message):
-                format_errors["message_unrecognized_key"] += 1
-            
-            if message.get("role", None) not in ("system", "user", "assistant", "function"):
-                format_errors["unrecognized_role"] += 1
-                
-            content = message.get("content", None)
-            function_call = message.get("function_call", None)
-            
-            if (not content and not function_call) or not isinstance(content, str):
-                format_errors["missing_content"] += 1
-        
-        if not any(message.get("role", None) == "assistant" for message in messages):
-            format_errors["example_missing_assistant_message"] += 1
-
-    if format_errors:
-        print("Found errors:")
-        for k, v in format_errors.items():
-            print(f"{k}: {v}")
-    else:
-        print("No errors found")
-        
+# Pricing and default n_epochs estimate
+MAX_TOKENS_PER_EXAMPLE = 4096
 
+TARGET_EPOCHS = 3
+MIN_TARGET_EXAMPLES = 100
+MAX_TARGET_EXAMPLES = 25000
+MIN_DEFAULT_EPOCHS = 1
+MAX_DEFAULT_EPOCHS = 25
 
-    encoding = tiktoken.get_encoding("cl100k_base")
+# Context windows the truncation report checks every example against
+CONTEXT_LIMITS = (4096, 8192, 16385, 65536, 128000)
+
+# Fixed token-length histogram bins; bin i is [edge i, edge i+1), the last one is open-ended
+TOKEN_HISTOGRAM_BINS = (0, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+HISTOGRAM_ROLES = ("system", "user", "assistant")
+
+# Tokenization: examples per encode_batch call, byte-range chunks per worker
+DEFAULT_BATCH_SIZE = 1000
+CHUNKS_PER_WORKER = 4
+
+# Incremental mode: sidecar checkpoint written next to the dataset
+CHECKPOINT_SUFFIX = ".prep_checkpoint.json"
+CHECKPOINT_VERSION = 2
+FINGERPRINT_BLOCK = 64 * 1024
+
+
+def iter_jsonl(data_path, start=0, end=None):
+    """Yield the examples of a JSONL file one at a time.
+
+    With start/end only the lines starting inside the byte range [start, end)
+    are read, so several workers can share one file."""
+    with open(data_path, 'rb') as f:
+        f.seek(start)
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def split_byte_ranges(data_path, n_chunks, start=0, end=None):
+    """Split [start, end) of a JSONL file into at most n_chunks byte ranges
+    aligned on line starts (start must itself be a line start)."""
+    if end is None:
+        end = os.path.getsize(data_path)
+    bounds = [start]
+    with open(data_path, 'rb') as f:
+        for i in range(1, n_chunks):
+            f.seek(start + (end - start) * i // n_chunks)
+            f.readline()  # move on to the start of the next line
+            pos = f.tell()
+            if bounds[-1] < pos < end:
+                bounds.append(pos)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def check_example_format(ex, format_errors):
+    """Count the format errors of one example into format_errors.
+
+    Returns False when the example has no usable messages list, i.e. no token
+    stats can be computed for it."""
+    if not isinstance(ex, dict):
+        format_errors["data_type"] += 1
+        return False
+
+    messages = ex.get("messages", None)
+    if not messages:
+        format_errors["missing_messages_list"] += 1
+        return False
+
+    for message in messages:
+        if "role" not in message or "content" not in message:
+            format_errors["message_missing_key"] += 1
+
+        if any(k not in ("role", "content", "name", "function_call", "weight") for k in message):
+            format_errors["message_unrecognized_key"] += 1
+
+        if message.get("role", None) not in ("system", "user", "assistant", "function"):
+            format_errors["unrecognized_role"] += 1
+
+        content = message.get("content", None)
+        function_call = message.get("function_call", None)
 
-    # not exact!
-    # simplified from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-    def num_tokens_from_messages(messages, tokens_per_message=3, tokens_per_name=1):
-        num_tokens = 0
+        if (not content and not function_call) or not isinstance(content, str):
+            format_errors["missing_content"] += 1
+
+    if not any(message.get("role", None) == "assistant" for message in messages):
+        format_errors["example_missing_assistant_message"] += 1
+    return True
+
+
+# not exact!
+# simplified from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def count_tokens_batch(batch_messages, encoding, tokens_per_message=3, tokens_per_name=1, num_threads=8, cache=None):
+    """Token counts of a batch of messages lists, as an int32 array of shape
+    (len(batch_messages), 1 + len(HISTOGRAM_ROLES)).
+
+    Column 0 is the total (num_tokens_from_messages), the next columns the
+    content tokens of the system / user / assistant messages. Every message
+    value of the batch goes through one encode_batch call and is encoded
+    exactly once; all counts are derived from the same encodings. With a
+    TokenCountCache only the values it has never seen are encoded."""
+    texts = []
+    for messages in batch_messages:
+        for message in messages:
+            for value in message.values():
+                texts.append(value if isinstance(value, str) else json.dumps(value))
+    if cache is not None:
+        lengths = iter(cache.count_batch(texts, num_threads=num_threads))
+    else:
+        lengths = iter([len(tokens) for tokens in encoding.encode_batch(texts, num_threads=num_threads)])
+
+    role_column = {role: i + 1 for i, role in enumerate(HISTOGRAM_ROLES)}
+    counts = np.zeros((len(batch_messages), 1 + len(HISTOGRAM_ROLES)), dtype=np.int32)
+    for row, messages in enumerate(batch_messages):
+        num_tokens = 3
         for message in messages:
             num_tokens += tokens_per_message
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
+            column = role_column.get(message.get("role"))
+            for key in message:
+                n = next(lengths)
+                num_tokens += n
                 if key == "name":
                     num_tokens += tokens_per_name
-        num_tokens += 3
-        return num_tokens
+                if key == "content" and column is not None:
+                    counts[row, column] += n
+        counts[row, 0] = num_tokens
+    return counts
+
+
+def token_histogram(values):
+    """Counts of values per TOKEN_HISTOGRAM_BINS bin."""
+    bins = np.searchsorted(TOKEN_HISTOGRAM_BINS, values, side='right') - 1
+    return np.bincount(bins, minlength=len(TOKEN_HISTOGRAM_BINS)).astype(np.int64)
 
-    def num_assistant_tokens_from_messages(messages):
-        num_tokens = 0
-        for message in messages:
-            if message["role"] == "assistant":
-                num_tokens += len(encoding.encode(message["content"]))
-        return num_tokens
-
-    def print_distribution(values, name):
-        print(f"\n#### Distribution of {name}:")
-        print(f"min / max: {min(values)}, {max(values)}")
-        print(f"mean / median: {np.mean(values)}, {np.median(values)}")
-        print(f"p5 / p95: {np.quantile(values, 0.1)}, {np.quantile(values, 0.9)}")
-
-
-    # Warnings and tokens counts
-    n_missing_system = 0
-    n_missing_user = 0
-    n_messages = []
-    convo_lens = []
-    assistant_message_lens = []
-
-    for ex in dataset:
-        messages = ex["messages"]
-        if not any(message["role"] == "system" for message in messages):
-            n_missing_system += 1
-        if not any(message["role"] == "user" for message in messages):
-            n_missing_user += 1
-        n_messages.append(len(messages))
-        convo_lens.append(num_tokens_from_messages(messages))
-        assistant_message_lens.append(num_assistant_tokens_from_messages(messages))
-        
-    print("Num examples missing system message:", n_missing_system)
-    print("Num examples missing user message:", n_missing_user)
-    print_distribution(n_messages, "num_messages_per_example")
-    print_distribution(convo_lens, "num_total_tokens_per_example")
-    print_distribution(assistant_message_lens, "num_assistant_tokens_per_example")
-    n_too_long = sum(l > 4096 for l in convo_lens)
-    print(f"\n{n_too_long} examples may be over the 4096 token limit, they will be truncated during fine-tuning")
-
-
-    # Pricing and default n_epochs estimate
-    MAX_TOKENS_PER_EXAMPLE = 4096
-
-    TARGET_EPOCHS = 3
-    MIN_TARGET_EXAMPLES = 100
-    MAX_TARGET_EXAMPLES = 25000
-    MIN_DEFAULT_EPOCHS = 1
-    MAX_DEFAULT_EPOCHS = 25
 
+def estimate_n_epochs(n_train_examples):
+    """Default n_epochs of a fine-tuning job; TARGET_EPOCHS for an empty dataset."""
     n_epochs = TARGET_EPOCHS
-    n_train_examples = len(dataset)
+    if n_train_examples <= 0:
+        return n_epochs
     if n_train_examples * TARGET_EPOCHS < MIN_TARGET_EXAMPLES:
         n_epochs = min(MAX_DEFAULT_EPOCHS, MIN_TARGET_EXAMPLES // n_train_examples)
     elif n_train_examples * TARGET_EPOCHS > MAX_TARGET_EXAMPLES:
         n_epochs = max(MIN_DEFAULT_EPOCHS, MAX_TARGET_EXAMPLES // n_train_examples)
+    return n_epochs
+
+
+class DataPrepStats:
+    """Running aggregates over (a part of) a dataset.
+
+    Partial stats computed by different workers are combined with merge().
+    With keep_lengths the per-example counts are also kept, in file order, as
+    compact int arrays (4 bytes per example and field)."""
+
+    def __init__(self, keep_lengths=False):
+        self.keep_lengths = keep_lengths
+        self.lengths = {
+            "valid": array('b'),
+            "n_messages": array('i'),
+            "convo_lens": array('i'),
+            "assistant_message_lens": array('i'),
+        } if keep_lengths else None
+        self.n_examples = 0
+        self.first_example = None
+        self.format_errors = defaultdict(int)
+        self.n_missing_system = 0
+        self.n_missing_user = 0
+        self.n_too_long = 0
+        self.n_billing_tokens_in_dataset = 0
+        self.n_messages = RunningStats()
+        self.convo_lens = RunningStats()
+        self.assistant_message_lens = RunningStats()
+        self.n_over_context_limit = np.zeros(len(CONTEXT_LIMITS), dtype=np.int64)
+        self.histograms = {name: np.zeros(len(TOKEN_HISTOGRAM_BINS), dtype=np.int64)
+                           for name in ("total",) + HISTOGRAM_ROLES}
+
+    def add_examples(self, examples, encoding, num_threads=8, cache=None):
+        valid = []
+        is_valid = []
+        for ex in examples:
+            self.n_examples += 1
+            if self.first_example is None and isinstance(ex, dict):
+                self.first_example = ex
+            ok = check_example_format(ex, self.format_errors)
+            is_valid.append(ok)
+            if ok:
+                valid.append(ex["messages"])
+
+        if self.keep_lengths:
+            self.lengths["valid"].frombytes(np.array(is_valid, dtype=np.int8).tobytes())
+        if not valid:
+            if self.keep_lengths:
+                for name in ("n_messages", "convo_lens", "assistant_message_lens"):
+                    self.lengths[name].frombytes(np.zeros(len(is_valid), dtype=np.int32).tobytes())
+            return
+
+        # everything below works on whole-batch arrays
+        counts = count_tokens_batch(valid, encoding, num_threads=num_threads, cache=cache)
+        convo_lens = counts[:, 0]
+        assistant_lens = counts[:, 1 + HISTOGRAM_ROLES.index("assistant")]
+        n_messages = np.fromiter((len(messages) for messages in valid), dtype=np.int32, count=len(valid))
+        has_system = np.fromiter((any(m.get("role") == "system" for m in messages) for messages in valid), dtype=bool, count=len(valid))
+        has_user = np.fromiter((any(m.get("role") == "user" for m in messages) for messages in valid), dtype=bool, count=len(valid))
+
+        if self.keep_lengths:
+            mask = np.array(is_valid, dtype=bool)
+            for name, values in (("n_messages", n_messages), ("convo_lens", convo_lens), ("assistant_message_lens", assistant_lens)):
+                full = np.zeros(len(is_valid), dtype=np.int32)
+                full[mask] = values
+                self.lengths[name].frombytes(full.tobytes())
+
+        self.n_missing_system += int(np.count_nonzero(~has_system))
+        self.n_missing_user += int(np.count_nonzero(~has_user))
+        self.n_messages.add_many(n_messages)
+        self.convo_lens.add_many(convo_lens)
+        self.assistant_message_lens.add_many(assistant_lens)
+        self.n_too_long += int(np.count_nonzero(convo_lens > MAX_TOKENS_PER_EXAMPLE))
+        self.n_billing_tokens_in_dataset += int(np.minimum(convo_lens, MAX_TOKENS_PER_EXAMPLE).sum(dtype=np.int64))
+        self.n_over_context_limit += (convo_lens[:, None] > np.asarray(CONTEXT_LIMITS)).sum(axis=0)
+        self.histograms["total"] += token_histogram(convo_lens)
+        for i, role in enumerate(HISTOGRAM_ROLES):
+            self.histograms[role] += token_histogram(counts[:, i + 1])
+
+    def merge(self, other):
+        if self.keep_lengths:
+            for name, values in self.lengths.items():
+                values.extend(other.lengths[name])
+        self.n_examples += other.n_examples
+        if self.first_example is None:
+            self.first_example = other.first_example
+        for k, v in other.format_errors.items():
+            self.format_errors[k] += v
+        self.n_missing_system += other.n_missing_system
+        self.n_missing_user += other.n_missing_user
+        self.n_too_long += other.n_too_long
+        self.n_billing_tokens_in_dataset += other.n_billing_tokens_in_dataset
+        self.n_messages.merge(other.n_messages)
+        self.convo_lens.merge(other.convo_lens)
+        self.assistant_message_lens.merge(other.assistant_message_lens)
+        self.n_over_context_limit += other.n_over_context_limit
+        for name, counts in other.histograms.items():
+            self.histograms[name] += counts
+
+    def to_result(self, data_path):
+        """Freeze the aggregates into a DataPrepResult.
+
+        Distributions are exact when the per-example lengths were kept, and
+        read from the quantile sketches otherwise."""
+        lengths = None
+        if self.keep_lengths:
+            lengths = {name: np.frombuffer(values, dtype=np.int8 if name == "valid" else np.int32)
+                       for name, values in self.lengths.items()}
+            lengths["valid"] = lengths["valid"].astype(bool)
+
+        distributions = {}
+        for name, attr in (("num_messages_per_example", "n_messages"),
+                           ("num_total_tokens_per_example", "convo_lens"),
+                           ("num_assistant_tokens_per_example", "assistant_message_lens")):
+            if lengths is not None:
+                distributions[name] = describe_distribution(lengths[attr][lengths["valid"]])
+            else:
+                distributions[name] = describe_running_stats(getattr(self, attr))
+
+        return DataPrepResult(
+            data_path=data_path,
+            n_examples=self.n_examples,
+            format_errors=dict(self.format_errors),
+            n_missing_system=self.n_missing_system,
+            n_missing_user=self.n_missing_user,
+            distributions=distributions,
+            n_too_long=self.n_too_long,
+            max_tokens_per_example=MAX_TOKENS_PER_EXAMPLE,
+            n_billing_tokens=self.n_billing_tokens_in_dataset,
+            n_epochs=estimate_n_epochs(self.n_examples),
+            n_over_context_limit={limit: int(n) for limit, n in zip(CONTEXT_LIMITS, self.n_over_context_limit)},
+            histograms={
+                "bin_edges": list(TOKEN_HISTOGRAM_BINS),
+                "counts": {name: counts.tolist() for name, counts in self.histograms.items()},
+            },
+            first_example=self.first_example,
+            valid=lengths["valid"] if lengths else None,
+            n_messages=lengths["n_messages"] if lengths else None,
+            convo_lens=lengths["convo_lens"] if lengths else None,
+            assistant_message_lens=lengths["assistant_message_lens"] if lengths else None,
+        )
+
+    def to_dict(self):
+        return {
+            "n_examples": self.n_examples,
+            "first_example": self.first_example,
+            "format_errors": dict(self.format_errors),
+            "n_missing_system": self.n_missing_system,
+            "n_missing_user": self.n_missing_user,
+            "n_too_long": self.n_too_long,
+            "n_billing_tokens_in_dataset": self.n_billing_tokens_in_dataset,
+            "n_messages": self.n_messages.to_dict(),
+            "convo_lens": self.convo_lens.to_dict(),
+            "assistant_message_lens": self.assistant_message_lens.to_dict(),
+            "n_over_context_limit": self.n_over_context_limit.tolist(),
+            "histograms": {name: counts.tolist() for name, counts in self.histograms.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.n_examples = data["n_examples"]
+        stats.first_example = data["first_example"]
+        stats.format_errors.update(data["format_errors"])
+        stats.n_missing_system = data["n_missing_system"]
+        stats.n_missing_user = data["n_missing_user"]
+        stats.n_too_long = data["n_too_long"]
+        stats.n_billing_tokens_in_dataset = data["n_billing_tokens_in_dataset"]
+        stats.n_messages = RunningStats.from_dict(data["n_messages"])
+        stats.convo_lens = RunningStats.from_dict(data["convo_lens"])
+        stats.assistant_message_lens = RunningStats.from_dict(data["assistant_message_lens"])
+        stats.n_over_context_limit = np.array(data["n_over_context_limit"], dtype=np.int64)
+        stats.histograms = {name: np.array(counts, dtype=np.int64) for name, counts in data["histograms"].items()}
+        return stats
+
+
+def describe_distribution(values):
+    """min / max / mean / median / p5 / p95 of the lengths in one vectorized pass."""
+    values = np.asarray(values, dtype=np.int32)
+    if values.size == 0:
+        return None
+    p0, p5, p50, p95, p100 = np.percentile(values, [0, 5, 50, 95, 100])
+    return {
+        "min": int(p0),
+        "max": int(p100),
+        "mean": float(values.mean(dtype=np.float64)),
+        "median": float(p50),
+        "p5": float(p5),
+        "p95": float(p95),
+    }
+
+
+def describe_running_stats(stats):
+    if stats.count == 0:
+        return None
+    return {
+        "min": stats.min,
+        "max": stats.max,
+        "mean": stats.mean(),
+        "median": stats.quantile(0.5),
+        "p5": stats.quantile(0.05),
+        "p95": stats.quantile(0.95),
+    }
+
+
+def iter_batches(examples, batch_size):
+    batch = []
+    for ex in examples:
+        batch.append(ex)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def analyze_byte_range(data_path, start=0, end=None, batch_size=DEFAULT_BATCH_SIZE, num_threads=8,
+                       cache_path=None, keep_lengths=False):
+    """Compute the DataPrepStats of the lines starting in [start, end) of data_path."""
+    encoding = tiktoken.get_encoding("cl100k_base")
+    cache = TokenCountCache(encoding, cache_path)
+    stats = DataPrepStats(keep_lengths)
+    try:
+        for batch in iter_batches(iter_jsonl(data_path, start, end), batch_size):
+            stats.add_examples(batch, encoding, num_threads=num_threads, cache=cache)
+    finally:
+        cache.close()
+    return stats
+
+
+def _analyze_byte_range_worker(args):
+    data_path, start, end, batch_size, cache_path, keep_lengths = args
+    # the process pool already gives the parallelism, don't oversubscribe cores
+    return analyze_byte_range(data_path, start, end, batch_size, num_threads=1, cache_path=cache_path, keep_lengths=keep_lengths)
+
+
+def compute_stats(data_path, start=0, end=None, workers=1, batch_size=DEFAULT_BATCH_SIZE, cache_path=None,
+                  keep_lengths=False):
+    """DataPrepStats of the lines starting in [start, end), using `workers` processes.
+
+    With workers > 1 the range is split into byte-range chunks that are
+    tokenized in a process pool, and the partial stats are merged in file order."""
+    if end is None:
+        end = os.path.getsize(data_path)
+    if workers <= 1:
+        return analyze_byte_range(data_path, start, end, batch_size=batch_size, cache_path=cache_path, keep_lengths=keep_lengths)
+
+    # a few chunks per worker so a slow chunk doesn't leave cores idle
+    ranges = split_byte_ranges(data_path, workers * CHUNKS_PER_WORKER, start, end)
+    stats = DataPrepStats(keep_lengths)
+    with multiprocessing.Pool(workers) as pool:
+        for partial in pool.imap(_analyze_byte_range_worker,
+                                 [(data_path, chunk_start, chunk_end, batch_size, cache_path, keep_lengths)
+                                  for chunk_start, chunk_end in ranges]):
+            stats.merge(partial)
+    return stats
+
+
+def checkpoint_path_for(data_path):
+    return data_path + CHECKPOINT_SUFFIX
+
+
+def file_fingerprint(data_path, offset):
+    """Cheap fingerprint of the first `offset` bytes of a file: its length plus
+    hashes of the first and last FINGERPRINT_BLOCK bytes of that prefix."""
+    with open(data_path, 'rb') as f:
+        head = f.read(min(offset, FINGERPRINT_BLOCK))
+        tail_start = max(0, offset - FINGERPRINT_BLOCK)
+        f.seek(tail_start)
+        tail = f.read(offset - tail_start)
+    return {
+        "offset": offset,
+        "head": hashlib.sha256(head).hexdigest(),
+        "tail": hashlib.sha256(tail).hexdigest(),
+    }
+
+
+def load_checkpoint(data_path, checkpoint_path):
+    """Return (offset, stats) from a checkpoint whose prefix still matches
+    data_path, or (0, None) when the file was rewritten or never analyzed."""
+    if not os.path.exists(checkpoint_path):
+        return 0, None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        return 0, None
+    fingerprint = checkpoint["fingerprint"]
+    offset = fingerprint["offset"]
+    if os.path.getsize(data_path) < offset or file_fingerprint(data_path, offset) != fingerprint:
+        return 0, None
+    return offset, DataPrepStats.from_dict(checkpoint["stats"])
+
+
+def save_checkpoint(data_path, checkpoint_path, offset, stats):
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "data_path": os.path.abspath(data_path),
+        "fingerprint": file_fingerprint(data_path, offset),
+        "stats": stats.to_dict(),
+    }
+    # write then rename so an interrupted run never leaves a broken sidecar
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def incremental_data_prep_analysis(data_path, workers=1, batch_size=DEFAULT_BATCH_SIZE, cache_path=None,
+                                   checkpoint_path=None, verbose=True):
+    """Streaming analysis that only reads what was appended since the last run.
+
+    The running aggregates and the byte offset they cover are kept in a sidecar
+    checkpoint next to the file. When the analyzed prefix is unchanged only the
+    new tail is tokenized and merged into the stored stats; otherwise (file
+    rewritten, truncated, or no checkpoint yet) the whole file is scanned."""
+    if checkpoint_path is None:
+        checkpoint_path = checkpoint_path_for(data_path)
+    offset, stats = load_checkpoint(data_path, checkpoint_path)
+    if stats is None:
+        if verbose:
+            print("No usable checkpoint, analyzing the whole file")
+        stats = DataPrepStats()
+
+    end = os.path.getsize(data_path)
+    if end > offset:
+        if verbose:
+            print(f"Analyzing bytes {offset}-{end} of {data_path}")
+        stats.merge(compute_stats(data_path, offset, end, workers=workers, batch_size=batch_size, cache_path=cache_path))
+        save_checkpoint(data_path, checkpoint_path, end, stats)
+    elif verbose:
+        print("No new examples since the last checkpoint")
+    return stats
+
+
+# Function to perform complete analysis of the dataset
+def complete_data_prep_analysis(data_path, streaming=False, workers=1, cache_path=None, incremental=False,
+                                keep_lengths=None, verbose=True):
+    """Validate a fine-tuning JSONL file and count its tokens.
+
+    Returns a DataPrepResult; the report is printed when verbose is set.
+
+    - default: per-example lengths are kept as NumPy arrays, exact distributions
+    - streaming: single pass in bounded memory, distributions from quantile
+      sketches (pass keep_lengths=True to still get the per-example arrays)
+    - workers > 1: tokenization spread over a process pool
+    - incremental: only rows appended since the last run are analyzed
+    - cache_path: SQLite token-count cache shared across runs, e.g.
+      token_cache.DEFAULT_TOKEN_CACHE_PATH; off by default (None: counts are
+      only memoized in process, nothing is written to disk)
+    """
+    # Growing datasets: only analyze the rows appended since the last checkpoint
+    if incremental:
+        stats = incremental_data_prep_analysis(data_path, workers=workers, cache_path=cache_path, verbose=verbose)
+    else:
+        # Large datasets: one pass over the file in bounded memory, tokenized by
+        # `workers` processes
+        if keep_lengths is None:
+            keep_lengths = not streaming
+        stats = compute_stats(data_path, workers=workers, cache_path=cache_path, keep_lengths=keep_lengths)
 
-    n_billing_tokens_in_dataset = sum(min(MAX_TOKENS_PER_EXAMPLE, length) for length in convo_lens)
-    print(f"Dataset has ~{n_billing_tokens_in_dataset} tokens that will be charged for during training")
-    print(f"By default, you'll train for {n_epochs} epochs on this dataset")
-    print(f"By default, you'll be charged for ~{n_epochs * n_billing_tokens_in_dataset} tokens")
\ No newline at end of file
+    result = stats.to_result(data_path)
+    if verbose:
+        result.print_report()
+    return result
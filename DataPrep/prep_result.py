@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Machine-readable result of complete_data_prep_analysis.
+
+The pipeline (cost estimation, sharding, job creation) reads the token counts
+from here instead of scraping the printed report or re-tokenizing the file.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass
+class DataPrepResult:
+    data_path: str
+    n_examples: int
+    format_errors: dict
+    n_missing_system: int
+    n_missing_user: int
+    # name -> {"min", "max", "mean", "median", "p5", "p95"}
+    distributions: dict
+    n_too_long: int
+    max_tokens_per_example: int
+    n_billing_tokens: int
+    n_epochs: int
+    # context limit -> number of examples longer than it
+    n_over_context_limit: dict = field(default_factory=dict)
+    # {"bin_edges": [...], "counts": {"total" | "system" | "user" | "assistant": [...]}}
+    histograms: dict = field(default_factory=dict)
+    first_example: Optional[dict] = None
+    # per-example arrays in file order (None when the lengths were not kept,
+    # e.g. streaming / incremental runs); invalid examples have valid == False
+    valid: Optional[np.ndarray] = field(default=None, repr=False)
+    n_messages: Optional[np.ndarray] = field(default=None, repr=False)
+    convo_lens: Optional[np.ndarray] = field(default=None, repr=False)
+    assistant_message_lens: Optional[np.ndarray] = field(default=None, repr=False)
+
+    @property
+    def n_charged_tokens(self):
+        return self.n_epochs * self.n_billing_tokens
+
+    def estimated_charged_tokens(self, n_epochs=None):
+        """Billed training tokens for n_epochs (default: the estimated n_epochs)."""
+        return (self.n_epochs if n_epochs is None else n_epochs) * self.n_billing_tokens
+
+    def to_dict(self, include_lengths=False):
+        data = {
+            "data_path": self.data_path,
+            "n_examples": self.n_examples,
+            "format_errors": dict(self.format_errors),
+            "n_missing_system": self.n_missing_system,
+            "n_missing_user": self.n_missing_user,
+            "distributions": self.distributions,
+            "n_too_long": self.n_too_long,
+            "max_tokens_per_example": self.max_tokens_per_example,
+            "n_billing_tokens": self.n_billing_tokens,
+            "n_epochs": self.n_epochs,
+            "n_charged_tokens": self.n_charged_tokens,
+            "n_over_context_limit": self.n_over_context_limit,
+            "histograms": self.histograms,
+        }
+        if include_lengths and self.convo_lens is not None:
+            data["valid"] = self.valid.tolist()
+            data["n_messages"] = self.n_messages.tolist()
+            data["convo_lens"] = self.convo_lens.tolist()
+            data["assistant_message_lens"] = self.assistant_message_lens.tolist()
+        return data
+
+    def to_json(self, path=None, include_lengths=False):
+        """Serialize to JSON; written to `path` when given, returned otherwise."""
+        text = json.dumps(self.to_dict(include_lengths), indent=2, default=_json_default)
+        if path is None:
+            return text
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def to_parquet(self, path):
+        """Write the per-example token lengths as a Parquet table (needs pyarrow).
+
+        Dataset level fields are stored in the file's key/value metadata."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("to_parquet requires pyarrow: pip install pyarrow") from e
+        if self.convo_lens is None:
+            raise ValueError("per-example lengths were not kept for this run, re-run with keep_lengths=True")
+        table = pa.table({
+            "valid": self.valid,
+            "n_messages": self.n_messages,
+            "convo_lens": self.convo_lens,
+            "assistant_message_lens": self.assistant_message_lens,
+        })
+        metadata = {b"data_prep_result": self.to_json().encode("utf-8")}
+        pq.write_table(table.replace_schema_metadata(metadata), path)
+
+    def print_report(self):
+        print("Num examples:", self.n_examples)
+        if self.first_example is not None:
+            print("First example:")
+            for message in self.first_example.get("messages") or []:
+                print(message)
+
+        if self.format_errors:
+            print("Found errors:")
+            for k, v in self.format_errors.items():
+                print(f"{k}: {v}")
+        else:
+            print("No errors found")
+
+        print("Num examples missing system message:", self.n_missing_system)
+        print("Num examples missing user message:", self.n_missing_user)
+        for name in ("num_messages_per_example", "num_total_tokens_per_example", "num_assistant_tokens_per_example"):
+            stats = self.distributions.get(name)
+            if not stats:
+                continue
+            print(f"\n#### Distribution of {name}:")
+            print(f"min / max: {stats['min']}, {stats['max']}")
+            print(f"mean / median: {stats['mean']}, {stats['median']}")
+            print(f"p5 / p95: {stats['p5']}, {stats['p95']}")
+        self.print_histograms()
+        print(f"\n{self.n_too_long} examples may be over the {self.max_tokens_per_example} token limit, they will be truncated during fine-tuning")
+        if self.n_over_context_limit:
+            print("Examples over context limit: " + ", ".join(f"{limit}: {n}" for limit, n in self.n_over_context_limit.items()))
+
+        print(f"Dataset has ~{self.n_billing_tokens} tokens that will be charged for during training")
+        if self.n_examples == 0:
+            print(f"No examples in {self.data_path}: n_epochs is the default {self.n_epochs}, there is nothing to train on")
+            return
+        print(f"By default, you'll train for {self.n_epochs} epochs on this dataset")
+        print(f"By default, you'll be charged for ~{self.n_charged_tokens} tokens")
+
+    def print_histograms(self):
+        if not self.histograms:
+            return
+        edges = self.histograms["bin_edges"]
+        counts = self.histograms["counts"]
+        names = list(counts)
+        print("\n#### Token-length histograms (tokens per example):")
+        print(f"{'tokens':>13} " + " ".join(f"{name:>10}" for name in names))
+        for i, low in enumerate(edges):
+            if not any(counts[name][i] for name in names):
+                continue
+            label = f"{low}-{edges[i + 1] - 1}" if i + 1 < len(edges) else f"{low}+"
+            print(f"{label:>13} " + " ".join(f"{counts[name][i]:>10}" for name in names))
+
+
+def _json_default(value):
+    # numpy scalars coming out of the distributions
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
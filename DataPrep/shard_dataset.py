@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Shard, dedupe and trim a fine-tuning JSONL before upload.
+
+Uses the token lengths computed by complete_data_prep_analysis to:
+- drop exact duplicates and near duplicates (same text once case, punctuation
+  and whitespace are normalized) through a hash index,
+- drop or split examples longer than MAX_TOKENS_PER_EXAMPLE (the part past the
+  limit is billed but never trained on),
+- write size-balanced shards: every example goes to the shard with the fewest
+  tokens so far.
+
+The input is streamed and shards are written as we go; memory is bounded by
+the hash index (one 8 byte digest per unique example) and the open shard files.
+
+    python -m DataPrep.shard_dataset ./Transactional/training_DI_txn.jsonl ./shards --n-shards 2
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import os
+from dataclasses import dataclass, field
+
+import tiktoken
+
+from DataPrep.fine_tuning_data_prep_analysis import (
+    DEFAULT_BATCH_SIZE,
+    MAX_TOKENS_PER_EXAMPLE,
+    complete_data_prep_analysis,
+    count_tokens_batch,
+    estimate_n_epochs,
+    iter_batches,
+    iter_jsonl,
+)
+from DataPrep.text_normalize import normalize_text
+from DataPrep.token_cache import DEFAULT_TOKEN_CACHE_PATH, TokenCountCache
+
+DEFAULT_MAX_TOKENS_PER_SHARD = 5_000_000
+OVER_LENGTH_POLICIES = ("drop", "split", "keep")
+
+
+@dataclass
+class ShardReport:
+    data_path: str
+    shard_paths: list
+    max_tokens_per_example: int = MAX_TOKENS_PER_EXAMPLE
+    n_examples: int = 0
+    n_invalid: int = 0
+    n_exact_duplicates: int = 0
+    n_near_duplicates: int = 0
+    n_too_long: int = 0
+    n_dropped_too_long: int = 0
+    n_split_pieces: int = 0
+    n_written: int = 0
+    # default epochs of the input, and of the examples written (fewer examples, more epochs)
+    n_epochs_before: int = 1
+    n_epochs: int = 1
+    billed_tokens_before: int = 0
+    billed_tokens_after: int = 0
+    shard_tokens: list = field(default_factory=list)
+    shard_examples: list = field(default_factory=list)
+
+    @property
+    def billed_token_delta(self):
+        """Change of the billed tokens of a job with default epochs; positive when the
+        output costs more (a deduplicated file can get more epochs)."""
+        return self.billed_tokens_after * self.n_epochs - self.billed_tokens_before * self.n_epochs_before
+
+    @property
+    def billed_token_savings(self):
+        return max(0, -self.billed_token_delta)
+
+    def print_report(self):
+        print("Num examples read:", self.n_examples)
+        print("Invalid examples skipped:", self.n_invalid)
+        print("Exact duplicates removed:", self.n_exact_duplicates)
+        print("Near duplicates removed:", self.n_near_duplicates)
+        print(f"Examples over {self.max_tokens_per_example} tokens: {self.n_too_long} "
+              f"({self.n_dropped_too_long} dropped, {self.n_split_pieces} pieces from splits)")
+        print("Examples written:", self.n_written)
+        for path, tokens, n in zip(self.shard_paths, self.shard_tokens, self.shard_examples):
+            print(f"  {path}: {n} examples, ~{tokens} tokens")
+        print(f"Billed tokens per epoch: ~{self.billed_tokens_before} -> ~{self.billed_tokens_after}")
+        epochs = f"{self.n_epochs_before} -> {self.n_epochs} epochs"
+        if self.billed_token_delta > 0:
+            print(f"~{self.billed_token_delta} more billed tokens ({epochs}); set n_epochs on the job to avoid it")
+        else:
+            print(f"Saving ~{self.billed_token_savings} billed tokens ({epochs})")
+
+
+def exact_key(messages):
+    text = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+def near_duplicate_key(messages):
+    """Hash of the conversation text with case, punctuation and whitespace normalized."""
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(f"{message.get('role')}:{normalize_text(content)}")
+    return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=8).digest()
+
+
+def split_conversation(messages, message_tokens, max_tokens):
+    """Split a multi-turn conversation into examples of at most max_tokens.
+
+    Leading system messages are repeated in every piece and turns (a user
+    message and the replies up to the next user message) are never cut, so
+    each piece still ends with the assistant's answer. message_tokens[i] is the
+    token cost of messages[i]. Turns too long on their own are dropped."""
+    n_system = 0
+    while n_system < len(messages) and messages[n_system].get("role") == "system":
+        n_system += 1
+    system, system_tokens = messages[:n_system], 3 + sum(message_tokens[:n_system])
+
+    turns = []
+    for message, n_tokens in zip(messages[n_system:], message_tokens[n_system:]):
+        if message.get("role") == "user" or not turns:
+            turns.append(([], 0))
+        turn_messages, turn_tokens = turns[-1]
+        turns[-1] = (turn_messages + [message], turn_tokens + n_tokens)
+
+    pieces = []
+    current, current_tokens = [], system_tokens
+    for turn_messages, turn_tokens in turns:
+        if system_tokens + turn_tokens > max_tokens:
+            continue
+        if current and current_tokens + turn_tokens > max_tokens:
+            pieces.append(system + current)
+            current, current_tokens = [], system_tokens
+        current += turn_messages
+        current_tokens += turn_tokens
+    if current:
+        pieces.append(system + current)
+    return [piece for piece in pieces if any(m.get("role") == "assistant" for m in piece)]
+
+
+def _message_tokens(messages, encoding, cache):
+    # a one-message list costs 3 (reply priming) + the message itself
+    return [int(n) - 3 for n in count_tokens_batch([[m] for m in messages], encoding, cache=cache)[:, 0]]
+
+
+def shard_dataset(data_path, output_dir, n_shards=None, max_tokens_per_shard=DEFAULT_MAX_TOKENS_PER_SHARD,
+                  max_tokens_per_example=MAX_TOKENS_PER_EXAMPLE, over_length="split", dedup=True, near_dedup=True,
+                  analysis=None, cache_path=None, verbose=True):
+    """Write deduplicated, length-capped, token-balanced shards of data_path.
+
+    `analysis` is the DataPrepResult of data_path with per-example lengths; it
+    is computed when missing. n_shards defaults to enough shards to keep each
+    under max_tokens_per_shard. cache_path is an optional SQLite token-count
+    cache (see complete_data_prep_analysis). Returns a ShardReport."""
+    if over_length not in OVER_LENGTH_POLICIES:
+        raise ValueError(f"over_length must be one of {OVER_LENGTH_POLICIES}, got {over_length!r}")
+    if analysis is None or analysis.convo_lens is None:
+        analysis = complete_data_prep_analysis(data_path, cache_path=cache_path, keep_lengths=True, verbose=False)
+    if n_shards is None:
+        n_shards = max(1, math.ceil(analysis.n_billing_tokens / max_tokens_per_shard))
+
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    report = ShardReport(
+        data_path=data_path,
+        shard_paths=[os.path.join(output_dir, f"{stem}_shard_{i:03d}.jsonl") for i in range(n_shards)],
+        max_tokens_per_example=max_tokens_per_example,
+        n_epochs_before=analysis.n_epochs,
+        shard_tokens=[0] * n_shards,
+        shard_examples=[0] * n_shards,
+    )
+    encoding = tiktoken.get_encoding("cl100k_base")
+    cache = TokenCountCache(encoding, cache_path)
+    seen_exact = set()
+    seen_near = set()
+    # (tokens so far, shard index): the least loaded shard is always on top
+    loads = [(0, i) for i in range(n_shards)]
+    shard_files = [open(path, 'w', encoding='utf-8') for path in report.shard_paths]
+
+    def write(messages, n_tokens):
+        tokens, i = heapq.heappop(loads)
+        shard_files[i].write(json.dumps({"messages": messages}, ensure_ascii=False) + "\n")
+        heapq.heappush(loads, (tokens + n_tokens, i))
+        report.shard_tokens[i] += n_tokens
+        report.shard_examples[i] += 1
+        report.n_written += 1
+        report.billed_tokens_after += min(max_tokens_per_example, n_tokens)
+
+    try:
+        index = 0
+        for batch in iter_batches(iter_jsonl(data_path), DEFAULT_BATCH_SIZE):
+            lengths = analysis.convo_lens[index:index + len(batch)].tolist()
+            valid = analysis.valid[index:index + len(batch)].tolist()
+            index += len(batch)
+            for ex, n_tokens, ok in zip(batch, lengths, valid):
+                report.n_examples += 1
+                if not ok:
+                    report.n_invalid += 1
+                    continue
+                messages = ex["messages"]
+                report.billed_tokens_before += min(max_tokens_per_example, n_tokens)
+
+                if dedup:
+                    key = exact_key(messages)
+                    if key in seen_exact:
+                        report.n_exact_duplicates += 1
+                        continue
+                    seen_exact.add(key)
+                if near_dedup:
+                    key = near_duplicate_key(messages)
+                    if key in seen_near:
+                        report.n_near_duplicates += 1
+                        continue
+                    seen_near.add(key)
+
+                if n_tokens <= max_tokens_per_example or over_length == "keep":
+                    report.n_too_long += n_tokens > max_tokens_per_example
+                    write(messages, n_tokens)
+                    continue
+
+                report.n_too_long += 1
+                pieces = []
+                if over_length == "split":
+                    pieces = split_conversation(messages, _message_tokens(messages, encoding, cache), max_tokens_per_example)
+                if not pieces:
+                    report.n_dropped_too_long += 1
+                    continue
+                piece_lengths = count_tokens_batch(pieces, encoding, cache=cache)[:, 0]
+                for piece, piece_tokens in zip(pieces, piece_lengths.tolist()):
+                    write(piece, piece_tokens)
+                    report.n_split_pieces += 1
+    finally:
+        for f in shard_files:
+            f.close()
+        cache.close()
+
+    report.n_epochs = estimate_n_epochs(report.n_written) if report.n_written else 0
+    if verbose:
+        report.print_report()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dedupe, trim and shard a fine-tuning JSONL file.")
+    parser.add_argument("data_path")
+    parser.add_argument("output_dir")
+    parser.add_argument("--n-shards", type=int)
+    parser.add_argument("--max-tokens-per-shard", type=int, default=DEFAULT_MAX_TOKENS_PER_SHARD)
+    parser.add_argument("--max-tokens-per-example", type=int, default=MAX_TOKENS_PER_EXAMPLE)
+    parser.add_argument("--over-length", choices=OVER_LENGTH_POLICIES, default="split")
+    parser.add_argument("--no-dedup", action="store_true", help="keep exact duplicates")
+    parser.add_argument("--no-near-dedup", action="store_true", help="keep near duplicates")
+    parser.add_argument("--token-cache", nargs="?", const=DEFAULT_TOKEN_CACHE_PATH, default=None,
+                        help=f"reuse token counts across runs in a SQLite file (default file: {DEFAULT_TOKEN_CACHE_PATH})")
+    args = parser.parse_args()
+    shard_dataset(args.data_path, args.output_dir, n_shards=args.n_shards, max_tokens_per_shard=args.max_tokens_per_shard,
+                  max_tokens_per_example=args.max_tokens_per_example, over_length=args.over_length,
+                  dedup=not args.no_dedup, near_dedup=not args.no_near_dedup, cache_path=args.token_cache)
+
+
+if __name__ == "__main__":
+    main()
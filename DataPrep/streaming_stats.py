@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Online statistics for the streaming mode of complete_data_prep_analysis.
+
+Everything here is single pass and bounded in memory: the quantile sketch keeps
+log-spaced buckets (DDSketch style), so the number of buckets only depends on
+the range of values seen, never on the number of examples.
+"""
+
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    """Streaming quantiles with a relative error of at most `alpha`."""
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        # token / message counts are integers, so estimates can be rounded back
+        self.integer = True
+
+    def add(self, value, weight=1):
+        if value <= 0:
+            self.zero_count += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + weight
+        if self.integer and value != int(value):
+            self.integer = False
+        self.count += weight
+
+    def add_many(self, values):
+        """Vectorized add() of a whole array of values."""
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zero_count += int(values.size - positive.size)
+        if positive.size:
+            keys, weights = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64), return_counts=True)
+            for key, weight in zip(keys.tolist(), weights.tolist()):
+                self.buckets[key] = self.buckets.get(key, 0) + weight
+        if self.integer and not np.array_equal(values, np.floor(values)):
+            self.integer = False
+        self.count += int(values.size)
+
+    def merge(self, other):
+        for key, weight in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + weight
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.integer = self.integer and other.integer
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                estimate = 2 * self.gamma ** key / (self.gamma + 1)
+                return round(estimate) if self.integer else estimate
+        return None
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha,
+            "buckets": {str(k): v for k, v in self.buckets.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "integer": self.integer,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(alpha=data["alpha"])
+        sketch.buckets = {int(k): v for k, v in data["buckets"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.integer = data["integer"]
+        return sketch
+
+
+class RunningStats:
+    """Exact count / sum / min / max plus a quantile sketch for everything else."""
+
+    def __init__(self, alpha=0.01):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(alpha)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def add_many(self, values):
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        self.count += int(values.size)
+        self.total += values.sum(dtype=np.float64 if values.dtype.kind == "f" else np.int64).item()
+        low, high = values.min().item(), values.max().item()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.sketch.add_many(values)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        # the sketch only guarantees relative accuracy, keep the tails exact
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        value = self.sketch.quantile(q)
+        if value is None:
+            return None
+        return min(max(value, self.min), self.max)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "sketch": self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data["count"]
+        stats.total = data["total"]
+        stats.min = data["min"]
+        stats.max = data["max"]
+        stats.sketch = QuantileSketch.from_dict(data["sketch"])
+        return stats
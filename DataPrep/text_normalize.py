@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Text normalization shared by the data prep tools and the chat engine.
+
+Kept free of the data prep stack (tiktoken, multiprocessing) so the chat UI
+can import it.
+
+    normalize_text("How do I  update my Address?")  # "how do i update my address"
+"""
+
+import re
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
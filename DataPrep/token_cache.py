@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed token-count cache for the data prep analysis.
+
+Counts are keyed by (encoding name, hash of the text). Lookups go through an
+in-process LRU memo first (so a system prompt repeated in every row is
+tokenized once per run), then through an optional SQLite file shared across
+runs and worker processes. Only the remaining misses are sent to encode_batch.
+The SQLite file is kept under max_entries rows by evicting the least recently
+used counts. Reads do not write: the recency of the counts found on disk is
+saved with the next write, or at eviction / close, in one batch.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "fine_tune_data_prep", "token_counts.sqlite3")
+DEFAULT_MAX_ENTRIES = 1_000_000
+DEFAULT_MEMO_SIZE = 100_000
+
+# SQLite caps the number of bound parameters per statement
+_SQL_CHUNK = 500
+
+
+def content_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class TokenCountCache:
+    """Token counts for one encoding, memoized in process and optionally on disk."""
+
+    def __init__(self, encoding, path=DEFAULT_TOKEN_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, memo_size=DEFAULT_MEMO_SIZE):
+        self.encoding = encoding
+        self.max_entries = max_entries
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.conn = None
+        # disk hits whose last_used is not saved yet
+        self.touched = set()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # several worker processes may write at once
+            self.conn = sqlite3.connect(path, timeout=60)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_counts ("
+                " encoding TEXT NOT NULL, hash BLOB NOT NULL, n_tokens INTEGER NOT NULL, last_used REAL NOT NULL,"
+                " PRIMARY KEY (encoding, hash)) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS token_counts_last_used ON token_counts (last_used)")
+            self.conn.commit()
+
+    def _remember(self, key, n_tokens):
+        self.memo[key] = n_tokens
+        self.memo.move_to_end(key)
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def count_batch(self, texts, num_threads=8):
+        """Return the number of tokens of each text, encoding only cache misses."""
+        keys = [content_hash(text) for text in texts]
+        counts = {}
+        for key in keys:
+            if key in self.memo and key not in counts:
+                counts[key] = self.memo[key]
+                self.memo.move_to_end(key)
+
+        missing = list({key: None for key in keys if key not in counts})
+        if missing and self.conn is not None:
+            found = self._disk_lookup(missing)
+            self.disk_hits += len(found)
+            for key, n_tokens in found.items():
+                counts[key] = n_tokens
+                self._remember(key, n_tokens)
+            missing = [key for key in missing if key not in found]
+
+        if missing:
+            missing_set = set(missing)
+            to_encode = {}
+            for key, text in zip(keys, texts):
+                if key in missing_set and key not in to_encode:
+                    to_encode[key] = text
+            encoded = self.encoding.encode_batch(list(to_encode.values()), num_threads=num_threads)
+            new_counts = {key: len(tokens) for key, tokens in zip(to_encode, encoded)}
+            for key, n_tokens in new_counts.items():
+                counts[key] = n_tokens
+                self._remember(key, n_tokens)
+            if self.conn is not None:
+                self._disk_store(new_counts)
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        return [counts[key] for key in keys]
+
+    def _disk_lookup(self, keys):
+        found = {}
+        for i in range(0, len(keys), _SQL_CHUNK):
+            chunk = keys[i:i + _SQL_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT hash, n_tokens FROM token_counts WHERE encoding = ? AND hash IN ({placeholders})",
+                [self.encoding.name, *chunk],
+            ).fetchall()
+            found.update(rows)
+        # refresh recency so frequently reused counts survive eviction, without
+        # taking the write lock on every read of every worker
+        self.touched.update(found)
+        return found
+
+    def _save_touched(self):
+        if self.touched:
+            now = time.time()
+            self.conn.executemany("UPDATE token_counts SET last_used = ? WHERE encoding = ? AND hash = ?",
+                                  [(now, self.encoding.name, key) for key in self.touched])
+            self.touched.clear()
+
+    def _disk_store(self, new_counts):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO token_counts (encoding, hash, n_tokens, last_used) VALUES (?, ?, ?, ?)",
+            [(self.encoding.name, key, n_tokens, now) for key, n_tokens in new_counts.items()],
+        )
+        self._save_touched()
+        self.conn.commit()
+
+    def evict(self):
+        """Drop the least recently used rows above max_entries."""
+        if self.conn is None:
+            return
+        self._save_touched()
+        self.conn.commit()
+        (n_entries,) = self.conn.execute("SELECT COUNT(*) FROM token_counts").fetchone()
+        if n_entries > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM token_counts WHERE (encoding, hash) IN"
+                " (SELECT encoding, hash FROM token_counts ORDER BY last_used LIMIT ?)",
+                (n_entries - self.max_entries,),
+            )
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.evict()
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Batch inference of a (fine-tuned) chat model over JSONL conversations.
+
+Every line of the input ({"messages": [...]} like the training and validation
+files) becomes one chat completion request on the messages up to the last
+assistant message; that message, when present, is kept as the reference.
+- `concurrency` workers send requests at the same time,
+- a token bucket limiter keeps them under the requests-per-minute and
+  tokens-per-minute limits of the account (a request is charged its
+  characters / 4 plus max_tokens up front, like the API estimates it, and the
+  difference with the real usage is refunded),
+- results are appended to the output JSONL as they complete, one line per
+  example, which is also the checkpoint: a rerun skips the examples already
+  answered (same index, same prompt) and retries the failed ones.
+
+    python -m FineTuning.batch_inference ./queue/validation.jsonl --model ft:gpt-3.5-turbo-0125:personal:queue-assist:xxx \\
+        --output ./queue/validation.predictions.jsonl --concurrency 8 --rpm 3500 --tpm 90000
+    python -m FineTuning.batch_inference ./queue/validation.jsonl --stub --sweep 1,4,16
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_TOKENS = 512
+# tier 1 limits of gpt-3.5-turbo
+DEFAULT_RPM = 3500
+DEFAULT_TPM = 60000
+# the API counts roughly one token per 4 characters when estimating a request
+CHARS_PER_TOKEN = 4
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute token buckets.
+
+    Each bucket holds up to a minute of capacity and refills continuously;
+    acquire() waits until both can pay for the request."""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm or 0)
+        self.tokens = float(tpm or 0)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, n_tokens):
+        if self.tpm:
+            # a request larger than the whole bucket would wait forever
+            n_tokens = min(n_tokens, self.tpm)
+        # the lock keeps the waiters in line: first come, first served
+        async with self.lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self.requests < 1:
+                    wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+                if self.tpm and self.tokens < n_tokens:
+                    wait = max(wait, (n_tokens - self.tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    break
+                self.waited += wait
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self.requests -= 1
+            if self.tpm:
+                self.tokens -= n_tokens
+
+    def refund(self, n_tokens):
+        """Give back what the estimate overcharged (negative: charge the excess)."""
+        if self.tpm:
+            self._refill()
+            self.tokens = min(self.tpm, self.tokens + n_tokens)
+
+    def pause(self, seconds):
+        """Empty the buckets so nothing is sent for about `seconds` (after a 429)."""
+        self._refill()
+        if self.rpm:
+            self.requests = min(self.requests, -seconds * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tokens, -seconds * self.tpm / 60)
+
+
+def estimate_tokens(messages, max_tokens):
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // CHARS_PER_TOKEN + (max_tokens or 0)
+
+
+def prompt_hash(messages):
+    return hashlib.blake2b(json.dumps(messages, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def split_example(example):
+    """(request messages, reference answer or None) of a {"messages": [...]} example."""
+    messages = example["messages"]
+    if messages and messages[-1]["role"] == "assistant":
+        return messages[:-1], messages[-1]["content"]
+    return messages, None
+
+
+def load_results(path):
+    """Last record per index of an output file; a line cut short by an
+    interrupted run is ignored."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            results[record["index"]] = record
+    return results
+
+
+@dataclass
+class BatchReport:
+    n_examples: int = 0
+    n_skipped: int = 0
+    n_done: int = 0
+    n_errors: int = 0
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latencies: list = field(default_factory=list)
+    rate_limit_wait: float = 0.0
+
+    @property
+    def requests_per_second(self):
+        return (self.n_done + self.n_errors) / self.seconds if self.seconds else 0.0
+
+    def print_report(self):
+        print(f"{self.n_done} answered, {self.n_errors} errors, {self.n_skipped} already done "
+              f"(of {self.n_examples}) in {self.seconds:.2f}s: {self.requests_per_second:.1f} requests/s, "
+              f"{self.completion_tokens / self.seconds if self.seconds else 0:.0f} completion tokens/s")
+        if self.latencies:
+            p50, p95 = np.percentile(self.latencies, [50, 95])
+            print(f"Latency p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms; "
+                  f"waited {self.rate_limit_wait:.1f}s for the rate limiter")
+
+
+async def complete(client, model, messages, params, stream):
+    """(answer, usage dict, finish_reason, time to first token)."""
+    start = time.perf_counter()
+    if not stream:
+        response = await client.chat.completions.create(model=model, messages=messages, **params)
+        choice = response.choices[0]
+        usage = response.usage.model_dump() if response.usage else {}
+        return choice.message.content, usage, choice.finish_reason, None
+    parts, usage, finish_reason, first_token = [], {}, None, None
+    async for chunk in await client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                            stream_options={"include_usage": True}, **params):
+        if chunk.usage:
+            usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(delta.content)
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+    return "".join(parts), usage, finish_reason, first_token
+
+
+async def run_batch(client, input_path, output_path, model, concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM,
+                    tpm=DEFAULT_TPM, temperature=0.0, max_tokens=DEFAULT_MAX_TOKENS, stream=False, limit=None,
+                    verbose=True):
+    report = BatchReport()
+    done = {index: record["prompt_hash"] for index, record in load_results(output_path).items()
+            if record.get("error") is None}
+    limiter = RateLimiter(rpm, tpm)
+    params = {"temperature": temperature}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+    # bounded: the input is read as the workers make progress
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    start = time.perf_counter()
+
+    async def produce():
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for index, line in enumerate(f):
+                if limit is not None and index >= limit:
+                    break
+                if not line.strip():
+                    continue
+                report.n_examples += 1
+                try:
+                    messages, reference = split_example(json.loads(line))
+                except (ValueError, KeyError, TypeError, IndexError) as e:
+                    # recorded like a failed request, the rest of the batch goes on
+                    await queue.put((index, None, None, None, f"invalid example: {type(e).__name__}: {e}"))
+                    continue
+                key = prompt_hash(messages)
+                if done.get(index) == key:
+                    report.n_skipped += 1
+                    continue
+                await queue.put((index, key, messages, reference, None))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work(out):
+        while (item := await queue.get()) is not None:
+            index, key, messages, reference, error = item
+            record = {"index": index, "prompt_hash": key, "model": model, "reference": reference}
+            if error is not None:
+                record["error"] = error
+            else:
+                estimate = estimate_tokens(messages, max_tokens)
+                await limiter.acquire(estimate)
+                request_start = time.perf_counter()
+                try:
+                    answer, usage, finish_reason, first_token = await complete(client, model, messages, params, stream)
+                except openai.RateLimitError as e:
+                    # the client already retried; hold everyone back before the next request
+                    limiter.pause(float(e.response.headers.get("retry-after") or 1))
+                    record["error"] = f"RateLimitError: {e}"
+                except openai.APIError as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+                else:
+                    latency = time.perf_counter() - request_start
+                    record.update({"response": answer, "finish_reason": finish_reason, "usage": usage,
+                                   "latency": round(latency, 4), "error": None})
+                    if first_token is not None:
+                        record["time_to_first_token"] = round(first_token, 4)
+                    limiter.refund(estimate - usage.get("total_tokens", estimate))
+                    report.n_done += 1
+                    report.latencies.append(latency)
+                    report.prompt_tokens += usage.get("prompt_tokens", 0)
+                    report.completion_tokens += usage.get("completion_tokens", 0)
+            if record.get("error"):
+                report.n_errors += 1
+                if verbose:
+                    print(f"Example {index}: {record['error']}")
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'a', encoding='utf-8') as out:
+        await asyncio.gather(produce(), *(work(out) for _ in range(concurrency)))
+    report.seconds = time.perf_counter() - start
+    report.rate_limit_wait = limiter.waited
+    return report
+
+
+def default_output_path(input_path, model):
+    name = model.replace(":", "_").replace("/", "_")
+    return f"{os.path.splitext(input_path)[0]}.{name}.predictions.jsonl"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch chat completions over a JSONL of conversations.")
+    parser.add_argument("input")
+    parser.add_argument("--model", default="gpt-3.5-turbo-0125")
+    parser.add_argument("--output", default=None, help="default: <input>.<model>.predictions.jsonl")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="requests per minute, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="tokens per minute, 0 for no limit")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--stream", action="store_true", help="stream the answers and record the time to first token")
+    parser.add_argument("--limit", type=int, default=None, help="only the first n lines")
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server replaying the references")
+    parser.add_argument("--stub-seconds", type=float, default=0.2, help="generation time of a stub completion")
+    parser.add_argument("--sweep", default=None, help="with --stub: comma separated concurrencies to compare")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if args.stub:
+        from FineTuning.stub_openai_server import load_answers, serve_in_thread
+        server = serve_in_thread(completion_seconds=args.stub_seconds, answers=load_answers([args.input]))
+        base_url = server.base_url
+        print(f"Stub server on {base_url}")
+
+    async def run(output, concurrency, verbose=True):
+        # a client per event loop, closed with it
+        async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY", "stub" if args.stub else None), base_url=base_url,
+                               max_retries=3) as client:
+            return await run_batch(client, args.input, output, args.model, concurrency, args.rpm, args.tpm,
+                                   args.temperature, args.max_tokens, args.stream, args.limit, verbose)
+
+    try:
+        if args.sweep:
+            print(f"{'concurrency':>11} {'requests/s':>11} {'seconds':>8}")
+            for concurrency in (int(c) for c in args.sweep.split(",")):
+                with tempfile.TemporaryDirectory() as tmp:
+                    report = asyncio.run(run(os.path.join(tmp, "out.jsonl"), concurrency, verbose=False))
+                print(f"{concurrency:>11} {report.requests_per_second:>11.1f} {report.seconds:>8.2f}")
+            return
+        output = args.output or default_output_path(args.input, args.model)
+        report = asyncio.run(run(output, args.concurrency))
+        report.print_report()
+        print(f"Results in {output}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Quality and speed benchmark of the three fine-tuned tasks, with a baseline to
+catch regressions.
+
+The validation files of the queue, DI QnA and Transactional tasks are replayed
+through a model backend:
+- OpenAIBackend: chat completions of a (fine-tuned) model, optionally
+  recorded to a JSONL file,
+- RecordedBackend: answers, usage and latencies from such a recording (or
+  from a batch_inference output), so the suite runs offline.
+Each answer is scored against the reference of its task:
+- queue: exact match of the "Queue N" category,
+- DI QnA: same reference link and a similar answer (cosine of hashed word /
+  character n-grams, see ChatEngine/router.py),
+- Transactional: same account numbers and amounts, or a similar answer.
+The report has accuracy, p50 / p95 / p99 latency, tokens per second and cost
+per request for every task. With --baseline, a drop in accuracy or a rise in
+p95 latency or cost beyond the tolerances makes the run exit with status 1;
+--update-baseline writes the current results as the new baseline.
+
+    python -m FineTuning.evaluate_tasks --backend openai --model ft:gpt-3.5-turbo-0125:personal:di-txn-assist:xxx \\
+        --record ./FineTuning/recordings.jsonl
+    python -m FineTuning.evaluate_tasks --backend recorded --recording ./FineTuning/recordings.jsonl \\
+        --baseline ./FineTuning/eval_baseline.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+from ChatEngine.router import HashedNgramVectorizer
+from FineTuning.batch_inference import load_results, prompt_hash, split_example
+
+TASK_FILES = {
+    "queue": "./queue/validation.jsonl",
+    "qna": "./DI_QnA_Assistance/validation_DI_QnA.jsonl",
+    "transactional": "./Transactional/validation_DI_txn.jsonl",
+}
+# USD per 1M tokens (input, output)
+PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "ft:gpt-3.5-turbo": (3.00, 6.00),
+}
+SIMILARITY_THRESHOLD = 0.8
+DEFAULT_ACCURACY_TOLERANCE = 0.02
+DEFAULT_LATENCY_TOLERANCE = 0.20
+DEFAULT_COST_TOLERANCE = 0.10
+
+_QUEUE = re.compile(r"queue\s*(\d)", re.IGNORECASE)
+_LINK = re.compile(r"\((https?://[^)\s]+)\)")
+_ACCOUNT = re.compile(r"\b\d{6}\b")
+_AMOUNT = re.compile(r"\$\s*([\d,]+(?:\.\d+)?)")
+
+
+@dataclass
+class Completion:
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+
+
+class OpenAIBackend:
+    def __init__(self, client, model, temperature=0.0, max_tokens=512, record_path=None):
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    def complete(self, messages):
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(model=self.model, messages=messages,
+                                                       temperature=self.temperature, max_tokens=self.max_tokens)
+        latency = time.perf_counter() - start
+        usage = response.usage
+        completion = Completion(response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens, latency)
+        if self.record_path:
+            # the record format of batch_inference, so either can be replayed; keyed
+            # by prompt, a new recording of the same prompt replaces the old one
+            record = {"index": prompt_hash(messages), "prompt_hash": prompt_hash(messages), "model": self.model,
+                      "response": completion.text, "latency": round(latency, 4), "error": None,
+                      "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens,
+                                "total_tokens": usage.prompt_tokens + usage.completion_tokens}}
+            with self._lock, open(self.record_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        return completion
+
+
+class RecordedBackend:
+    """Replays recorded answers, looked up by the hash of the request messages."""
+
+    def __init__(self, paths, model=None):
+        self.records = {}
+        for path in paths:
+            for record in load_results(path).values():
+                if record.get("error") is None:
+                    self.records[record["prompt_hash"]] = record
+        self.model = model or next((r.get("model") for r in self.records.values()), "recorded")
+
+    def complete(self, messages):
+        record = self.records.get(prompt_hash(messages))
+        if record is None:
+            raise KeyError("no recorded answer for this prompt")
+        usage = record.get("usage") or {}
+        return Completion(record["response"], usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                          record.get("latency", 0.0))
+
+
+def price_per_token(model):
+    """(input, output) USD per token of a model, by its longest matching prefix."""
+    base = "ft:gpt-3.5-turbo" if model.startswith("ft:") else model
+    key = max((k for k in PRICES if base.startswith(k)), key=len, default=None)
+    price_in, price_out = PRICES.get(key, (0.0, 0.0))
+    return price_in / 1e6, price_out / 1e6
+
+
+_vectorizer = HashedNgramVectorizer()
+
+
+def similarity(a, b):
+    return float(_vectorizer.transform_one(a) @ _vectorizer.transform_one(b))
+
+
+def score_queue(answer, reference):
+    expected = _QUEUE.findall(reference)[:1]
+    correct = bool(expected) and _QUEUE.findall(answer)[:1] == expected
+    return correct, float(correct)
+
+
+def score_qna(answer, reference):
+    sim = similarity(answer, reference)
+    same_link = set(_LINK.findall(answer)) == set(_LINK.findall(reference))
+    return same_link and sim >= SIMILARITY_THRESHOLD, sim
+
+
+def _facts(text):
+    return set(_ACCOUNT.findall(text)), {float(a.replace(",", "")) for a in _AMOUNT.findall(text)}
+
+
+def score_transactional(answer, reference):
+    sim = similarity(answer, reference)
+    facts = _facts(reference)
+    if any(facts):
+        return _facts(answer) == facts, sim
+    return sim >= SIMILARITY_THRESHOLD, sim
+
+
+SCORERS = {"queue": score_queue, "qna": score_qna, "transactional": score_transactional}
+
+
+@dataclass
+class TaskResult:
+    task: str
+    n_examples: int = 0
+    n_correct: int = 0
+    n_errors: int = 0
+    mean_similarity: float = 0.0
+    latency_p50: float = 0.0
+    latency_p95: float = 0.0
+    latency_p99: float = 0.0
+    tokens_per_second: float = 0.0
+    cost_per_request: float = 0.0
+    failures: list = field(default_factory=list)
+
+    @property
+    def accuracy(self):
+        return self.n_correct / self.n_examples if self.n_examples else 0.0
+
+
+def evaluate_task(backend, task, path, concurrency=4, model=None, max_failures=5):
+    with open(path, 'r', encoding='utf-8') as f:
+        examples = [split_example(json.loads(line)) for line in f if line.strip()]
+
+    def run(example):
+        messages, reference = example
+        try:
+            return backend.complete(messages), reference, None
+        except Exception as e:
+            return None, reference, f"{type(e).__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(run, examples))
+
+    result = TaskResult(task, n_examples=len(examples))
+    price_in, price_out = price_per_token(model or getattr(backend, "model", ""))
+    latencies, similarities, costs = [], [], []
+    completion_tokens = generation_seconds = 0.0
+    for (messages, _), (completion, reference, error) in zip(examples, outcomes):
+        question = messages[-1]["content"] if messages else ""
+        if error is not None:
+            result.n_errors += 1
+            if len(result.failures) < max_failures:
+                result.failures.append({"question": question, "error": error})
+            continue
+        correct, sim = SCORERS[task](completion.text, reference)
+        result.n_correct += bool(correct)
+        similarities.append(sim)
+        latencies.append(completion.latency)
+        costs.append(completion.prompt_tokens * price_in + completion.completion_tokens * price_out)
+        completion_tokens += completion.completion_tokens
+        generation_seconds += completion.latency
+        if not correct and len(result.failures) < max_failures:
+            result.failures.append({"question": question, "answer": completion.text, "reference": reference})
+    if latencies:
+        result.latency_p50, result.latency_p95, result.latency_p99 = (float(x) for x in np.percentile(latencies, [50, 95, 99]))
+        result.mean_similarity = float(np.mean(similarities))
+        result.cost_per_request = float(np.mean(costs))
+        result.tokens_per_second = completion_tokens / generation_seconds if generation_seconds else 0.0
+    return result
+
+
+def print_results(results):
+    print(f"{'task':>14} {'n':>4} {'accuracy':>9} {'similarity':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'tokens/s':>9} {'$/request':>10} {'errors':>7}")
+    for r in results:
+        print(f"{r.task:>14} {r.n_examples:>4} {r.accuracy:>9.1%} {r.mean_similarity:>11.2f} {r.latency_p50 * 1000:>8.0f} "
+              f"{r.latency_p95 * 1000:>8.0f} {r.latency_p99 * 1000:>8.0f} {r.tokens_per_second:>9.1f} "
+              f"{r.cost_per_request:>10.6f} {r.n_errors:>7}")
+
+
+def compare_to_baseline(results, baseline, accuracy_tolerance=DEFAULT_ACCURACY_TOLERANCE,
+                        latency_tolerance=DEFAULT_LATENCY_TOLERANCE, cost_tolerance=DEFAULT_COST_TOLERANCE):
+    """Regressions of results against a baseline ({task: TaskResult dict}), as messages."""
+    regressions = []
+    for r in results:
+        base = baseline.get(r.task)
+        if base is None:
+            continue
+        base_accuracy = base["n_correct"] / base["n_examples"] if base["n_examples"] else 0.0
+        if r.accuracy < base_accuracy - accuracy_tolerance:
+            regressions.append(f"{r.task}: accuracy {r.accuracy:.1%} < baseline {base_accuracy:.1%}")
+        if base["latency_p95"] and r.latency_p95 > base["latency_p95"] * (1 + latency_tolerance):
+            regressions.append(f"{r.task}: p95 latency {r.latency_p95 * 1000:.0f} ms > baseline "
+                               f"{base['latency_p95'] * 1000:.0f} ms + {latency_tolerance:.0%}")
+        if base["cost_per_request"] and r.cost_per_request > base["cost_per_request"] * (1 + cost_tolerance):
+            regressions.append(f"{r.task}: cost ${r.cost_per_request:.6f} > baseline "
+                               f"${base['cost_per_request']:.6f} + {cost_tolerance:.0%}")
+        if r.n_errors > base.get("n_errors", 0):
+            regressions.append(f"{r.task}: {r.n_errors} errors, baseline {base.get('n_errors', 0)}")
+    return regressions
+
+
+def save_baseline(results, path):
+    baseline = {r.task: {k: v for k, v in asdict(r).items() if k != "failures"} for r in results}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy, latency and cost of the fine-tuned tasks, against a baseline.")
+    parser.add_argument("--backend", choices=["openai", "recorded", "stub"], default="recorded")
+    parser.add_argument("--model", default="gpt-3.5-turbo-0125")
+    parser.add_argument("--recording", nargs="*", default=["./FineTuning/recordings.jsonl"],
+                        help="recordings or batch_inference outputs replayed by the recorded backend")
+    parser.add_argument("--record", default=None, help="openai backend: append the answers to this recording")
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--tasks", default=",".join(TASK_FILES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--accuracy-tolerance", type=float, default=DEFAULT_ACCURACY_TOLERANCE)
+    parser.add_argument("--latency-tolerance", type=float, default=DEFAULT_LATENCY_TOLERANCE)
+    parser.add_argument("--cost-tolerance", type=float, default=DEFAULT_COST_TOLERANCE)
+    parser.add_argument("--verbose", action="store_true", help="print the failed examples")
+    args = parser.parse_args()
+
+    server = None
+    if args.backend == "recorded":
+        backend = RecordedBackend(args.recording)
+    else:
+        from openai import OpenAI
+        base_url = args.base_url
+        if args.backend == "stub":
+            from FineTuning.stub_openai_server import load_answers, serve_in_thread
+            server = serve_in_thread(answers=load_answers(TASK_FILES.values()))
+            base_url = server.base_url
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "stub" if server else None), base_url=base_url)
+        backend = OpenAIBackend(client, args.model, record_path=args.record)
+    try:
+        results = [evaluate_task(backend, task, TASK_FILES[task], args.concurrency) for task in args.tasks.split(",")]
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print_results(results)
+    if args.verbose:
+        for r in results:
+            for failure in r.failures:
+                print(f"\n[{r.task}] {json.dumps(failure, indent=2)}")
+
+    status = 0
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.accuracy_tolerance, args.latency_tolerance,
+                                          args.cost_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            status = 1
+        else:
+            print(f"No regression against {args.baseline}")
+    if args.baseline and (args.update_baseline or not os.path.exists(args.baseline)):
+        save_baseline(results, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Follow fine-tuning jobs without re-downloading their whole event list.
+
+The events endpoint returns events newest first and pages backwards with
+`after`, so every poll reads from the top and stops at the newest event seen
+by the previous poll: a quiet job costs one small request per poll. Polling
+backs off exponentially while nothing happens and snaps back to the minimum
+interval on new events. Metrics events (step, train / valid loss, token
+accuracy) are collected into an in-memory time series per job, and any
+number of jobs are followed concurrently from one event loop.
+
+    python -m FineTuning.job_monitor ftjob-abc123 ftjob-def456
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+DEFAULT_MIN_INTERVAL = 2.0
+DEFAULT_MAX_INTERVAL = 60.0
+DEFAULT_BACKOFF = 2.0
+DEFAULT_PAGE_SIZE = 50
+# idle polls between two jobs.retrieve calls; status changes normally come with an event
+STATUS_EVERY = 5
+
+# "Step 12/100: training loss=0.53, validation loss=0.61" (older events carry no data)
+_STEP_MESSAGE = re.compile(r"Step (\d+)(?:/(\d+))?: training loss=([\d.]+)(?:, validation loss=([\d.]+))?")
+METRIC_FIELDS = ("train_loss", "valid_loss", "train_mean_token_accuracy", "valid_mean_token_accuracy")
+
+
+class MetricSeries:
+    """Per-step training metrics of one job, in step order."""
+
+    def __init__(self):
+        self.step = []
+        self.created_at = []
+        self.values = {name: [] for name in METRIC_FIELDS}
+        self.total_steps = None
+
+    def __len__(self):
+        return len(self.step)
+
+    def add(self, step, created_at, total_steps=None, **metrics):
+        if self.step and step <= self.step[-1]:
+            return
+        self.step.append(step)
+        self.created_at.append(created_at)
+        for name, values in self.values.items():
+            values.append(metrics.get(name))
+        if total_steps:
+            self.total_steps = total_steps
+
+    def latest(self):
+        if not self.step:
+            return None
+        return {"step": self.step[-1], **{name: values[-1] for name, values in self.values.items()}}
+
+    def to_numpy(self):
+        """Columns as arrays, missing values as NaN."""
+        columns = {"step": np.asarray(self.step, dtype=np.int64), "created_at": np.asarray(self.created_at, dtype=np.int64)}
+        for name, values in self.values.items():
+            columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return columns
+
+
+@dataclass
+class JobState:
+    job_id: str
+    status: Optional[str] = None
+    fine_tuned_model: Optional[str] = None
+    trained_tokens: Optional[int] = None
+    error: Optional[str] = None
+    # events in chronological order
+    events: list = field(default_factory=list)
+    metrics: MetricSeries = field(default_factory=MetricSeries)
+    # id of the newest event seen, polls stop reading when they reach it
+    cursor: Optional[str] = None
+    n_requests: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+
+def parse_metrics(event):
+    """Metrics dict of a fine-tuning event, or None for plain messages."""
+    data = getattr(event, "data", None) or {}
+    if not isinstance(data, dict):
+        data = dict(data)
+    if "step" in data:
+        return data
+    match = _STEP_MESSAGE.match(event.message or "")
+    if match is None:
+        return None
+    step, total_steps, train_loss, valid_loss = match.groups()
+    return {
+        "step": int(step),
+        "total_steps": int(total_steps) if total_steps else None,
+        "train_loss": float(train_loss),
+        "valid_loss": float(valid_loss) if valid_loss else None,
+    }
+
+
+class JobMonitor:
+    """Polls the events of many fine-tuning jobs concurrently.
+
+    on_event(state, event) is called for every new event in chronological
+    order, on_status(state) whenever the job status changes."""
+
+    def __init__(self, client: AsyncOpenAI, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 backoff=DEFAULT_BACKOFF, page_size=DEFAULT_PAGE_SIZE, on_event=None, on_status=None):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.page_size = page_size
+        self.on_event = on_event
+        self.on_status = on_status
+        self.jobs = {}
+
+    async def fetch_new_events(self, state):
+        """Read events newer than state.cursor; returns them oldest first."""
+        new_events = []
+        after = None
+        while True:
+            params = {"limit": self.page_size}
+            if after is not None:
+                params["after"] = after
+            page = await self.client.fine_tuning.jobs.list_events(state.job_id, **params)
+            state.n_requests += 1
+            for event in page.data:
+                if event.id == state.cursor:
+                    return self._record(state, new_events)
+                new_events.append(event)
+            if not page.has_more or not page.data:
+                return self._record(state, new_events)
+            after = page.data[-1].id
+
+    def _record(self, state, new_events):
+        new_events.reverse()
+        for event in new_events:
+            state.events.append(event)
+            metrics = parse_metrics(event)
+            if metrics is not None:
+                state.metrics.add(metrics["step"], event.created_at, metrics.get("total_steps"),
+                                  **{name: metrics.get(name) for name in METRIC_FIELDS})
+            if self.on_event is not None:
+                self.on_event(state, event)
+        if new_events:
+            state.cursor = new_events[-1].id
+        return new_events
+
+    async def refresh_status(self, state):
+        job = await self.client.fine_tuning.jobs.retrieve(state.job_id)
+        state.n_requests += 1
+        changed = job.status != state.status
+        state.status = job.status
+        state.fine_tuned_model = job.fine_tuned_model
+        state.trained_tokens = job.trained_tokens
+        state.error = getattr(job.error, "message", None) if job.error else None
+        if changed and self.on_status is not None:
+            self.on_status(state)
+        return changed
+
+    async def watch(self, job_id, timeout=None):
+        """Follow one job until it reaches a terminal status; returns its JobState."""
+        state = self.jobs.setdefault(job_id, JobState(job_id))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self.min_interval
+        await self.refresh_status(state)
+        idle_polls = 0
+        while not state.done:
+            # jitter keeps many jobs from polling in lockstep
+            await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{job_id} still {state.status} after {timeout}s")
+            new_events = await self.fetch_new_events(state)
+            idle_polls = 0 if new_events else idle_polls + 1
+            changed = False
+            if new_events or idle_polls % STATUS_EVERY == 0:
+                changed = await self.refresh_status(state)
+            if new_events or changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+        # events written together with the final status
+        await self.fetch_new_events(state)
+        state.finished = time.perf_counter()
+        return state
+
+    async def watch_many(self, job_ids, timeout=None):
+        """Follow all jobs concurrently; returns their JobStates in order."""
+        return await asyncio.gather(*(self.watch(job_id, timeout) for job_id in job_ids))
+
+
+def print_event(state, event):
+    print(f"[{state.job_id}] {event.message}")
+
+
+def print_summary(states):
+    for state in states:
+        latest = state.metrics.latest() or {}
+        print(f"{state.job_id}: {state.status} -> {state.fine_tuned_model}, {len(state.events)} events, "
+              f"{len(state.metrics)} metric points, last train loss {latest.get('train_loss')}, "
+              f"valid loss {latest.get('valid_loss')}, {state.n_requests} API requests")
+        if state.error:
+            print(f"  error: {state.error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow fine-tuning jobs until they finish.")
+    parser.add_argument("job_ids", nargs="+")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"))
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--min-interval", type=float, default=DEFAULT_MIN_INTERVAL)
+    parser.add_argument("--max-interval", type=float, default=DEFAULT_MAX_INTERVAL)
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+
+    client = AsyncOpenAI(api_key=args.api_key, base_url=args.base_url)
+    monitor = JobMonitor(client, args.min_interval, args.max_interval, on_event=None if args.quiet else print_event)
+    print_summary(asyncio.run(monitor.watch_many(args.job_ids)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous upload + chained fine-tuning for the queue, DI QnA and
+Transactional tasks (the steps Custom_Tuning_RBC.ipynb runs cell by cell).
+
+All training and validation files are uploaded concurrently, then the jobs are
+submitted in order, each one starting from the fine_tuned_model of the
+previous job (queue -> DI QnA -> Transactional transfer learning).
+
+Works against any OpenAI compatible endpoint, e.g. the local stand-in:
+
+    python -m FineTuning.orchestrator --stub
+    python -m FineTuning.orchestrator --base-url http://127.0.0.1:8089/v1
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from openai import AsyncOpenAI
+
+from FineTuning.job_monitor import DEFAULT_MAX_INTERVAL, JobMonitor, print_event
+
+BASE_MODEL = "gpt-3.5-turbo-0125"
+DEFAULT_UPLOAD_CONCURRENCY = 8
+DEFAULT_POLL_INTERVAL = 10.0
+
+
+@dataclass
+class TaskSpec:
+    name: str
+    training_file: str
+    validation_file: Optional[str]
+    suffix: str
+    # None: n_epochs from complete_data_prep_analysis of the training file
+    hyperparameters: Optional[dict] = None
+
+
+DEFAULT_TASKS = [
+    TaskSpec("queue", './queue/training.jsonl', './queue/validation.jsonl', "queue-assist"),
+    TaskSpec("DI QnA", './DI_QnA_Assistance/training_DI_QnA.jsonl', './DI_QnA_Assistance/validation_DI_QnA.jsonl',
+             "QnA-Assist-DI", {"n_epochs": 3, "learning_rate_multiplier": 3, "batch_size": 1}),
+    TaskSpec("Transactional", './Transactional/training_DI_txn.jsonl', './Transactional/validation_DI_txn.jsonl',
+             "DI-Txn-Assist", {"n_epochs": 3, "learning_rate_multiplier": 2, "batch_size": 1}),
+]
+
+
+@dataclass
+class UploadResult:
+    path: str
+    file_id: str
+    n_bytes: int
+    seconds: float
+
+
+@dataclass
+class JobResult:
+    task: str
+    job_id: str
+    model: str
+    status: str
+    fine_tuned_model: Optional[str] = None
+    trained_tokens: Optional[int] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+    # last metrics event of the job (step, train_loss, valid_loss, ...)
+    final_metrics: Optional[dict] = None
+
+
+@dataclass
+class OrchestrationReport:
+    uploads: list = field(default_factory=list)
+    upload_seconds: float = 0.0
+    jobs: list = field(default_factory=list)
+    total_seconds: float = 0.0
+
+    @property
+    def uploaded_bytes(self):
+        return sum(u.n_bytes for u in self.uploads)
+
+    @property
+    def fine_tuned_model(self):
+        """Model produced by the last job of the chain (None if it did not finish)."""
+        return self.jobs[-1].fine_tuned_model if self.jobs else None
+
+    def print_report(self):
+        sequential = sum(u.seconds for u in self.uploads)
+        print(f"Uploaded {len(self.uploads)} files ({self.uploaded_bytes / 1e3:.1f} KB) in {self.upload_seconds:.2f}s: "
+              f"{len(self.uploads) / max(self.upload_seconds, 1e-9):.1f} files/s, "
+              f"{self.uploaded_bytes / 1e6 / max(self.upload_seconds, 1e-9):.2f} MB/s "
+              f"(sum of single upload times {sequential:.2f}s)")
+        for u in self.uploads:
+            print(f"  {u.path}: {u.file_id} ({u.seconds:.2f}s)")
+        for job in self.jobs:
+            print(f"{job.task}: {job.job_id} {job.status} in {job.seconds:.1f}s, "
+                  f"{job.model} -> {job.fine_tuned_model}" + (f" ({job.error})" if job.error else ""))
+            if job.final_metrics:
+                print(f"  step {job.final_metrics['step']}: train loss {job.final_metrics['train_loss']}, "
+                      f"valid loss {job.final_metrics['valid_loss']}")
+        print(f"Total: {self.total_seconds:.1f}s")
+
+
+async def upload_file(client, path, purpose="fine-tune"):
+    start = time.perf_counter()
+    content = await asyncio.to_thread(_read_bytes, path)
+    response = await client.files.create(file=(os.path.basename(path), content), purpose=purpose)
+    return UploadResult(path, response.id, len(content), time.perf_counter() - start)
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def upload_files(client, paths, concurrency=DEFAULT_UPLOAD_CONCURRENCY):
+    """Upload all paths concurrently (at most `concurrency` at a time); returns
+    UploadResults in the order of paths."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload(path):
+        async with semaphore:
+            return await upload_file(client, path)
+
+    return await asyncio.gather(*(upload(path) for path in paths))
+
+
+async def _task_hyperparameters(task, analyze):
+    if task.hyperparameters is not None:
+        return task.hyperparameters
+    if not analyze:
+        return None
+    from DataPrep.fine_tuning_data_prep_analysis import complete_data_prep_analysis
+    analysis = await asyncio.to_thread(complete_data_prep_analysis, task.training_file, verbose=False)
+    return {"n_epochs": analysis.n_epochs}
+
+
+async def run_pipeline(client, tasks=DEFAULT_TASKS, base_model=BASE_MODEL, upload_concurrency=DEFAULT_UPLOAD_CONCURRENCY,
+                       poll_interval=DEFAULT_POLL_INTERVAL, analyze=True, monitor=None, verbose=True):
+    """Upload every file of `tasks` concurrently, then run the chained jobs.
+
+    The first task fine-tunes base_model, every next one the model produced by
+    the previous job. Stops at the first job that does not succeed. Jobs are
+    followed with `monitor` (default: a JobMonitor polling every poll_interval
+    seconds at most, backing off while idle). Returns an OrchestrationReport."""
+    if monitor is None:
+        monitor = JobMonitor(client, min_interval=poll_interval, max_interval=max(poll_interval, DEFAULT_MAX_INTERVAL),
+                             on_event=print_event if verbose else None)
+    report = OrchestrationReport()
+    start = time.perf_counter()
+
+    paths = list(dict.fromkeys(p for task in tasks for p in (task.training_file, task.validation_file) if p))
+    # token analysis (for the default n_epochs) runs while the files upload
+    hyperparameters = asyncio.gather(*(_task_hyperparameters(task, analyze) for task in tasks))
+    report.uploads = await upload_files(client, paths, upload_concurrency)
+    report.upload_seconds = time.perf_counter() - start
+    file_ids = {u.path: u.file_id for u in report.uploads}
+    hyperparameters = await hyperparameters
+    if verbose:
+        print(f"Uploaded {len(paths)} files in {report.upload_seconds:.2f}s")
+
+    model = base_model
+    for task, task_hyperparameters in zip(tasks, hyperparameters):
+        job_start = time.perf_counter()
+        params = {"training_file": file_ids[task.training_file], "model": model, "suffix": task.suffix}
+        if task.validation_file:
+            params["validation_file"] = file_ids[task.validation_file]
+        if task_hyperparameters:
+            params["hyperparameters"] = task_hyperparameters
+        job = await client.fine_tuning.jobs.create(**params)
+        if verbose:
+            print(f"{task.name}: created {job.id} on {model}")
+        state = await monitor.watch(job.id)
+        report.jobs.append(JobResult(task.name, job.id, model, state.status, state.fine_tuned_model, state.trained_tokens,
+                                     time.perf_counter() - job_start, state.error, state.metrics.latest()))
+        if verbose:
+            print(f"{task.name}: {state.status} -> {state.fine_tuned_model}")
+        if state.status != "succeeded":
+            break
+        model = state.fine_tuned_model
+
+    report.total_seconds = time.perf_counter() - start
+    if verbose:
+        report.print_report()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload the fine-tuning files and run the chained jobs.")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"), help="OpenAI compatible endpoint")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--upload-concurrency", type=int, default=DEFAULT_UPLOAD_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="shortest delay between two polls")
+    parser.add_argument("--no-analysis", action="store_true", help="let the API pick n_epochs for tasks without hyperparameters")
+    parser.add_argument("--stub", action="store_true", help="run against a local stub server")
+    args = parser.parse_args()
+
+    server = None
+    if args.stub:
+        from FineTuning.stub_openai_server import serve_in_thread
+        server = serve_in_thread(latency=0.05)
+        args.base_url, args.api_key = server.base_url, "stub"
+        args.poll_interval = min(args.poll_interval, 0.2)
+    try:
+        client = AsyncOpenAI(api_key=args.api_key, base_url=args.base_url)
+        asyncio.run(run_pipeline(client, base_model=args.base_model, upload_concurrency=args.upload_concurrency,
+                                 poll_interval=args.poll_interval, analyze=not args.no_analysis))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
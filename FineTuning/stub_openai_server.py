@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the parts of the OpenAI API the fine-tuning pipeline uses.
+
+Implements files upload / retrieve, fine_tuning jobs create / retrieve /
+list / events / cancel and chat completions (plain and streamed) with the same
+JSON shapes as the real API, so the orchestrator and the batch inference can
+be exercised without an account or network access. Jobs run on a simulated
+clock: validating_files for `validation_seconds`, then `total_steps` training
+steps of `step_seconds` each (one metrics event per step), then succeeded.
+`latency` adds a delay to every request, handy to see what concurrency buys.
+
+Chat completions take `completion_seconds` and answer with the assistant
+message recorded for the last user message in `answers` (e.g. loaded from the
+validation files with --answers), else with an echo. With `rpm_limit` set,
+requests over the limit get a 429 with a retry-after header.
+
+    python -m FineTuning.stub_openai_server --port 8089 --answers ./queue/validation.jsonl
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python -m FineTuning.orchestrator
+"""
+
+import argparse
+import json
+import math
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _new_id(prefix):
+    return f"{prefix}-{uuid.uuid4().hex[:24]}"
+
+
+class StubState:
+    """In-memory files and jobs, shared by the request handler threads."""
+
+    def __init__(self, latency=0.0, validation_seconds=0.2, step_seconds=0.05, total_steps=20, fail_models=(),
+                 completion_seconds=0.05, answers=None, rpm_limit=None):
+        self.latency = latency
+        self.completion_seconds = completion_seconds
+        # last user message -> assistant answer
+        self.answers = dict(answers or {})
+        self.rpm_limit = rpm_limit
+        self._recent_completions = deque()
+        self.validation_seconds = validation_seconds
+        self.step_seconds = step_seconds
+        self.total_steps = total_steps
+        # jobs whose base model is in here fail after validation
+        self.fail_models = set(fail_models)
+        self.files = {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def create_file(self, filename, content, purpose):
+        file_id = _new_id("file")
+        lines = [line for line in content.decode("utf-8").splitlines() if line.strip()]
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "_n_examples": len(lines),
+        }
+        return self.files[file_id]
+
+    def create_job(self, body):
+        for key in ("training_file", "model"):
+            if not body.get(key):
+                raise ValueError(f"Missing required parameter: '{key}'.")
+        for key in ("training_file", "validation_file"):
+            if body.get(key) and body[key] not in self.files:
+                raise ValueError(f"invalid {key}: {body[key]}")
+        job_id = _new_id("ftjob")
+        now = time.time()
+        hyperparameters = dict(body.get("hyperparameters") or {})
+        hyperparameters.setdefault("n_epochs", "auto")
+        self.jobs[job_id] = {
+            "id": job_id,
+            "object": "fine_tuning.job",
+            "created_at": int(now),
+            "model": body["model"],
+            "training_file": body["training_file"],
+            "validation_file": body.get("validation_file"),
+            "hyperparameters": hyperparameters,
+            "suffix": body.get("suffix"),
+            "status": "validating_files",
+            "fine_tuned_model": None,
+            "finished_at": None,
+            "trained_tokens": None,
+            "error": None,
+            "_started": now,
+            "_cancelled_at": None,
+            "_events": [],
+        }
+        self._event(self.jobs[job_id], now, f"Created fine-tuning job: {job_id}")
+        return self.jobs[job_id]
+
+    def _event(self, job, created_at, message, level="info", data=None):
+        job["_events"].append({
+            "object": "fine_tuning.job.event",
+            "id": f"ftevent-{job['id'][6:]}-{len(job['_events']):06d}",
+            "created_at": int(created_at),
+            "level": level,
+            "message": message,
+            "data": data or {},
+            "type": "metrics" if data else "message",
+        })
+
+    def advance(self, job):
+        """Bring a job up to date with the simulated clock."""
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return
+        now = job["_cancelled_at"] or time.time()
+        started = job["_started"]
+        training_start = started + self.validation_seconds
+        if now < training_start:
+            return
+        if job["status"] == "validating_files":
+            if job["model"] in self.fail_models:
+                job["status"] = "failed"
+                job["finished_at"] = int(training_start)
+                job["error"] = {"code": "invalid_model", "message": f"Model {job['model']} cannot be fine-tuned", "param": "model"}
+                self._event(job, training_start, job["error"]["message"], level="error")
+                return
+            job["status"] = "running"
+            self._event(job, training_start, "Fine-tuning job started")
+
+        done = sum(1 for e in job["_events"] if e["type"] == "metrics")
+        steps = min(self.total_steps, int((now - training_start) / self.step_seconds))
+        for step in range(done + 1, steps + 1):
+            train_loss = round(2.0 * math.exp(-3.0 * step / self.total_steps) + 0.05, 4)
+            data = {"step": step, "total_steps": self.total_steps, "train_loss": train_loss,
+                    "train_mean_token_accuracy": round(1 - train_loss / 2.5, 4)}
+            message = f"Step {step}/{self.total_steps}: training loss={train_loss:.2f}"
+            if job["validation_file"]:
+                data["valid_loss"] = round(train_loss * 1.1, 4)
+                data["valid_mean_token_accuracy"] = round(1 - data["valid_loss"] / 2.5, 4)
+                message += f", validation loss={data['valid_loss']:.2f}"
+            self._event(job, training_start + step * self.step_seconds, message, data=data)
+
+        if job["_cancelled_at"]:
+            job["status"] = "cancelled"
+            job["finished_at"] = int(now)
+            self._event(job, now, "Fine-tuning job cancelled")
+        elif steps == self.total_steps:
+            finished = training_start + self.total_steps * self.step_seconds
+            n_examples = self.files[job["training_file"]]["_n_examples"]
+            job["status"] = "succeeded"
+            job["finished_at"] = int(finished)
+            job["trained_tokens"] = n_examples * 100 * self.total_steps
+            suffix = f":{job['suffix']}" if job["suffix"] else ""
+            job["fine_tuned_model"] = f"ft:{job['model'].removeprefix('ft:').split(':')[0]}:stub{suffix}:{job['id'][6:14]}"
+            self._event(job, finished, f"New fine-tuned model created: {job['fine_tuned_model']}")
+            self._event(job, finished, "The job has successfully completed")
+
+    def admit_completion(self, now):
+        """False when the request is over rpm_limit in the last minute."""
+        if not self.rpm_limit:
+            return True
+        while self._recent_completions and self._recent_completions[0] <= now - 60:
+            self._recent_completions.popleft()
+        if len(self._recent_completions) >= self.rpm_limit:
+            return False
+        self._recent_completions.append(now)
+        return True
+
+    def completion(self, body):
+        messages = body.get("messages")
+        if not body.get("model") or not messages:
+            raise ValueError("Missing required parameter: 'model' or 'messages'.")
+        question = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        answer = self.answers.get(question, f"Stub answer to: {question}")
+        prompt_tokens = sum(3 + len(m.get("content") or "") // 4 for m in messages) + 3
+        completion_tokens = len(answer) // 4 + 1
+        return answer, {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens}
+
+
+def load_answers(paths):
+    """last user message -> assistant answer of the examples in JSONL files."""
+    answers = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    messages = json.loads(line).get("messages", [])
+                    users = [m["content"] for m in messages if m.get("role") == "user"]
+                    if users and messages[-1].get("role") == "assistant":
+                        answers[users[-1]] = messages[-1]["content"]
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue  # not an example; batch_inference records it as an error
+    return answers
+
+
+def public(obj):
+    return {k: v for k, v in obj.items() if not k.startswith("_")}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def setup(self):
+        super().setup()
+        # headers and body go out as separate writes, don't let Nagle hold one back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, code=None):
+        self._send(status, {"error": {"message": message, "type": "invalid_request_error", "param": None, "code": code}})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _route(self, method):
+        with self.state.lock:
+            self.state.request_count += 1
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = re.sub(r"^/v1", "", url.path).rstrip("/")
+        for pattern, handler_method, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and handler_method == method:
+                try:
+                    return getattr(self, name)(query, *match.groups())
+                except ValueError as e:
+                    return self._error(400, str(e))
+                except KeyError as e:
+                    return self._error(404, f"No such object: {e.args[0]}")
+        self._error(404, f"Unknown endpoint {method} {url.path}")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    routes = [
+        (r"/files", "POST", "create_file"),
+        (r"/files/([\w-]+)", "GET", "retrieve_file"),
+        (r"/fine_tuning/jobs", "POST", "create_job"),
+        (r"/fine_tuning/jobs", "GET", "list_jobs"),
+        (r"/fine_tuning/jobs/([\w-]+)", "GET", "retrieve_job"),
+        (r"/fine_tuning/jobs/([\w-]+)/events", "GET", "list_events"),
+        (r"/fine_tuning/jobs/([\w-]+)/cancel", "POST", "cancel_job"),
+        (r"/chat/completions", "POST", "create_completion"),
+    ]
+
+    def create_file(self, query):
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=HTTP).parsebytes(header + self._body())
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = (part.get_filename(), part.get_payload(decode=True))
+        if "file" not in fields:
+            raise ValueError("Missing required parameter: 'file'.")
+        filename, content = fields["file"]
+        purpose = (fields.get("purpose") or (None, b"fine-tune"))[1].decode("utf-8")
+        with self.state.lock:
+            file = self.state.create_file(filename, content, purpose)
+        self._send(200, public(file))
+
+    def retrieve_file(self, query, file_id):
+        self._send(200, public(self.state.files[file_id]))
+
+    def create_job(self, query):
+        body = json.loads(self._body() or b"{}")
+        with self.state.lock:
+            job = self.state.create_job(body)
+        self._send(200, public(job))
+
+    def list_jobs(self, query):
+        with self.state.lock:
+            jobs = sorted(self.state.jobs.values(), key=lambda j: j["_started"], reverse=True)
+            for job in jobs:
+                self.state.advance(job)
+            data = [public(job) for job in jobs]
+        self._send(200, {"object": "list", "data": data, "has_more": False})
+
+    def retrieve_job(self, query, job_id):
+        with self.state.lock:
+            job = self.state.jobs[job_id]
+            self.state.advance(job)
+            data = public(job)
+        self._send(200, data)
+
+    def list_events(self, query, job_id):
+        limit = int(query.get("limit", 20))
+        with self.state.lock:
+            job = self.state.jobs[job_id]
+            self.state.advance(job)
+            # newest first; `after` is the last event id of the previous page
+            events = job["_events"][::-1]
+        if "after" in query:
+            ids = [e["id"] for e in events]
+            events = events[ids.index(query["after"]) + 1:] if query["after"] in ids else []
+        self._send(200, {"object": "list", "data": events[:limit], "has_more": len(events) > limit})
+
+    def cancel_job(self, query, job_id):
+        with self.state.lock:
+            job = self.state.jobs[job_id]
+            if job["status"] in ("succeeded", "failed", "cancelled"):
+                raise ValueError(f"Job {job_id} has already finished")
+            job["_cancelled_at"] = time.time()
+            self.state.advance(job)
+            data = public(job)
+        self._send(200, data)
+
+    def create_completion(self, query):
+        body = json.loads(self._body() or b"{}")
+        with self.state.lock:
+            admitted = self.state.admit_completion(time.time())
+            answer, usage = self.state.completion(body)
+        if not admitted:
+            data = json.dumps({"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                         "param": None, "code": "rate_limit_exceeded"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("retry-after", "1")
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        completion_id = _new_id("chatcmpl")
+        created = int(time.time())
+        if not body.get("stream"):
+            time.sleep(self.state.completion_seconds)
+            return self._send(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "logprobs": None,
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = re.findall(r"\S+\s*", answer) or [answer]
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"]}
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": piece} for piece in pieces]
+        for i, delta in enumerate(deltas):
+            if i:
+                time.sleep(self.state.completion_seconds / len(pieces))
+            self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": None}]})
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {}, "logprobs": None, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**chunk, "choices": [], "usage": usage})
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _send_event(self, data):
+        self._send_chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), state=None, verbose=False, handler=StubHandler):
+        super().__init__(address, handler)
+        self.state = state or StubState()
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def serve_in_thread(port=0, **state_kwargs):
+    """Start a stub server on a background thread; returns the server, whose
+    base_url is ready to pass to OpenAI(base_url=...). Stop it with shutdown()."""
+    server = StubServer(("127.0.0.1", port), StubState(**state_kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI files and fine-tuning API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--step-seconds", type=float, default=0.05)
+    parser.add_argument("--total-steps", type=int, default=20)
+    parser.add_argument("--completion-seconds", type=float, default=0.05, help="generation time of a chat completion")
+    parser.add_argument("--answers", nargs="*", default=[], help="JSONL files whose assistant answers the stub replays")
+    parser.add_argument("--rpm-limit", type=int, default=None, help="chat completions per minute before 429s")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    state = StubState(latency=args.latency, step_seconds=args.step_seconds, total_steps=args.total_steps,
+                      completion_seconds=args.completion_seconds, answers=load_answers(args.answers),
+                      rpm_limit=args.rpm_limit)
+    server = StubServer(("127.0.0.1", args.port), state, verbose=args.verbose)
+    print(f"Serving on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
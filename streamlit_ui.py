@@ -1,11 +1,20 @@
-import openai
 import streamlit as st
 from streamlit_chat import message
 from dotenv import load_dotenv
 import os
-import json
+import dataclasses
 #from serpapi import GoogleSearch
-import requests
+
+from ChatEngine.history import ConversationHistory, make_llm_summarizer
+from ChatEngine.resources import (get_openai_client, get_queue_classifier, get_retrieval_index, get_task_router, get_txn_store,
+                                  latency_recorder)
+from ChatEngine.response_cache import CachedClient, response_cache
+from ChatEngine.router import TaskRouter
+from ChatEngine.search_backends import make_backend
+from ChatEngine.streaming import StreamingChatEngine
+from ChatEngine.tool_executor import ToolExecutor
+from ChatEngine.tools import TOOLS, make_search_internet
+from ChatEngine.txn_fastpath import TxnFastPath
 
 load_dotenv(override=True)
 openai_api_key = st.secrets["OPENAI_API_KEY"]
@@ -19,7 +28,8 @@ serp_api_secret = st.secrets["SERP_API_KEY"]
 #serp_api_secret = os.getenv("SERP_API_KEY")
 
 
-client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", openai_api_key))
+# one client (and connection pool) per process, shared by every rerun and session
+client = get_openai_client(os.environ.get("OPENAI_API_KEY", openai_api_key))
 
 
 def run_conversation():
@@ -27,25 +37,7 @@ def run_conversation():
     messages = []
     messages.append({"role": "system", "content": "You are allowed to generate search_query text on Financial Industries such as Dividends, Earnings per share/EPS etc. and plug into functions.  Provide Answer with Reference link from function in the format: [Answer](URL)"})
     messages.append({"role": "user", "content": "What's the last quarter dividend price declared by Scotiabank in Q1 2024?"})
-    tools = [
-         {
-        "type": "function",
-        "function": {
-            "name": "search_internet",
-            "description": "Search the internet for the search_query on Finance.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "search_query": {
-                        "type": "string",
-                        "description": "The query to search for on the internet."
-                    }
-                },
-                "required": ["search_query"]
-            }
-        }
-    }
-    ]
+    tools = TOOLS
     response = client.chat.completions.create(
         model=fine_tuned_model_id,
         messages=messages,
@@ -57,78 +49,41 @@ def run_conversation():
     # Step 2: check if the model wanted to call a function
     if tool_calls:
         print('+++++++++++Invoking function++++++++')
-        # Step 3: call the function
-        # Note: the JSON response may not always be valid; be sure to handle errors
-        available_functions = {
-            "search_internet": search_internet,
-        }  # only one function in this example, but you can have multiple
+        # Step 3: call the functions (tool_executor maps the names to functions, invalid
+        # JSON arguments or a failing search come back as an error tool message)
         messages.append(response_message)  # extend conversation with assistant's reply
-        # Step 4: send the info for each function call and function response to the model
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            print('function to call -->',function_to_call)
-            function_args = json.loads(tool_call.function.arguments)
-            print('function to call w/ arguments-->',function_args)
-            function_response = function_to_call(
-                search_query=function_args.get("search_query")
-            )
-            messages.append(
-                {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )  # extend conversation with function response
+        # Step 4: run the function calls of the turn concurrently and send the
+        # responses to the model, in the order of the tool calls
+        for result in tool_executor.run(tool_calls):
+            print('function called -->', result.name, 'in %.2fs' % result.seconds, '' if result.ok else result.error)
+            messages.append(result.to_message())  # extend conversation with function response
         second_response = client.chat.completions.create(
             model=fine_tuned_model_id,
             messages=messages,
         )  # get a new response from the model where it can see the function response
         return second_response
     
-# Example dummy function hard coded to return the same weather
-# In production, this could be your backend API or an external API
-def search_internet(search_query):
-    """Get the latest news from the internet on Finance for given search_query"""
-    if search_query == None:
-        print("LLM Didn't pass the argument")
-        return
-    # params = {
-    # "engine": "google",
-    # "q": search_query,
-    # "api_key": serp_api_secret
-
-    # }
-    # # print('--------------')
-    # # print(params)
-    # # print('--------------')
-    # search = GoogleSearch(params)
-    # results = search.get_dict()
-    # # print('--------------')
-    # # print(results)
-    # # print('--------------')
-    # organic_results = results["organic_results"][:3]
-    
-    params = {
-    'api_key': serp_api_secret,
-    'q': search_query,
-    'google_domain': 'google.com',
-    'gl': 'ca'
-    }
-
-    # make the http GET request to VALUE SERP
-    api_result = requests.get('https://api.valueserp.com/search', params)
+# search_internet runs on the backend picked with SEARCH_BACKEND (valueserp,
+# serpapi, offline or hedged:valueserp,serpapi), see ChatEngine/search_backends.py;
+# results are cached by normalized query
+search_backend = make_backend(os.getenv("SEARCH_BACKEND", "valueserp"), api_keys={"valueserp": serp_api_secret})
+search_internet = make_search_internet(search_backend)
 
-    data = json.loads((json.dumps(api_result.json())))
+# shared by run_conversation and the chat UI: every tool call of a turn runs
+# concurrently, with a timeout per call
+tool_executor = ToolExecutor({"search_internet": search_internet})
 
-    # Extract organic results
-    organic_results = data["organic_results"][:3]   
-
-    # Extract 'link' and 'snippet' fields from each dictionary
-    filtered_data = [{'link': item['link'], 'snippet': item['snippet']} for item in organic_results]
-    # Convert the filtered data to JSON
-    return json.dumps(filtered_data, indent=4)
+# picks queue / qna / transactional for each question, see ChatEngine/router.py
+search_instructions = "\n--You are allowed to generate search_query text on Financial Industries such as Dividends, Earnings per share/EPS etc. and plug into functions.  Provide Answer with Reference link from function in the format: [Answer](URL)"
+task_router = get_task_router(suffix=search_instructions)
+# the transactions table in SQLite; the Transactional prompt only carries the
+# rows matching the question, see ChatEngine/txn_store.py
+txn_store = get_txn_store()
+txn_fast_path = TxnFastPath(txn_store)
+queue_classifier = get_queue_classifier()
+# RETRIEVAL_SOURCES: extra files or folders of documents for the QnA answers
+retrieval_index = get_retrieval_index(os.getenv("RETRIEVAL_INDEX_DIR", "./retrieval_index"),
+                                      tuple(filter(None, os.getenv("RETRIEVAL_SOURCES", "").split(os.pathsep))))
 
 def run():
 
@@ -157,11 +112,20 @@ def run():
 
     
     
-    client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", openai_api_key))
 
     if "openai_model" not in st.session_state:
         st.session_state["openai_model"] = fine_tuned_model_id
 
+    # what is sent of st.session_state.messages: the system prompt and the recent
+    # turns within HISTORY_TOKEN_BUDGET tokens; older turns are dropped, or
+    # summarized when HISTORY_SUMMARY_MODEL is set
+    if "history" not in st.session_state:
+        summary_model = os.getenv("HISTORY_SUMMARY_MODEL")
+        st.session_state.history = ConversationHistory(
+            budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 4000)),
+            summarizer=make_llm_summarizer(client, summary_model) if summary_model else None,
+        )
+
     if "messages" not in st.session_state:
         st.session_state.messages = []
         st.session_state.messages.append({"role": "system", "content": system_message})
@@ -175,100 +139,72 @@ def run():
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
-        tools = [
-                    {
-                    "type": "function",
-                    "function": {
-                        "name": "search_internet",
-                        "description": "Search the internet for the search_query on Finance.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "search_query": {
-                                    "type": "string",
-                                    "description": "The query to search for on the internet."
-                                }
-                            },
-                            "required": ["search_query"]
-                        }
-                    }
-                }
-                ]
-        
-            # try:
-                    
-        response_ai = client.chat.completions.create(
-            model=st.session_state["openai_model"],
-            messages=[
-                {"role": m["role"], "content": m["content"]}
-                for m in st.session_state.messages
-            ],
-            tools=tools,
-            tool_choice="auto",
-        )
-        
-        #response = response_ai.choices[0].message.content
+        tools = TOOLS
+
+        # only the system prompt of the task the question belongs to is sent (the
+        # combined prompt above when the router is unsure)
+        decision = task_router.route(prompt, previous=st.session_state.get("task"))
+        st.session_state["task"] = decision.task
+        if decision.task == "transactional":
+            decision = dataclasses.replace(decision, system_prompt=txn_store.system_prompt(prompt) + search_instructions)
+        elif decision.task == "qna":
+            # the passages of the local documents closest to the question, see ChatEngine/retrieval.py
+            decision = dataclasses.replace(decision, system_prompt=decision.system_prompt + retrieval_index.context(prompt))
+        print('task -->', decision.task, 'similarity %.2f margin %.2f' % (decision.similarity, decision.margin))
         
-        response_message = response_ai.choices[0].message
-        tool_calls = response_message.tool_calls
-        if tool_calls:
-            gif_runner = st.image('https://i.postimg.cc/P5YszBXF/output-online-gif.gif', width=100)
-            print('+++++++++++Invoking function++++++++')
-            # Step 3: call the function
-            # Note: the JSON response may not always be valid; be sure to handle errors
-            available_functions = {
-                "search_internet": search_internet,
-            }  # only one function in this example, but you can have multiple
-            # this temp_msg is to store the response from the function call - serpapi
-            temp_msg = []
-            temp_msg.append(response_message)  # extend conversation with assistant's reply <----- Not extending the conversation with assistant's reply
-            #st.session_state.messages.append(response_message)  # extend conversation with assistant's reply <----- Not extending the conversation with assistant's reply
-            # Step 4: send the info for each function call and function response to the model
-            for tool_call in tool_calls:
-                function_name = tool_call.function.name
-                function_to_call = available_functions[function_name]
-                # print('function to call -->',function_to_call)
-                function_args = json.loads(tool_call.function.arguments)
-                # print('function to call w/ arguments-->',function_args)
-                function_response = function_to_call(
-                    search_query=function_args.get("search_query")
+        # exact lookups on the transactions table (balance of an account, accounts
+        # with a status...) are answered locally, see ChatEngine/txn_fastpath.py
+        fast_path = txn_fast_path.answer(prompt) if decision.task == "transactional" else None
+        if fast_path is not None:
+            print('fast path -->', fast_path.reason, 'in %.0fus' % (fast_path.seconds * 1e6))
+        # confident queue labels come from ChatEngine/queue_classifier.py, the others
+        # from the fine-tuned model
+        queue_label = queue_classifier.classify(prompt) if decision.task == "queue" else None
+        if queue_label is not None:
+            print('queue classifier -->', queue_label.label, 'confidence %.2f' % queue_label.confidence)
+
+        # Stream the answer: text is shown as it arrives, search_internet calls run
+        # as soon as their arguments are complete and the answer that uses the
+        # search results is streamed too
+        with st.chat_message("assistant"):
+            if fast_path is not None and fast_path.hit:
+                response = fast_path.answer
+                st.markdown(response)
+            elif queue_label is not None and queue_label.local:
+                response = queue_label.label
+                st.markdown(response)
+            else:
+                gif_runner = st.empty()
+                # queue labels and QnA answers are deterministic: asked again, they are
+                # replayed from ChatEngine/response_cache.py
+                params = {"temperature": 0} if decision.task in ("queue", "qna") else {}
+                cached_client = CachedClient(client, response_cache)
+                engine = StreamingChatEngine(
+                    cached_client,
+                    st.session_state["openai_model"],
+                    tools=tools,
+                    executor=tool_executor,
+                    on_tool_call=lambda tool_call: gif_runner.image('https://i.postimg.cc/P5YszBXF/output-online-gif.gif', width=100),
+                    on_tool_results=lambda tool_messages: gif_runner.empty(),
                 )
-                temp_msg.append({
-                         "tool_call_id": tool_call.id,
-                         "role": "tool",
-                         "name": function_name,
-                         "content": function_response,
-                     })
-                # st.session_state.messages.append(
-                #     {
-                #         "tool_call_id": tool_call.id,
-                #         "role": "tool",
-                #         "name": function_name,
-                #         "content": function_response,
-                #     }
-                # )  # extend conversation with function response
-            # print('+++++++++++++++++++++++++++++++SSM++++++++++++++++++++++++++++++++++++++++++++++++++')
-            # print(st.session_state.messages) # the last message in the session state
-            # print('+++++++++++++++++++++++++++++++TEMP_MSG++++++++++++++++++++++++++++++++++++++++++++++++++')
-            # print(temp_msg)
-            
-            
-            second_response = client.chat.completions.create(
-                model=fine_tuned_model_id,
-                messages=[st.session_state.messages[-1]]+temp_msg,
-            )
-            
-            sec_response_message = second_response.choices[0].message
-            st.session_state.messages.append({"role": "assistant", "content": sec_response_message.content})
-            gif_runner.empty()
-            with st.chat_message("assistant"):
-                st.markdown(sec_response_message.content)
-        
+                response = st.write_stream(engine.stream(
+                    TaskRouter.apply(st.session_state.history.window(st.session_state.messages), decision), **params
+                ))
+        st.session_state.messages.append({"role": "assistant", "content": response})
+        if fast_path is not None and fast_path.hit:
+            st.sidebar.caption('answered from the transactions table in %.0f us' % (fast_path.seconds * 1e6))
+        elif queue_label is not None and queue_label.local:
+            st.sidebar.caption('classified locally (confidence %.2f) in %.0f us' % (queue_label.confidence, queue_label.seconds * 1e6))
+        elif cached_client.chat.completions.last_hit is not None:
+            cache_hit = cached_client.chat.completions.last_hit
+            print('response cache -->', cache_hit.kind, 'similarity %.2f' % cache_hit.similarity)
+            st.sidebar.caption('answered from the response cache (%s) in %.0f us' % (cache_hit.kind, cache_hit.seconds * 1e6))
         else:
-            st.session_state.messages.append({"role": "assistant", "content": response_message.content})
-            
-            with st.chat_message("assistant"):
-                st.markdown(response_message.content)
+            # connect / first byte / generation time of the last OpenAI request
+            timing = latency_recorder.last()
+            if timing is not None:
+                print(timing.describe())
+                st.sidebar.caption(timing.describe())
         
         print('++++++++++++++++++++++++++++++++FNL STATE+++++++++++++++++++++++++++++++++++++++++++++++++')
         print(st.session_state.messages)
@@ -3,8 +3,13 @@ import streamlit as st
 from streamlit_chat import message
 from dotenv import load_dotenv
 import os
-import json
-from serpapi import GoogleSearch
+#from serpapi import GoogleSearch
+
+from ChatEngine.history import ConversationHistory, make_llm_summarizer
+from ChatEngine.resources import get_openai_client
+from ChatEngine.search_backends import make_backend
+from ChatEngine.tool_executor import ToolExecutor
+from ChatEngine.tools import TOOLS, make_search_internet
 
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
@@ -14,7 +19,8 @@ openai.api_key = os.getenv("API_KEY")
 openai.base_url = os.getenv("BASE_URL")
 serp_api_secret = os.getenv("SERP_API_KEY")
 
-client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", openai_api_key))
+# one client (and connection pool) per process, shared by every rerun and session
+client = get_openai_client(os.environ.get("OPENAI_API_KEY", openai_api_key))
 
 
 def run_conversation():
@@ -22,25 +28,7 @@ def run_conversation():
     messages = []
     messages.append({"role": "system", "content": "You are allowed to generate search_query text on Financial Industries such as Dividends, Earnings per share/EPS etc. and plug into functions.  Provide Answer with Reference link from function in the format: [Answer](URL)"})
     messages.append({"role": "user", "content": "What's the last quarter dividend price declared by Scotiabank in Q1 2024?"})
-    tools = [
-         {
-        "type": "function",
-        "function": {
-            "name": "search_internet",
-            "description": "Search the internet for the search_query on Finance.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "search_query": {
-                        "type": "string",
-                        "description": "The query to search for on the internet."
-                    }
-                },
-                "required": ["search_query"]
-            }
-        }
-    }
-    ]
+    tools = TOOLS
     response = client.chat.completions.create(
         model=fine_tuned_model_id,
         messages=messages,
@@ -52,64 +40,29 @@ def run_conversation():
     # Step 2: check if the model wanted to call a function
     if tool_calls:
         print('+++++++++++Invoking function++++++++')
-        # Step 3: call the function
-        # Note: the JSON response may not always be valid; be sure to handle errors
-        available_functions = {
-            "search_internet": search_internet,
-        }  # only one function in this example, but you can have multiple
+        # Step 3: call the functions (tool_executor maps the names to functions, invalid
+        # JSON arguments or a failing search come back as an error tool message)
         messages.append(response_message)  # extend conversation with assistant's reply
-        # Step 4: send the info for each function call and function response to the model
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            print('function to call -->',function_to_call)
-            function_args = json.loads(tool_call.function.arguments)
-            print('function to call w/ arguments-->',function_args)
-            function_response = function_to_call(
-                search_query=function_args.get("search_query")
-            )
-            messages.append(
-                {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )  # extend conversation with function response
+        # Step 4: run the function calls of the turn concurrently and send the
+        # responses to the model, in the order of the tool calls
+        for result in tool_executor.run(tool_calls):
+            print('function called -->', result.name, 'in %.2fs' % result.seconds, '' if result.ok else result.error)
+            messages.append(result.to_message())  # extend conversation with function response
         second_response = client.chat.completions.create(
             model=fine_tuned_model_id,
             messages=messages,
         )  # get a new response from the model where it can see the function response
         return second_response
     
-# Example dummy function hard coded to return the same weather
-# In production, this could be your backend API or an external API
-def search_internet(search_query):
-    """Get the latest news from the internet on Finance for given search_query"""
-    if search_query == None:
-        print("LLM Didn't pass the argument")
-        return
-    params = {
-    "engine": "google",
-    "q": search_query,
-    "api_key": serp_api_secret
-
-    }
-    print('--------------')
-    print(params)
-    print('--------------')
-    search = GoogleSearch(params)
-    results = search.get_dict()
-    print('--------------')
-    print(results)
-    print('--------------')
-    organic_results = results["organic_results"][:3]
-
-    # Extract 'link' and 'snippet' fields from each dictionary
-    filtered_data = [{'link': item['link'], 'snippet': item['snippet']} for item in organic_results]
-
-    # Convert the filtered data to JSON
-    return json.dumps(filtered_data, indent=4)
+# search_internet runs on the backend picked with SEARCH_BACKEND (valueserp,
+# serpapi, offline or hedged:valueserp,serpapi), see ChatEngine/search_backends.py;
+# results are cached by normalized query
+search_backend = make_backend(os.getenv("SEARCH_BACKEND", "serpapi"), api_keys={"serpapi": serp_api_secret})
+search_internet = make_search_internet(search_backend)
+
+# shared by run_conversation and the chat UI: every tool call of a turn runs
+# concurrently, with a timeout per call
+tool_executor = ToolExecutor({"search_internet": search_internet})
 
 def run():
 
@@ -138,11 +91,20 @@ def run():
 
     
     
-    client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", openai_api_key))
 
     if "openai_model" not in st.session_state:
         st.session_state["openai_model"] = fine_tuned_model_id
 
+    # what is sent of st.session_state.messages: the system prompt and the recent
+    # turns within HISTORY_TOKEN_BUDGET tokens; older turns are dropped, or
+    # summarized when HISTORY_SUMMARY_MODEL is set
+    if "history" not in st.session_state:
+        summary_model = os.getenv("HISTORY_SUMMARY_MODEL")
+        st.session_state.history = ConversationHistory(
+            budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 4000)),
+            summarizer=make_llm_summarizer(client, summary_model) if summary_model else None,
+        )
+
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
@@ -160,10 +122,7 @@ def run():
             try:    
                 stream = client.chat.completions.create(
                     model=st.session_state["openai_model"],
-                    messages=[
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.messages
-                    ],
+                    messages=st.session_state.history.window(st.session_state.messages),
                     stream=True,
                 )
                 response = st.write_stream(stream)
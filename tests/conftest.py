@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+from datetime import date
+
+import pytest
+import tiktoken
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ChatEngine.txn_store import Transaction, TransactionStore  # noqa: E402
+
+
+@pytest.fixture(autouse=True, scope="session")
+def repo_root():
+    """The default dataset paths ("./DI_QnA_Assistance/...") are relative to the repo root."""
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    yield ROOT
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def txn_store():
+    """A few rows of the Transactional table."""
+    return TransactionStore([
+        Transaction("123456", date(2024, 1, 5), "Transferred cash from TD Bank to RBC", date(2024, 2, 14), None,
+                    75000.0, 150000.0, 10, "Opened", "Contacted customer to confirm transaction", date(2024, 2, 14)),
+        Transaction("345678", date(2024, 1, 15), "Withdrew cash for investment", date(2024, 2, 5), 50000.0, None,
+                    150000.0, None, "Closed", None, None),
+        Transaction("901234", date(2024, 1, 20), "Deposited funds from BMO into account", date(2024, 2, 7), None,
+                    85000.0, 185000.0, 18, "Opened", "Verified deposit with customer", date(2024, 2, 7)),
+        Transaction("234567", date(2024, 2, 3), "Withdrew funds for stock purchase", date(2024, 2, 25), 70000.0, None,
+                    160000.0, None, "Closed", None, None),
+    ])
+
+
+class WordEncoding:
+    """Offline stand-in for a tiktoken encoding: one token per word or punctuation mark."""
+
+    name = "cl100k_base"
+
+    def encode(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+    def encode_batch(self, texts, num_threads=8):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    """tiktoken.get_encoding returns a WordEncoding, so the tests need no BPE download."""
+    encoding = WordEncoding()
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: encoding)
+    return encoding
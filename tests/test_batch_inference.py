@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from FineTuning.batch_inference import RateLimiter, load_results, prompt_hash, split_example
+
+
+def test_split_example_and_prompt_hash():
+    example = {"messages": [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]}
+    messages, reference = split_example(example)
+    assert messages == [{"role": "user", "content": "Hi"}]
+    assert reference == "Hello"
+    assert split_example({"messages": messages}) == (messages, None)
+    assert prompt_hash(messages) == prompt_hash([{"role": "user", "content": "Hi"}])
+    assert prompt_hash(messages) != prompt_hash([{"role": "user", "content": "Hi!"}])
+
+
+def test_load_results_keeps_the_last_record_and_skips_a_cut_line(tmp_path):
+    path = tmp_path / "predictions.jsonl"
+    path.write_text('{"index": 0, "error": "timeout"}\n{"index": 0, "error": null}\n{"index": 1, "err', encoding='utf-8')
+    assert load_results(str(path)) == {0: {"index": 0, "error": None}}
+    assert load_results(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_rate_limiter_waits_for_the_next_request():
+    async def run():
+        limiter = RateLimiter(rpm=600)
+        for _ in range(600):
+            await limiter.acquire(0)
+        assert limiter.waited == 0
+        await limiter.acquire(0)
+        return limiter.waited
+
+    # a bucket of 600 requests per minute refills one request per 0.1 s
+    assert 0.05 < asyncio.run(run()) <= 0.1
+
+
+def test_rate_limiter_tokens_refund_and_pause():
+    async def run():
+        limiter = RateLimiter(tpm=6000)
+        await limiter.acquire(6000)
+        limiter.refund(3000)
+        await limiter.acquire(3000)
+        assert limiter.waited == 0
+        limiter.pause(0.1)
+        await limiter.acquire(1)
+        return limiter.waited
+
+    assert 0.09 < asyncio.run(run()) < 0.2
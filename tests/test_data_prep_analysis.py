@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+from DataPrep.fine_tuning_data_prep_analysis import (
+    TARGET_EPOCHS,
+    checkpoint_path_for,
+    complete_data_prep_analysis,
+    compute_stats,
+    estimate_n_epochs,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+
+def test_estimate_n_epochs():
+    assert estimate_n_epochs(10) == 10
+    assert estimate_n_epochs(1000) == TARGET_EPOCHS
+    assert estimate_n_epochs(100_000) == 1
+    assert estimate_n_epochs(0) == TARGET_EPOCHS
+
+
+@pytest.mark.parametrize("content", ["", '{"a": 1}\n[1]\n'])
+@pytest.mark.parametrize("mode", [{}, {"streaming": True}, {"incremental": True}])
+def test_empty_or_invalid_file(tmp_path, encoding, capsys, content, mode):
+    path = tmp_path / "data.jsonl"
+    path.write_text(content, encoding='utf-8')
+    result = complete_data_prep_analysis(str(path), cache_path=None, **mode)
+    assert result.n_billing_tokens == 0
+    if not content:
+        assert result.n_epochs == TARGET_EPOCHS
+        assert "nothing to train on" in capsys.readouterr().out
+
+
+def example_line(i):
+    return json.dumps({"messages": [{"role": "system", "content": "You are a helpful assistant."},
+                                    {"role": "user", "content": f"Question number {i} about my account?"},
+                                    {"role": "assistant", "content": "Answer " + "word " * (i % 7)}]}) + "\n"
+
+
+def test_streaming_matches_the_exact_analysis(tmp_path, encoding):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(example_line(i) for i in range(50)), encoding='utf-8')
+    exact = complete_data_prep_analysis(str(path), verbose=False)
+    streamed = complete_data_prep_analysis(str(path), streaming=True, verbose=False)
+    assert streamed.n_billing_tokens == exact.n_billing_tokens
+    assert streamed.histograms == exact.histograms
+    for name, distribution in exact.distributions.items():
+        assert streamed.distributions[name]["min"] == distribution["min"]
+        assert streamed.distributions[name]["max"] == distribution["max"]
+
+
+def test_checkpoint_resume_only_reads_the_appended_rows(tmp_path, encoding, monkeypatch):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(example_line(i) for i in range(20)), encoding='utf-8')
+    first = complete_data_prep_analysis(str(path), incremental=True, verbose=False)
+    assert first.n_examples == 20
+    assert os.path.exists(checkpoint_path_for(str(path)))
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("".join(example_line(i) for i in range(20, 30)))
+    encoded = []
+    monkeypatch.setattr(encoding, "encode_batch", lambda texts, num_threads=8: encoded.extend(texts) or
+                        [encoding.encode(text) for text in texts])
+    resumed = complete_data_prep_analysis(str(path), incremental=True, verbose=False)
+    questions = {text for text in encoded if text.startswith("Question number")}
+    assert questions == {f"Question number {i} about my account?" for i in range(20, 30)}
+
+    full = complete_data_prep_analysis(str(path), streaming=True, verbose=False)
+    assert resumed.n_examples == 30
+    assert resumed.n_billing_tokens == full.n_billing_tokens
+    assert resumed.histograms == full.histograms
+
+
+def test_rewritten_file_is_analyzed_again(tmp_path, encoding):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(example_line(i) for i in range(20)), encoding='utf-8')
+    complete_data_prep_analysis(str(path), incremental=True, verbose=False)
+    path.write_text("".join(example_line(i) for i in range(100, 125)), encoding='utf-8')
+    offset, stats = load_checkpoint(str(path), checkpoint_path_for(str(path)))
+    assert (offset, stats) == (0, None)
+    assert complete_data_prep_analysis(str(path), incremental=True, verbose=False).n_examples == 25
+
+
+def test_checkpoint_round_trip(tmp_path, encoding):
+    path = tmp_path / "data.jsonl"
+    path.write_text("".join(example_line(i) for i in range(10)), encoding='utf-8')
+    stats = compute_stats(str(path))
+    save_checkpoint(str(path), str(tmp_path / "checkpoint.json"), os.path.getsize(path), stats)
+    offset, loaded = load_checkpoint(str(path), str(tmp_path / "checkpoint.json"))
+    assert offset == os.path.getsize(path)
+    assert loaded.to_dict() == stats.to_dict()
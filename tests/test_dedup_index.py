@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import json
+
+from DataPrep.dedup_index import DedupIndex, example_text, find_duplicates
+
+
+def example(user, assistant):
+    return {"messages": [{"role": "system", "content": "Classify the query."},
+                         {"role": "user", "content": user}, {"role": "assistant", "content": assistant}]}
+
+
+def write_jsonl(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    return str(path)
+
+
+QUESTION = "How do I update the email address on my RBC Direct Investing account before the next statement?"
+
+
+def test_example_text_is_normalized_and_skips_the_system_prompt():
+    assert (example_text(example("How  do I update\nmy EMAIL?", "Queue 1"))
+            == example_text(example("how do i update my email", "queue 1")))
+    assert "classify" not in example_text(example("question", "answer"))
+    assert example_text(example("  ?! ", "Queue 1")) == ""
+
+
+def test_exact_near_and_leakage(tmp_path):
+    training = write_jsonl(tmp_path / "training.jsonl", [
+        example(QUESTION, "Queue 1: Account Management"),
+        example(QUESTION.upper(), "Queue 1: Account Management"),
+        example(QUESTION.replace("next", "upcoming"), "Queue 1: Account Management"),
+        example("Can I transfer my TFSA from TD to RBC?", "Queue 3: External Transfers"),
+    ])
+    validation = write_jsonl(tmp_path / "validation.jsonl", [
+        example("Can I transfer my TFSA from TD to RBC?", "Queue 3: External Transfers"),
+        example("How do I place a limit order?", "Queue 4: Trading and Withdrawals"),
+    ])
+    report = find_duplicates([training, validation], remove=True, output_dir=str(tmp_path / "out"), verbose=False)
+    assert report.within_file[(training, "exact")] == 1
+    assert report.within_file[(training, "near")] == 1
+    assert report.cross_file[(validation, training, "exact")] == 1
+    with open(report.output_paths[validation], 'r', encoding='utf-8') as f:
+        assert [json.loads(line)["messages"][1]["content"] for line in f] == ["How do I place a limit order?"]
+
+
+def test_empty_rows_are_not_duplicates(tmp_path):
+    path = write_jsonl(tmp_path / "data.jsonl", [example("", "Queue 1"), example("...", "Queue 1"), example("Hi", "")])
+    report = find_duplicates([path], verbose=False)
+    assert report.empty[path] == 3
+    assert not report.within_file[(path, "exact")] and not report.within_file[(path, "near")]
+
+
+def test_full_buckets_are_counted():
+    template = "user: list the accounts with a balance over {} and a status of closed for {}\nassistant: queue {}"
+    rows = [template.format(100 * i, name, i % 4) for i, name in enumerate(["alice", "bob", "carol", "dave", "erin"])]
+    for max_bucket_size, overflows in ((1, True), (None, False), (1000, False)):
+        index = DedupIndex(max_bucket_size=max_bucket_size)
+        for ref, text in enumerate(rows):
+            index.lookup_and_add(text, ref)
+        assert (index.bucket_overflow > 0) == overflows
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from ChatEngine.response_cache import TOUCH_EVERY, ResponseCache, cache_key
+
+QUESTION = [{"role": "user", "content": "How do I update my address?"}]
+PARAMS = {"temperature": 0}
+
+
+def test_cache_key_ignores_whitespace_and_transport_params():
+    reworded = [{"role": "user", "content": "  How do I update\nmy address? "}]
+    assert cache_key("m", QUESTION, PARAMS) == cache_key("m", reworded, {"temperature": 0, "stream": True, "user": "u"})
+    assert cache_key("m", QUESTION, PARAMS) != cache_key("m", QUESTION, {"temperature": 0, "max_tokens": 10})
+    assert cache_key("m", QUESTION, PARAMS) != cache_key("other", QUESTION, PARAMS)
+
+
+def test_only_deterministic_requests_are_cached():
+    cache = ResponseCache()
+    cache.set("m", QUESTION, {"temperature": 0.7}, "answer")
+    assert cache.get("m", QUESTION, {"temperature": 0.7}) is None
+    cache.set("m", QUESTION, PARAMS, "answer")
+    assert cache.get("m", QUESTION, PARAMS).text == "answer"
+
+
+def test_disk_hits_do_not_write_until_a_batch_is_full(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    cache.set("m", QUESTION, PARAMS, "answer")
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    for _ in range(3):
+        cache.memo.clear()
+        assert cache.get("m", QUESTION, PARAMS).text == "answer"
+    assert not [s for s in statements if s.startswith("UPDATE") or s == "COMMIT"]
+    (last_used,) = cache.touched.values()
+
+    # saved with the next write
+    cache.set("m", [{"role": "user", "content": "Another question"}], PARAMS, "answer")
+    assert not cache.touched
+    key = cache_key("m", QUESTION, PARAMS)
+    assert cache.conn.execute("SELECT last_used FROM response_cache WHERE key = ?", (key,)).fetchone() == (last_used,)
+    cache.close()
+
+
+def test_touches_are_saved_in_batches(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    for i in range(TOUCH_EVERY - 1):
+        cache._touch(bytes([i]), float(i))
+    assert len(cache.touched) == TOUCH_EVERY - 1
+    cache._touch(b"last", 0.0)
+    assert not cache.touched
+    cache.close()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+
+from ChatEngine.router import TASK_DATASETS, HashedNgramVectorizer, TaskRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return TaskRouter.from_datasets()
+
+
+def test_vectors_ignore_case_and_punctuation():
+    vectorizer = HashedNgramVectorizer()
+    vector = vectorizer.transform_one("How do I update my address?")
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert np.allclose(vector, vectorizer.transform_one("how do i update my address"))
+
+
+def test_validation_questions_go_to_their_task(router):
+    routed = correct = 0
+    for task, (_, validation_path) in TASK_DATASETS.items():
+        with open(validation_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                question = next(m["content"] for m in json.loads(line)["messages"] if m["role"] == "user")
+                routed += 1
+                correct += router.route(question).task == task
+    assert correct / routed >= 0.85
+
+
+def test_off_topic_question_keeps_the_previous_task(router):
+    assert router.route("What's the weather in Toronto tomorrow?").task is None
+    assert router.route("What's the weather in Toronto tomorrow?", previous="qna").task == "qna"
+
+
+def test_apply_replaces_the_system_message(router):
+    decision = router.route("List all accounts with a status of 'Closed'")
+    messages = TaskRouter.apply([{"role": "system", "content": "old"}, {"role": "user", "content": "hi"}], decision)
+    assert messages == [{"role": "system", "content": decision.system_prompt}, {"role": "user", "content": "hi"}]
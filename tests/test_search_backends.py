@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from ChatEngine.retrieval import read_jsonl_passages
+from ChatEngine.search_backends import DEFAULT_OFFLINE_SOURCES, OfflineIndexBackend, reference_answer
+
+
+def test_reference_answer():
+    message = {"role": "assistant", "content": "Open the menu.\nReference: [Trading](https://www.rbc.com/trade.html)"}
+    assert reference_answer(message) == ("Trading", "https://www.rbc.com/trade.html", "Open the menu.")
+    assert reference_answer({"role": "user", "content": message["content"]}) is None
+    assert reference_answer({"role": "assistant", "content": "Please call us."}) is None
+
+
+def test_offline_indexes_read_the_same_passages():
+    backend = OfflineIndexBackend.from_qna_datasets()
+    passages = {}
+    for path in DEFAULT_OFFLINE_SOURCES:
+        for passage in read_jsonl_passages(path):
+            passages.setdefault(passage["link"], (passage["title"], passage["text"]))
+    assert passages
+    assert {doc["link"]: (doc["title"], doc["snippet"]) for doc in backend.documents} == passages
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import time
+
+from ChatEngine.search_cache import SearchCache, cache_key, normalize_query
+
+
+def test_normalized_queries_share_an_entry():
+    assert normalize_query("Scotiabank dividend Q1 2024?") == normalize_query("q1 2024 scotiabank  dividend")
+    assert cache_key("Scotiabank dividend", "valueserp") != cache_key("Scotiabank dividend", "offline")
+
+
+def test_empty_results_expire_early():
+    cache = SearchCache(ttl=3600, empty_ttl=60)
+    before = time.time()
+    cache.set("nothing found", "[]")
+    cache.set("dividend", '[{"link": "https://example.com"}]')
+    assert cache.memo[cache_key("nothing found")][0] < before + 61
+    assert cache.memo[cache_key("dividend")][0] > before + 3599
+
+
+def test_disk_hits_do_not_write(tmp_path):
+    cache = SearchCache(path=str(tmp_path / "search.sqlite3"))
+    cache.set("dividend", "result")
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    for _ in range(3):
+        cache.memo.clear()
+        assert cache.get("dividend") == "result"
+    assert not [s for s in statements if s.startswith("UPDATE") or s == "COMMIT"]
+    assert cache.disk_hits == 3
+
+    cache.set("earnings", "result")
+    assert not cache.touched
+    cache.close()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from DataPrep.shard_dataset import ShardReport
+
+
+def test_savings_are_never_negative():
+    report = ShardReport("data.jsonl", [], billed_tokens_before=1000, billed_tokens_after=800, n_epochs_before=3, n_epochs=3)
+    assert report.billed_token_delta == -600
+    assert report.billed_token_savings == 600
+    # fewer examples, more default epochs: the job costs more
+    report.n_epochs = 5
+    assert report.billed_token_delta == 1000
+    assert report.billed_token_savings == 0
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from DataPrep.streaming_stats import QuantileSketch, RunningStats
+
+
+def test_sketch_quantiles_are_within_the_relative_error():
+    values = np.random.default_rng(0).integers(1, 5000, size=20_000)
+    sketch = QuantileSketch(alpha=0.01)
+    sketch.add_many(values)
+    for q in (0.05, 0.5, 0.95):
+        exact = np.quantile(values, q, method="lower")
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact + 1
+
+
+def test_merge_equals_one_pass():
+    values = np.random.default_rng(1).integers(0, 3000, size=10_000)
+    whole = RunningStats()
+    whole.add_many(values)
+    left, right = RunningStats(), RunningStats()
+    left.add_many(values[:3000])
+    for value in values[3000:]:
+        right.add(int(value))
+    left.merge(right)
+    assert (left.count, left.total, left.min, left.max) == (whole.count, whole.total, whole.min, whole.max)
+    assert left.sketch.buckets == whole.sketch.buckets
+    assert left.sketch.zero_count == whole.sketch.zero_count
+    assert [left.quantile(q) for q in (0, 0.05, 0.5, 0.95, 1)] == [whole.quantile(q) for q in (0, 0.05, 0.5, 0.95, 1)]
+
+
+def test_round_trip_through_a_dict():
+    stats = RunningStats()
+    stats.add_many([3, 5, 8, 13, 0])
+    copy = RunningStats.from_dict(stats.to_dict())
+    assert copy.to_dict() == stats.to_dict()
+    assert copy.quantile(0.5) == stats.quantile(0.5)
+    assert RunningStats().quantile(0.5) is None
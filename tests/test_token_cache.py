@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from DataPrep.token_cache import TokenCountCache
+
+
+class CountingEncoding:
+    name = "words"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_batch(self, texts, num_threads=8):
+        self.encoded.extend(texts)
+        return [text.split() for text in texts]
+
+
+def test_counts_and_in_process_memo():
+    encoding = CountingEncoding()
+    cache = TokenCountCache(encoding, path=None)
+    assert cache.count_batch(["a b c", "d", "a b c"]) == [3, 1, 3]
+    assert encoding.encoded == ["a b c", "d"]
+    assert cache.count_batch(["d", "e f"]) == [1, 2]
+    assert encoding.encoded == ["a b c", "d", "e f"]
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_counts_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "tokens.sqlite3")
+    first = TokenCountCache(CountingEncoding(), path)
+    first.count_batch(["a b c", "d"])
+    first.close()
+
+    encoding = CountingEncoding()
+    second = TokenCountCache(encoding, path)
+    assert second.count_batch(["a b c", "d", "e f"]) == [3, 1, 2]
+    assert encoding.encoded == ["e f"]
+    assert second.disk_hits == 2
+    second.close()
+
+
+def test_disk_reads_do_not_write(tmp_path):
+    path = str(tmp_path / "tokens.sqlite3")
+    TokenCountCache(CountingEncoding(), path).count_batch(["a b c"])
+    cache = TokenCountCache(CountingEncoding(), path)
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    cache.count_batch(["a b c"])
+    assert not [s for s in statements if s.startswith(("UPDATE", "INSERT")) or s == "COMMIT"]
+    assert len(cache.touched) == 1
+    cache.close()
+
+
+def test_evict_keeps_the_recently_used_counts(tmp_path):
+    cache = TokenCountCache(CountingEncoding(), str(tmp_path / "tokens.sqlite3"), max_entries=2)
+    for text in ("a", "b b", "c c c"):
+        cache.count_batch([text])
+    cache.evict()
+    assert cache.conn.execute("SELECT COUNT(*) FROM token_counts").fetchone() == (2,)
+    cache.close()
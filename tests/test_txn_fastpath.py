@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ChatEngine.txn_fastpath import TxnFastPath
+
+
+@pytest.fixture
+def fast_path(txn_store):
+    return TxnFastPath(txn_store)
+
+
+@pytest.mark.parametrize("question, reason", [
+    ("Is account 345678 opened?", "not understood: opened"),
+    ("Show account 345678", "no field"),
+    ("List account 345678", "no field"),
+    ("What is the weather like today?", "not understood: weather like today"),
+    ("List all accounts with a balance amount greater than $900,000", "no matching rows"),
+])
+def test_misses_go_to_the_model(fast_path, question, reason):
+    result = fast_path.answer(question)
+    assert not result.hit
+    assert result.reason == reason
+
+
+def test_lookup_of_one_account(fast_path):
+    result = fast_path.answer("For the account number 345678, what is the balance amount and status")
+    assert result.reason == "lookup"
+    assert result.answer == "Balance Amount: $150,000\nStatus: Closed"
+
+
+def test_list_by_status_shows_the_compared_amount(fast_path):
+    result = fast_path.answer("List all accounts with a status of 'Closed' and a withdrawal amount greater than $60,000")
+    assert result.reason == "list"
+    assert result.answer == "Account: 234567\nWithdrawal Amount: $70,000"
+
+
+def test_total(fast_path):
+    result = fast_path.answer("What is the total deposit amount for accounts with a status of 'Opened'?")
+    assert result.reason == "total"
+    assert result.answer == "Total Deposit Amount: $160,000"
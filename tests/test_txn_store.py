@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from ChatEngine.txn_store import TxnFilters, extract_filters, strip_filters
+
+
+def test_account_needs_a_reference_or_a_known_number():
+    assert extract_filters("For the account number 901234, what is the balance?").accounts == ["901234"]
+    assert extract_filters("What is the status of 345678?").accounts == []
+    assert extract_filters("What is the status of 345678?", {"345678"}).accounts == ["345678"]
+
+
+def test_numeric_filters_are_not_accounts():
+    filters = extract_filters("List all accounts with a balance amount greater than $160,000", {"160000"})
+    assert filters.accounts == []
+    assert filters.amounts == [("balance_amount", ">", 160000.0)]
+    filters = extract_filters("expected transfer days less than or equal to 20 and a status of 'Closed'")
+    assert filters.amounts == [("expected_transfer_days", "<=", 20.0)]
+    assert filters.status == "Closed"
+
+
+def test_dates_need_their_column():
+    filters = extract_filters("transfer date after February 20, 2024 and request date before 2024-03-01")
+    assert filters.dates == [("transfer_date", ">", date(2024, 2, 20)), ("request_date", "<", date(2024, 3, 1))]
+    assert extract_filters("List all accounts opened after January 15, 2024").dates == []
+
+
+def test_strip_filters_keeps_the_rest_of_the_question():
+    rest = strip_filters("List all accounts with a status of 'Closed' and a note mentioning 'customer'")
+    assert "Closed" not in rest
+    assert "note mentioning 'customer'" in rest
+
+
+def test_no_filter_sends_the_whole_table(txn_store):
+    prompt, filters, rows = txn_store.system_prompt_for("What is the total withdrawal amount?", max_rows=2)
+    assert not filters
+    assert len(rows) == len(txn_store) == 4
+    assert "incomplete" not in prompt
+
+
+def test_truncation_is_marked(txn_store):
+    prompt, filters, rows = txn_store.system_prompt_for("List all accounts with a status of 'Opened'", max_rows=1)
+    assert filters.status == "Opened"
+    assert [row.account_no for row in rows] == ["123456"]
+    assert "Only 1 of the 2 rows matching the question are shown" in prompt
+
+
+def test_or_between_filters_sends_the_whole_table(txn_store):
+    question = "Show the balance of account 123456 or accounts with a status of 'Closed'"
+    prompt, filters, rows = txn_store.system_prompt_for(question)
+    assert filters == TxnFilters()
+    assert len(rows) == 4
+
+
+def test_no_match_sends_the_whole_table(txn_store):
+    prompt, filters, rows = txn_store.system_prompt_for("What is the balance of account number 999999?")
+    assert len(rows) == 4